@@ -1,11 +1,14 @@
 from datetime import datetime, date
+import os
+import threading
 
-from flask import Flask
+from flask import Flask, Request, current_app
 from flask.json.provider import DefaultJSONProvider
 from flask_login import LoginManager
 
 from config import Config
 from app.extensions import db
+from app.uploads import create_upload_file
 
 
 # Serialize date(time)s to ISO strings.
@@ -16,17 +19,45 @@ class UpdatedJSONProvider(DefaultJSONProvider):
         return super().default(o)
 
 
+# Reject uploaded files while they're parsed out of the request, as soon as they're
+# over the limits; and parse them into the staging directory, where they can be
+# staged without being copied.
+class UploadLimitingRequest(Request):
+    def _get_file_stream(
+        self, total_content_length, content_type, filename=None, content_length=None
+    ):
+        return create_upload_file(
+            current_app.config['UPLOADS_STAGING_PATH'],
+            current_app.config['UPLOAD_MAX_FILE_SIZE'],
+            current_app.config['MEDIA_MAX_IMAGE_PIXELS'],
+        )
+
+
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.json = UpdatedJSONProvider(app)
+    app.request_class = UploadLimitingRequest
     app.config.from_object(config_class)
 
+    # Media formats Pillow can encode
+    from app.imaging import init_rendition_formats
+    init_rendition_formats(app)
+
+    os.makedirs(app.config['UPLOADS_MEDIA_PATH'], exist_ok=True)
+    os.makedirs(app.config['UPLOADS_STAGING_PATH'], exist_ok=True)
+    os.makedirs(app.config['UPLOADS_THUMBNAILS_PATH'], exist_ok=True)
+    os.makedirs(app.config['UPLOADS_RENDITIONS_PATH'], exist_ok=True)
+    os.makedirs(app.config['MEDIA_CACHE_PATH'], exist_ok=True)
+
     # Extensions
     db.init_app(app)
     login_manager = LoginManager(app)
 
     with app.app_context():
-        from app.models.post import Post, PostMedia, PostComment, Flow, PostFlow
+        from app.models.post import (
+            Post, PostMedia, MediaObject, MediaJob, MediaRendition, MediaCacheEntry,
+            MediaCacheUsage, ChunkedUpload, PostComment, Flow, PostFlow
+        )
         from app.models.user import User
         db.create_all()
 
@@ -59,4 +90,60 @@ def create_app(config_class=Config):
     from app.user import bp as user_bp
     app.register_blueprint(user_bp, url_prefix='/users')
 
+    from app.media import bp as media_bp, storage_bp
+    app.register_blueprint(media_bp, url_prefix='/media')
+    # takes precedence over the static files
+    app.register_blueprint(storage_bp, url_prefix='/static/uploads')
+
+    # Commands
+    from app.schema import db_cli
+    app.cli.add_command(db_cli)
+
+    # Metrics
+    from app.metrics import Metrics
+    metrics = app.extensions['metrics'] = Metrics('imgflow')
+    # so they can be tuned against what's actually uploaded
+    metrics.set_gauge('upload_max_request_bytes', app.config['MAX_CONTENT_LENGTH'])
+    metrics.set_gauge('upload_max_file_bytes', app.config['UPLOAD_MAX_FILE_SIZE'])
+    metrics.set_gauge('upload_max_files', app.config['UPLOAD_MAX_FILES'])
+    metrics.set_gauge('upload_max_image_pixels', app.config['MEDIA_MAX_IMAGE_PIXELS'])
+
+    # In-memory state
+    from app.view_counts import init_view_counter
+    init_view_counter(app)
+
+    from app.flow_suggestions import init_flow_suggestions
+    init_flow_suggestions(app)
+
+    # Background work, once the app serves requests: never for CLI commands
+    if app.config['BACKGROUND_WORK']:
+        background_work_started = threading.Event()
+        background_work_lock = threading.Lock()
+
+        @app.before_request
+        def start_background_work_once():
+            if background_work_started.is_set():
+                return
+            with background_work_lock:
+                if not background_work_started.is_set():
+                    start_background_work(app)
+                    background_work_started.set()
+
     return app
+
+
+def start_background_work(app: Flask) -> None:
+    """Start the media job workers of the given app, and the threads writing its
+    views and reloading its flow suggestions, as configured (see
+    `MEDIA_JOB_WORKERS`, `VIEW_COUNTER_FLUSH_INTERVAL` and
+    `FLOW_SUGGESTIONS_REFRESH_INTERVAL`)."""
+    from app.jobs import start_media_job_workers
+    start_media_job_workers(app)
+
+    counter = app.extensions['view_counter']
+    if counter.flush_interval:
+        counter.start()
+
+    suggestions = app.extensions['flow_suggestions']
+    if suggestions.refresh_interval:
+        suggestions.start()
@@ -1,11 +1,14 @@
+from collections.abc import Iterable
+from datetime import timedelta
+import hmac
 import os
-import uuid
+import time
 
 from flask import jsonify, request, current_app
 from flask_login import current_user, login_user
-from werkzeug.utils import secure_filename
-from PIL import Image, ImageFile
+from PIL import Image, UnidentifiedImageError
 import regex
+from werkzeug.exceptions import RequestEntityTooLarge
 
 from app.api import bp
 from app.dbapi import (
@@ -13,14 +16,30 @@ from app.dbapi import (
     upvote_post, remove_upvote_from_post,
     upvote_comment, remove_upvote_from_comment,
     get_comment_replies, get_public_posts_by_page, search_public_posts_by_page,
-    get_post_media, get_post_and_media,
+    get_post_media, get_post_and_media, delete_post, is_media_stored,
+    is_post_processing,
+    create_chunked_upload, get_chunked_upload, claim_chunked_upload,
+    advance_chunked_upload, finalize_chunked_upload, get_finalized_chunked_uploads,
+    consume_chunked_uploads, delete_chunked_uploads,
+    delete_expired_chunked_uploads,
     get_post_comments_by_page, PostSorting, CommentSorting,
-    get_flow, get_flows_overview, suggest_flows_by_name,
+    get_flow, get_flows_overview,
     get_public_posts_in_flow_by_page,
     create_user, is_username_taken, get_user_by_name,
     get_public_posts_from_user_by_page,
 )
-from app.models.post import Post, Flow
+from app.flow_suggestions import get_flow_suggestions
+from app.imaging import (
+    read_image_size, probe_image_size, negotiate_rendition_format, srcset
+)
+from app.jobs import run_pending_media_jobs
+from app.metrics import get_metrics
+from app.models.post import Post, Flow, ChunkedUpload
+from app.storage import MEDIA, RENDITIONS, THUMBNAILS, get_media_storage
+from app.uploads import (
+    IMAGE_PROBE_LENGTH, FileTooLarge, ImageTooLarge, StagedUpload,
+    stage_upload, write_upload_chunk, identify_staged_file
+)
 from app.models.user import User
 
 
@@ -35,16 +54,9 @@ flow_regex_pattern = regex.compile(r"""
 
 # TODO: username_regex_pattern
 
-UPLOADS_MEDIA_PATH = 'app/static/uploads/media'
-"""Where media files are stored."""
-UPLOADS_THUMBNAILS_PATH = 'app/static/uploads/thumbnails'
-"""Where autogenerated thumbnails are stored."""
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
 """The only types of media allowed to be included in posts."""
 
-MAX_THUMBNAIL_SIZE = (256, 256)
-"""The maximum size (width, height) for thumbnails, in pixels."""
-
 MAX_COMMENT_LENGTH = 2_000
 """The maximum number of characters that comments can have."""
 MAX_DESCRIPTION_LENGTH = 2_000
@@ -52,59 +64,120 @@ MAX_DESCRIPTION_LENGTH = 2_000
 
 
 def is_file_allowed(filename: str) -> bool:
-    """Return whether the given file is allowed to be included in a post."""
-    # TODO: stricter file checking
+    """Return whether the given file is allowed to be included in a post, judging by
+    its name.
+
+    This is only a quick check before reading the file; its real format is sniffed
+    while it's stored (see stage_upload()).
+    """
     return (
         '.' in filename
         and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
     )
 
 
-def randomise_filename(filename: str) -> str:
-    """Return a randomised filename with the extension from the given filename."""
-    _, extension = os.path.splitext(filename)
-    return uuid.uuid4().hex + extension
+def _remove_files(paths: Iterable[str]) -> None:
+    """Remove the files at the given paths, if they exist."""
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _staging_path(upload_id: str) -> str:
+    """Return the path of the staging file of the chunked upload of the given ID."""
+    return os.path.join(current_app.config['UPLOADS_STAGING_PATH'], upload_id)
+
+
+def _reject_upload(error: str, status: int = 400):
+    """Return an error response for a rejected upload, counting it by reason."""
+    get_metrics().increment('upload_rejections_total', reason=error)
+    return jsonify({'error': error}), status
+
+
+@bp.errorhandler(RequestEntityTooLarge)
+def handle_request_too_large(error):
+    # raised while the request is read, as soon as it's over a limit
+    if isinstance(error, FileTooLarge):
+        return _reject_upload('file_too_large', 413)
+    return _reject_upload('request_too_large', 413)
+
+
+@bp.errorhandler(ImageTooLarge)
+def handle_image_too_large(error):
+    return _reject_upload('image_too_large')
+
+
+def _page_arguments() -> tuple[int, str | None]:
+    """Return the page and the cursor a listing was requested with. The cursor, if
+    any, is the one returned in the X-Next-Cursor header of the previous page, and
+    takes precedence over the page.
+
+    Raises:
+        ValueError: if the page isn't a number.
+    """
+    return int(request.args.get('page') or 0), request.args.get('cursor') or None
+
+
+def _post_sorting(is_search: bool = False) -> PostSorting:
+    """Return the PostSorting a listing of posts was requested with.
+
+    Raises:
+        ValueError: if it isn't one, or it's only for searches and this isn't one.
+    """
+    sorting = PostSorting(request.args.get('sort'))
+    if sorting is PostSorting.RELEVANCE and not is_search:
+        raise ValueError('Only searches can be sorted by relevance')
+    return sorting
 
 
-def thumbnail_from_file(file) -> ImageFile.ImageFile:
-    """Return a thumbnail (smaller, lower quality) version of the given file."""
-    # TODO: handle invalid image
-    image = Image.open(file)
-    image.thumbnail(MAX_THUMBNAIL_SIZE)
-    return image
+def _page_headers(next_cursor: str | None) -> dict[str, str]:
+    """Return the headers of a listing's page, pointing to the next one (if any)."""
+    if next_cursor is None:
+        return {}
+    return {'X-Next-Cursor': next_cursor}
+
+
+def _server_timing(timings: dict[str, float]) -> str:
+    """Return a Server-Timing header value from the given durations (in ms)."""
+    return ', '.join(f'{name};dur={duration:.1f}' for name, duration in timings.items())
 
 
 @bp.route('/posts', methods=['GET', 'POST'])
 def api_posts():
     if request.method == 'GET':
-        page = request.args.get('page') or 0
         try:
-            page = int(page)
+            page, cursor = _page_arguments()
         except ValueError:
             return jsonify({'error': 'invalid_page'}), 400
 
+        title_query = request.args.get('title')
         try:
-            sorting = PostSorting(request.args.get('sort'))
+            sorting = _post_sorting(is_search=bool(title_query))
         except ValueError:
             return jsonify({'error': 'invalid_sort'}), 400
 
-        title_query = request.args.get('title')
-        posts = None
-        if title_query:
-            posts = search_public_posts_by_page(
-                title_query,
-                current_user.id if current_user.is_authenticated else None,
-                page,
-                sorting
-            )
-        else:
-            posts = get_public_posts_by_page(
-                current_user.id if current_user.is_authenticated else None,
-                page,
-                sorting,
-            )
+        try:
+            if title_query:
+                posts, next_cursor = search_public_posts_by_page(
+                    title_query,
+                    current_user.id if current_user.is_authenticated else None,
+                    page,
+                    sorting,
+                    cursor,
+                )
+            else:
+                posts, next_cursor = get_public_posts_by_page(
+                    current_user.id if current_user.is_authenticated else None,
+                    page,
+                    sorting,
+                    cursor,
+                )
+        except ValueError:
+            return jsonify({'error': 'invalid_cursor'}), 400
 
-        return jsonify(posts)
+        return jsonify(posts), _page_headers(next_cursor)
 
     raw_title = request.form.get('title')
     title = (raw_title.strip() or None) if raw_title else None
@@ -136,54 +209,352 @@ def api_posts():
             flows.append(flow_name)
 
 
+    # media is either uploaded along with the post, or beforehand in chunks
     uploaded_files = request.files.getlist("media_file")
+    upload_ids = request.form.getlist("upload_id")
     descriptions = request.form.getlist("description")
+    if uploaded_files and upload_ids:
+        return jsonify({'error': 'mixed_media_sources'}), 400
 
-    post_media_list = []
-    for file, description in zip(uploaded_files, descriptions):
+    if len(uploaded_files or upload_ids) > current_app.config['UPLOAD_MAX_FILES']:
+        return _reject_upload('too_many_files')
+
+    chunked_uploads = ()
+    if upload_ids:
+        chunked_uploads = get_finalized_chunked_uploads(
+            upload_ids, current_user.id if current_user.is_authenticated else None
+        )
+        if chunked_uploads is None:
+            return jsonify({'error': 'invalid_upload'}), 400
+
+    # cheap checks first, before anything is stored
+    clean_descriptions = []
+    for media_source, description in zip(uploaded_files or upload_ids, descriptions):
         clean_description = description.strip() or None
         if (
             clean_description and len(clean_description) > MAX_DESCRIPTION_LENGTH
         ):
             return jsonify({'error': 'wrong_description_length'}), 400
 
-        if not file.filename:
-            return jsonify({'error': 'file_missing_filename'}), 400
+        if not upload_ids:
+            if not media_source.filename:
+                return jsonify({'error': 'file_missing_filename'}), 400
 
-        if is_file_allowed(file.filename):
-            filename = secure_filename(randomise_filename(file.filename))
+            if not is_file_allowed(media_source.filename):
+                return _reject_upload('wrong_filetype')
 
-            media_destination = os.path.join(UPLOADS_MEDIA_PATH, filename)
-            file.save(media_destination)
+        clean_descriptions.append(clean_description)
 
-            thumbnail_destination = os.path.join(UPLOADS_THUMBNAILS_PATH, filename)
-            thumbnail = thumbnail_from_file(file)
-            thumbnail.save(thumbnail_destination)
+    if chunked_uploads and not consume_chunked_uploads(upload_ids):
+        # included in a post by a concurrent request: its staging files are theirs
+        return jsonify({'error': 'upload_consumed'}), 409
 
-            post_media_list.append({
-                'media_url': os.path.join('/static/uploads/media', filename),
-                'thumbnail_url': os.path.join('/static/uploads/thumbnails', filename),
-                'description': clean_description,
-            })
+    staging_path = current_app.config['UPLOADS_STAGING_PATH']
+    storage = get_media_storage()
+    metrics = get_metrics()
+
+    media_storing_start = time.perf_counter()
+    post_media_list = []
+    staged_uploads = []
+    new_filenames = []
+    for index, clean_description in enumerate(clean_descriptions):
+        if chunked_uploads:
+            # already sniffed and hashed when finalized
+            upload = chunked_uploads[index]
+            staged = StagedUpload(
+                f"{upload['content_hash']}.{upload['extension']}",
+                _staging_path(upload['upload_id']),
+                upload['extension'],
+                upload['content_hash'],
+                upload['size'],
+            )
         else:
-            return jsonify({'error': 'wrong_filetype'}), 400
+            # sniffed, hashed and written to disk as the request was parsed
+            staged = stage_upload(uploaded_files[index].stream, staging_path)
 
-    new_post = create_post(
-        current_user.id if current_user.is_authenticated else None,
-        title,
-        post_media_list,
-        is_public,
-        flows
-    )
-    return jsonify(new_post)
+        error = None
+        if staged is None:
+            error = 'wrong_filetype'
+        else:
+            staged_uploads.append(staged)
+            try:
+                # only the header: to reject what can't be processed, and so the
+                # dimensions are known before any image is downloaded
+                width, height = read_image_size(
+                    staged.path, current_app.config['MEDIA_MAX_IMAGE_PIXELS']
+                )
+            except UnidentifiedImageError:
+                error = 'wrong_filetype'
+            except Image.DecompressionBombError:
+                error = 'image_too_large'
+
+        if error:
+            # nothing was stored yet (but chunked uploads were consumed already)
+            if chunked_uploads:
+                _remove_files(_staging_path(upload_id) for upload_id in upload_ids)
+            else:
+                _remove_files(staged.path for staged in staged_uploads)
+            return _reject_upload(error)
+
+        metrics.observe('upload_file_bytes', staged.size)
+        metrics.observe('upload_image_pixels', width * height)
+        post_media_list.append({
+            'media_url': storage.url(MEDIA, staged.filename),
+            'thumbnail_url': storage.url(THUMBNAILS, staged.filename),
+            'description': clean_description,
+            'content_hash': staged.content_hash,
+            'extension': staged.extension,
+            'size': staged.size,
+            'width': width,
+            'height': height,
+        })
+
+    already_stored = []
+    for staged in staged_uploads:
+        if staged.filename in new_filenames:
+            _remove_files([staged.path])
+        # files are named after their contents, so a known file is stored already
+        elif is_media_stored(staged.content_hash):
+            already_stored.append(staged)
+        else:
+            new_filenames.append(staged.filename)
+            storage.put(MEDIA, staged.filename, staged.path)
+
+    timings = {'media-store': (time.perf_counter() - media_storing_start) * 1000}
+
+    # new files' thumbnails and renditions are generated by media jobs
+    flow_suggestions = get_flow_suggestions()
+    with flow_suggestions.changing_posts():
+        new_post = create_post(
+            current_user.id if current_user.is_authenticated else None,
+            title,
+            post_media_list,
+            is_public,
+            flows
+        )
+        flow_suggestions.add_posts(new_post['flow_names'])
+    for staged in already_stored:
+        # referenced now, so it can't be deleted anymore; but it might have been,
+        # by a post deleted since it was found (see delete_post())
+        if storage.exists(MEDIA, staged.filename):
+            _remove_files([staged.path])
+        else:
+            storage.put(MEDIA, staged.filename, staged.path)
+
+    if current_app.config['MEDIA_JOB_WORKERS'] == 0:
+        # no background workers: process them right now, in parallel
+        media_processing_start = time.perf_counter()
+        durations = run_pending_media_jobs()
+        for index, media_item in enumerate(post_media_list):
+            duration = durations.pop(media_item['content_hash'], None)
+            if duration is not None:
+                timings[f'media-{index}'] = duration
+        timings['media-total'] = (time.perf_counter() - media_processing_start) * 1000
+
+        new_post['is_processing'] = is_post_processing(new_post['post_id'])
 
+    return jsonify(new_post), {'Server-Timing': _server_timing(timings)}
 
-@bp.route('/posts/<post_id>')
+
+@bp.route('/posts/<post_id>', methods=['GET', 'DELETE'])
 def api_post(post_id):
     if len(post_id) != Post.POST_ID_LENGTH:
         return '', 404;
-    post = get_post_and_media(post_id, current_user.id)
-    return jsonify(post)
+
+    if request.method == 'GET':
+        post = get_post_and_media(
+            post_id,
+            current_user.id if current_user.is_authenticated else None
+        )
+        if post:
+            rendition_format = negotiate_rendition_format(
+                request.accept_mimetypes,
+                current_app.config['MEDIA_RENDITION_FORMATS'],
+            )
+            for media_item in post['media']:
+                media_item['srcset'] = srcset(media_item['renditions'], rendition_format)
+
+        return jsonify(post), {'Vary': 'Accept'}
+
+    if not current_user.is_authenticated:
+        return current_app.login_manager.unauthorized()
+
+    storage = get_media_storage()
+
+    def delete_media_files(unused_media):
+        # only once no post references them anymore
+        for media_item in unused_media:
+            filename = media_item['filename']
+            storage.delete(MEDIA, filename)
+            storage.delete(THUMBNAILS, filename)
+            for rendition_filename in media_item['rendition_filenames']:
+                storage.delete(RENDITIONS, rendition_filename)
+
+    flow_suggestions = get_flow_suggestions()
+    with flow_suggestions.changing_posts():
+        flow_names = delete_post(post_id, current_user.id, delete_media_files)
+        if flow_names is None:
+            return '', 404
+        flow_suggestions.add_posts(flow_names, -1)
+
+    return '', 204
+
+
+@bp.route('/uploads', methods=['POST'])
+def api_uploads():
+    try:
+        filename = request.json['filename']
+        size = request.json['size']
+    except KeyError:
+        return jsonify({'error': 'missing_upload_info'}), 400
+
+    if not isinstance(filename, str) or not is_file_allowed(filename):
+        return _reject_upload('wrong_filetype')
+
+    if not isinstance(size, int) or size <= 0:
+        return jsonify({'error': 'invalid_size'}), 400
+
+    if size > current_app.config['UPLOAD_MAX_FILE_SIZE']:
+        return _reject_upload('file_too_large', 413)
+
+    # cheap, and keeps abandoned uploads from piling up
+    expired_upload_ids = delete_expired_chunked_uploads(
+        timedelta(seconds=current_app.config['UPLOAD_EXPIRY'])
+    )
+    _remove_files(_staging_path(upload_id) for upload_id in expired_upload_ids)
+
+    upload_id = create_chunked_upload(
+        current_user.id if current_user.is_authenticated else None,
+        size
+    )
+    open(_staging_path(upload_id), 'xb').close()
+
+    return jsonify({'upload_id': upload_id, 'offset': 0}), 201
+
+
+@bp.route('/uploads/<upload_id>', methods=['GET', 'PATCH', 'DELETE'])
+def api_upload(upload_id):
+    if len(upload_id) != ChunkedUpload.UPLOAD_ID_LENGTH:
+        return '', 404
+
+    upload = get_chunked_upload(
+        upload_id,
+        current_user.id if current_user.is_authenticated else None
+    )
+    if upload is None:
+        return '', 404
+
+    if request.method == 'GET':
+        # where to resume from
+        return jsonify({
+            'upload_id': upload_id,
+            'size': upload['size'],
+            'offset': upload['offset'],
+            'is_finalized': upload['content_hash'] is not None,
+        })
+
+    if request.method == 'DELETE':
+        delete_chunked_uploads([upload_id])
+        _remove_files([_staging_path(upload_id)])
+        return '', 204
+
+    if upload['content_hash'] is not None:
+        return jsonify({'error': 'upload_finalized'}), 409
+
+    try:
+        offset = int(request.headers['Upload-Offset'])
+    except (KeyError, ValueError):
+        return jsonify({'error': 'invalid_offset'}), 400
+
+    if offset != upload['offset']:
+        # e.g. a retried chunk that did arrive: the client should resume from here
+        return jsonify({'error': 'wrong_offset', 'offset': upload['offset']}), 409
+
+    remaining = upload['size'] - offset
+    if request.content_length is not None and request.content_length > remaining:
+        return jsonify({'error': 'chunk_too_large'}), 413
+
+    # before anything is written, so concurrent chunks never write over each other
+    stale_after = timedelta(seconds=current_app.config['UPLOAD_CHUNK_TIMEOUT'])
+    if not claim_chunked_upload(upload_id, offset, stale_after):
+        return jsonify({'error': 'concurrent_chunk'}), 409
+
+    try:
+        written, is_complete = write_upload_chunk(
+            request.stream, _staging_path(upload_id), offset, remaining
+        )
+    except ValueError:
+        advance_chunked_upload(upload_id, offset)
+        return jsonify({'error': 'chunk_too_large'}), 413
+
+    advance_chunked_upload(upload_id, offset + written)
+
+    if offset == 0:
+        # the header is in the first chunk: no need to wait for the rest of an image
+        # that's too big to be processed
+        with open(_staging_path(upload_id), 'rb') as staged:
+            header = staged.read(IMAGE_PROBE_LENGTH)
+        try:
+            probe_image_size(header, current_app.config['MEDIA_MAX_IMAGE_PIXELS'])
+        except Image.DecompressionBombError:
+            delete_chunked_uploads([upload_id])
+            _remove_files([_staging_path(upload_id)])
+            return _reject_upload('image_too_large')
+
+    if not is_complete:
+        return jsonify({'error': 'chunk_incomplete', 'offset': offset + written}), 400
+
+    return jsonify({'offset': offset + written})
+
+
+@bp.route('/uploads/<upload_id>/finalize', methods=['POST'])
+def api_finalize_upload(upload_id):
+    if len(upload_id) != ChunkedUpload.UPLOAD_ID_LENGTH:
+        return '', 404
+
+    upload = get_chunked_upload(
+        upload_id,
+        current_user.id if current_user.is_authenticated else None
+    )
+    if upload is None:
+        return '', 404
+
+    if upload['content_hash'] is None:
+        if upload['offset'] != upload['size']:
+            return jsonify({
+                'error': 'upload_incomplete', 'offset': upload['offset']
+            }), 400
+
+        staging_path = _staging_path(upload_id)
+        identified = identify_staged_file(staging_path)
+        error = None
+        if identified is None:
+            error = 'wrong_filetype'
+        else:
+            try:
+                # only the header, to reject what can't be processed
+                read_image_size(
+                    staging_path, current_app.config['MEDIA_MAX_IMAGE_PIXELS']
+                )
+            except UnidentifiedImageError:
+                error = 'wrong_filetype'
+            except Image.DecompressionBombError:
+                error = 'image_too_large'
+
+        if error:
+            delete_chunked_uploads([upload_id])
+            _remove_files([staging_path])
+            return _reject_upload(error)
+
+        extension, content_hash = identified
+        finalize_chunked_upload(upload_id, content_hash, extension)
+        upload['content_hash'] = content_hash
+
+    return jsonify({
+        'upload_id': upload_id,
+        'size': upload['size'],
+        'content_hash': upload['content_hash'],
+    })
 
 
 @bp.route('/posts/<post_id>/upvote', methods=['POST', 'DELETE'])
@@ -208,9 +579,8 @@ def api_post_comments(post_id):
     # TODO: check if post id exists
 
     if request.method == 'GET':
-        page = request.args.get('page') or 0
         try:
-            page = int(page)
+            page, cursor = _page_arguments()
         except ValueError:
             return jsonify({'error': 'invalid_page'}), 400
 
@@ -219,13 +589,18 @@ def api_post_comments(post_id):
         except ValueError:
             return jsonify({'error': 'invalid_sort'}), 400
 
-        comments = get_post_comments_by_page(
-            post_id,
-            current_user.id if current_user.is_authenticated else None,
-            page,
-            sorting
-        )
-        return jsonify(comments)
+        try:
+            comments, next_cursor = get_post_comments_by_page(
+                post_id,
+                current_user.id if current_user.is_authenticated else None,
+                page,
+                sorting,
+                cursor,
+            )
+        except ValueError:
+            return jsonify({'error': 'invalid_cursor'}), 400
+
+        return jsonify(comments), _page_headers(next_cursor)
 
     if not current_user.is_authenticated:
         return current_app.login_manager.unauthorized()
@@ -251,7 +626,7 @@ def api_vote_comment(post_id, comment_id):
     # TODO: check if post id and comment id exist
 
     if request.method == 'POST':
-        upvote_comment(comment_id, current_user.id)
+        upvote_comment(post_id, comment_id, current_user.id)
     elif request.method == 'DELETE':
         remove_upvote_from_comment(post_id, comment_id, current_user.id)
 
@@ -302,7 +677,7 @@ def api_flow_suggestions():
     if not partial_name:
         return jsonify({'error':'missing_name'}), 400
 
-    return jsonify(suggest_flows_by_name(partial_name))
+    return jsonify(get_flow_suggestions().suggest(partial_name))
 
 
 @bp.route('/flows')
@@ -332,14 +707,13 @@ def api_flow(flow_name):
 
 @bp.route('/flows/<flow_name>/posts')
 def api_posts_in_flow(flow_name):
-    page = request.args.get('page') or 0
     try:
-        page = int(page)
+        page, cursor = _page_arguments()
     except ValueError:
         return jsonify({'error': 'invalid_page'}), 400
 
     try:
-        sorting = PostSorting(request.args.get('sort'))
+        sorting = _post_sorting()
     except ValueError:
         return jsonify({'error': 'invalid_sort'}), 400
 
@@ -354,13 +728,18 @@ def api_posts_in_flow(flow_name):
     if not flow:
         return jsonify(None), 404
 
-    posts = get_public_posts_in_flow_by_page(
-        flow['id'],
-        current_user.id if current_user.is_authenticated else None,
-        page,
-        sorting
-    )
-    return jsonify(posts)
+    try:
+        posts, next_cursor = get_public_posts_in_flow_by_page(
+            flow['id'],
+            current_user.id if current_user.is_authenticated else None,
+            page,
+            sorting,
+            cursor,
+        )
+    except ValueError:
+        return jsonify({'error': 'invalid_cursor'}), 400
+
+    return jsonify(posts), _page_headers(next_cursor)
 
 
 # -- authentication --
@@ -403,14 +782,13 @@ def api_create_user():
 
 @bp.route('/users/<username>/posts')
 def api_user_posts(username):
-    page = request.args.get('page') or 0
     try:
-        page = int(page)
+        page, cursor = _page_arguments()
     except ValueError:
         return jsonify({'error': 'invalid_page'}), 400
 
     try:
-        sorting = PostSorting(request.args.get('sort'))
+        sorting = _post_sorting()
     except ValueError:
         return jsonify({'error': 'invalid_sort'}), 400
 
@@ -425,13 +803,18 @@ def api_user_posts(username):
     if not user:
         return jsonify({'error': 'user_not_found'}), 404
 
-    posts = get_public_posts_from_user_by_page(
-        user.id,
-        current_user.id if current_user.is_authenticated else None,
-        page,
-        sorting
-    )
-    return jsonify(posts)
+    try:
+        posts, next_cursor = get_public_posts_from_user_by_page(
+            user.id,
+            current_user.id if current_user.is_authenticated else None,
+            page,
+            sorting,
+            cursor,
+        )
+    except ValueError:
+        return jsonify({'error': 'invalid_cursor'}), 400
+
+    return jsonify(posts), _page_headers(next_cursor)
 
 
 @bp.route('/usernames/<username>')
@@ -470,3 +853,15 @@ def api_login():
 
     login_user(user, remember=True)
     return '', 204
+
+
+@bp.route('/metrics')
+def api_metrics():
+    # only for scrapers: as if there was nothing here for anyone else
+    token = current_app.config['METRICS_TOKEN']
+    if not token or not hmac.compare_digest(
+        request.headers.get('Authorization', ''), f'Bearer {token}'
+    ):
+        return '', 404
+
+    return get_metrics().render(), {'Content-Type': 'text/plain; version=0.0.4'}
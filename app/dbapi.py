@@ -1,10 +1,23 @@
-from collections.abc import Iterable, Sequence
+import base64
+from collections import Counter
+from collections.abc import Callable, Iterable, Mapping, Sequence
+from datetime import datetime, timedelta, timezone
 from enum import Enum
+import functools
+import json
+import re
+import secrets
 from typing import Any
 
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.exc import IntegrityError
+
 from app.extensions import db
 from app.models.post import (
-    Post, PostMedia, PostComment, Flow, PostUpvote, CommentUpvote, PostFlow
+    Post, PostMedia, MediaObject, MediaJob, MediaRendition, MediaCacheEntry,
+    MediaCacheUsage, ChunkedUpload, PostComment, Flow, PostUpvote, CommentUpvote,
+    PostFlow,
+    POST_TITLE_SEARCH
 )
 from app.models.user import User
 
@@ -12,7 +25,12 @@ from app.models.user import User
 POSTS_PER_PAGE = 20
 COMMENTS_PER_PAGE = 30
 FLOWS_IN_OVERVIEW = 8
-FLOW_SUGGESTIONS_LIMIT = 8
+MEDIA_CACHE_TOUCH_INTERVAL = timedelta(minutes=10)
+"""How stale a media cache entry's last use can get before it's updated; this keeps
+cache hits from writing to the database every time."""
+MEDIA_CACHE_LOW_WATERMARK = 0.9
+"""When the media cache is evicted, it shrinks to this fraction of its maximum size,
+so that it isn't evicted again on every new entry."""
 
 
 def create_post(
@@ -30,7 +48,10 @@ def create_post(
         title: The title of the post. Must not exceed Post.MAX_NAME_LENGTH
             characters. If None, no title will be added.
         media_list: Collection of dicts containing the media's URL
-            ('media_url') and a description ('description') of optional value.
+            ('media_url'), a description ('description') of optional value, and the
+            stored file's hash ('content_hash'), extension ('extension'), size in
+            bytes ('size') and dimensions in pixels ('width' and 'height'). New
+            files are queued to be processed (see MediaJob).
         is_public: If True, the post will show up on public feeds.
         flow_names: Collection of Flows the post will be in. Its length
             must not exceed Post.MAX_FLOWS_PER_POST.
@@ -40,14 +61,23 @@ def create_post(
         however, will be 'flow_names' instead, containing the names of the
         Flows this post is in.
     """
+    is_processing = False
     media: list[PostMedia] = []
     for media_item in media_list:
         description = media_item['description']
 
+        is_processing |= _acquire_media_object(
+            media_item['content_hash'],
+            media_item['extension'],
+            media_item['size'],
+            media_item['width'],
+            media_item['height'],
+        )
         media.append(
             PostMedia(
                 media_url=media_item['media_url'],
-                description=(description if description else None)
+                description=(description if description else None),
+                content_hash=media_item['content_hash'],
             )
         )
 
@@ -67,8 +97,13 @@ def create_post(
 
     # TODO: check if failed because of post_id collision
     post = Post(user_id, title, media, media_list[0]['thumbnail_url'], is_public, flows)
+    post.is_processing = is_processing
+    post.cover_hash = media_list[0]['content_hash']
 
     db.session.add(post)
+    if flows:
+        db.session.flush()
+        _offer_flows_top_post(post.post_id)
     db.session.commit()
 
     return {
@@ -81,10 +116,321 @@ def create_post(
         'comment_count': post.comment_count,
         'views':         post.views,
         'is_public':     post.is_public,
+        'is_processing': post.is_processing,
         'flow_names':    tuple(flow.name for flow in post.flows),
     }
 
 
+def import_posts(posts: Sequence[dict[str, Any]]) -> list[str]:
+    """Create many posts in the database at once, in a single transaction, with
+    media files that were already stored and processed (see app.imports).
+
+    Unlike create_post(), stored files, flows and counts are looked up and updated
+    once per batch rather than once per post.
+
+    Args:
+        posts: Dicts with the same keys as create_post()'s arguments ('user_id',
+            'title', 'media_list', 'is_public' and 'flow_names'). Each media item
+            also has the 'renditions', 'placeholder' and 'dominant_color' its file
+            was processed into (see imaging.process_media()), which are only
+            recorded if the file is new.
+
+    Returns:
+        The IDs of the new posts, in the same order.
+    """
+    media_items = [
+        media_item for post in posts for media_item in post['media_list']
+    ]
+    reference_counts = Counter(
+        media_item['content_hash'] for media_item in media_items
+    )
+    media_objects = {
+        media_object.content_hash: media_object
+        for media_object in db.session.execute(
+            db.select(
+                MediaObject
+            ).where(
+                MediaObject.content_hash.in_(reference_counts)
+            )
+        ).scalars()
+    }
+    for content_hash, count in reference_counts.items():
+        if content_hash in media_objects:
+            db.session.execute(
+                db.update(MediaObject)
+                    .where(MediaObject.content_hash == content_hash)
+                    .values(ref_count=MediaObject.ref_count + count)
+            )
+
+    for media_item in media_items:
+        if media_item['content_hash'] in media_objects:
+            continue
+
+        media_object = MediaObject(
+            media_item['content_hash'],
+            media_item['extension'],
+            media_item['size'],
+            media_item['width'],
+            media_item['height'],
+        )
+        media_object.ref_count = reference_counts[media_item['content_hash']]
+        media_object.renditions = [
+            MediaRendition(
+                rendition['width'],
+                rendition['height'],
+                rendition['format'],
+                rendition['filename'],
+            ) for rendition in media_item['renditions']
+        ]
+        media_object.placeholder = media_item['placeholder']
+        media_object.dominant_color = media_item['dominant_color']
+        media_objects[media_object.content_hash] = media_object
+        db.session.add(media_object)
+
+    flow_counts = Counter(
+        flow_name
+        for post in posts if post['is_public']
+        for flow_name in post['flow_names']
+    )
+    flows = {
+        flow.name: flow
+        for flow in db.session.execute(
+            db.select(
+                Flow
+            ).where(
+                Flow.name.in_(flow_counts)
+            )
+        ).scalars()
+    }
+    for flow_name, count in flow_counts.items():
+        if flow_name in flows:
+            db.session.execute(
+                db.update(Flow)
+                    .where(Flow.id == flows[flow_name].id)
+                    .values(post_count=Flow.post_count + count)
+            )
+        else:
+            # new flow: let's create it
+            flow = Flow(name=flow_name)
+            flow.post_count = count
+            flows[flow_name] = flow
+            db.session.add(flow)
+
+    new_posts = []
+    for post in posts:
+        media_list = post['media_list']
+        new_post = Post(
+            post['user_id'],
+            post['title'],
+            [
+                PostMedia(
+                    media_url=media_item['media_url'],
+                    description=media_item['description'] or None,
+                    content_hash=media_item['content_hash'],
+                ) for media_item in media_list
+            ],
+            media_list[0]['thumbnail_url'],
+            post['is_public'],
+            [flows[flow_name] for flow_name in post['flow_names']]
+                if post['is_public'] else [],
+        )
+        # only files that were already being processed by a media job
+        new_post.is_processing = any(
+            media_objects[media_item['content_hash']].is_processing
+            for media_item in media_list
+        )
+        new_post.cover_hash = media_list[0]['content_hash']
+        new_posts.append(new_post)
+
+    db.session.add_all(new_posts)
+    if flows:
+        db.session.flush()
+        _update_flow_top_posts(Flow.id.in_([flow.id for flow in flows.values()]))
+    db.session.commit()
+
+    return [post.post_id for post in new_posts]
+
+
+def delete_post(
+    post_id: str,
+    user_id: int,
+    delete_media_files: Callable[[tuple[dict[str, Any], ...]], None],
+) -> tuple[str, ...] | None:
+    """Delete a post made by the given user, along with its comments, upvotes and
+    media items, and remove it from its flows.
+
+    Args:
+        delete_media_files: Called with the stored media files which are no longer
+            used by any post (see _release_media_objects()), to delete them before
+            the deletion is committed: until then, a new post with one of them
+            waits to reference it, and then finds it gone, and stores it again (see
+            api.routes.api_posts()).
+
+    Returns:
+        The names of the Flows the post was in; or None if there's no such post by
+        that user.
+    """
+    post = db.session.execute(
+        db.select(
+            Post
+        ).where(
+            Post.post_id == post_id,
+            Post.user_id == user_id,
+        )
+    ).scalar_one_or_none()
+
+    if not post:
+        return None
+
+    comment_ids = db.select(PostComment.id).where(PostComment.post_id == post_id)
+    db.session.execute(
+        db.delete(CommentUpvote).where(CommentUpvote.comment_id.in_(comment_ids))
+    )
+    db.session.execute(db.delete(PostComment).where(PostComment.post_id == post_id))
+    db.session.execute(db.delete(PostUpvote).where(PostUpvote.post_id == post_id))
+
+    flow_names = tuple(flow.name for flow in post.flows)
+    for flow in post.flows:
+        _decrement_flow_post_count(flow.id)
+    post.flows = []
+    db.session.flush()
+    _update_flow_top_posts(Flow.top_post_id == post.id)
+
+    content_hashes = []
+    for media_item in post.media:
+        if media_item.content_hash is not None:
+            content_hashes.append(media_item.content_hash)
+        db.session.delete(media_item)
+    db.session.delete(post)
+
+    unused_media = _release_media_objects(content_hashes)
+    db.session.flush()
+    delete_media_files(unused_media)
+    db.session.commit()
+
+    return flow_names
+
+
+def get_stored_media_hashes(content_hashes: Iterable[str]) -> set[str]:
+    """Return which of the given content hashes belong to media files that are
+    already stored."""
+    return set(db.session.execute(
+        db.select(
+            MediaObject.content_hash
+        ).where(
+            MediaObject.content_hash.in_(content_hashes)
+        )
+    ).scalars())
+
+
+def is_media_stored(content_hash: str) -> bool:
+    """Return whether a media file with the given content hash is already stored
+    (along with its thumbnail).
+    """
+    return db.session.execute(
+        db.select(
+            MediaObject.content_hash
+        ).where(
+            MediaObject.content_hash == content_hash
+        )
+    ).scalar() is not None
+
+
+def is_post_processing(post_id: str) -> bool:
+    """Return whether any of a post's media files are still being processed."""
+    return db.session.execute(
+        db.select(
+            Post.is_processing
+        ).where(
+            Post.post_id == post_id
+        )
+    ).scalar_one()
+
+
+def _acquire_media_object(
+    content_hash: str, extension: str, size: int, width: int, height: int
+) -> bool:
+    """Add a reference to the stored media file with the given hash, recording it and
+    queueing it to be processed if it's new.
+
+    The row is inserted first, skipping it if it exists, and only then updated:
+    concurrent first uploads of the same file then can't both insert it.
+
+    Returns:
+        Whether the file is still being processed.
+    """
+    result = db.session.execute(
+        _insert_ignoring_duplicates(MediaObject).values(
+            content_hash=content_hash,
+            extension=extension,
+            size=size,
+            width=width,
+            height=height,
+            ref_count=1,
+            is_processing=True,
+        )
+    )
+    if result.rowcount == 1:
+        job = MediaJob()
+        job.content_hash = content_hash
+        db.session.add(job)
+        return True
+
+    db.session.execute(
+        db.update(MediaObject)
+            .where(MediaObject.content_hash == content_hash)
+            .values(ref_count=MediaObject.ref_count + 1)
+    )
+    return db.session.execute(
+        db.select(
+            MediaObject.is_processing
+        ).where(
+            MediaObject.content_hash == content_hash
+        )
+    ).scalar_one()
+
+
+def _release_media_objects(
+    content_hashes: Sequence[str]
+) -> tuple[dict[str, Any], ...]:
+    """Remove a reference to each of the stored media files with the given hashes,
+    forgetting the ones that aren't referenced anymore.
+
+    Returns:
+        The media files that aren't referenced anymore, as dicts with their
+        filename ('filename') and the filenames of their renditions
+        ('rendition_filenames').
+    """
+    for content_hash in content_hashes:
+        db.session.execute(
+            db.update(MediaObject)
+                .where(MediaObject.content_hash == content_hash)
+                .values(ref_count=MediaObject.ref_count - 1)
+        )
+
+    unused = db.session.execute(
+        db.select(
+            MediaObject
+        ).where(
+            MediaObject.content_hash.in_(set(content_hashes)),
+            MediaObject.ref_count <= 0,
+        )
+    ).scalars().all()
+
+    unused_media = tuple(
+        {
+            'filename': media_object.filename,
+            'rendition_filenames': tuple(
+                rendition.filename for rendition in media_object.renditions
+            ),
+        } for media_object in unused
+    )
+    for media_object in unused:
+        db.session.delete(media_object)
+
+    return unused_media
+
+
 def comment_on_post(post_id: str, user_id: int, content: str) -> dict[str, Any]:
     """Comment on a post.
 
@@ -159,177 +505,210 @@ def _rows_to_dicts(rows: Iterable) -> tuple[dict[str, Any], ...]:
     return tuple(row._asdict() for row in rows)
 
 
+def _add_post_upvote_states(
+    posts: tuple[dict[str, Any], ...], current_user_id: int | None
+) -> tuple[dict[str, Any], ...]:
+    """Add whether each of the given posts was upvoted by the logged in user of the
+    given ID ('has_upvote'; always False if None) to their dicts, and return them.
+
+    Their upvotes are fetched at once, rather than looked up for each post.
+    """
+    upvoted_post_ids = set()
+    if current_user_id is not None and posts:
+        upvoted_post_ids = set(db.session.execute(
+            db.select(
+                PostUpvote.post_id
+            ).where(
+                PostUpvote.user_id == current_user_id,
+                PostUpvote.post_id.in_([post['post_id'] for post in posts]),
+            )
+        ).scalars())
+
+    for post in posts:
+        post['has_upvote'] = post['post_id'] in upvoted_post_ids
+    return posts
+
+
+def _add_comment_upvote_states(
+    comments: tuple[dict[str, Any], ...], current_user_id: int | None
+) -> tuple[dict[str, Any], ...]:
+    """Add whether each of the given comments was upvoted by the logged in user of
+    the given ID ('has_upvote'; always False if None) to their dicts, and return
+    them.
+
+    Their upvotes are fetched at once, rather than looked up for each comment.
+    """
+    upvoted_comment_ids = set()
+    if current_user_id is not None and comments:
+        upvoted_comment_ids = set(db.session.execute(
+            db.select(
+                CommentUpvote.comment_id
+            ).where(
+                CommentUpvote.user_id == current_user_id,
+                CommentUpvote.comment_id.in_([comment['id'] for comment in comments]),
+            )
+        ).scalars())
+
+    for comment in comments:
+        comment['has_upvote'] = comment['id'] in upvoted_comment_ids
+    return comments
+
+
 class PostSorting(Enum):
     """Sorting options when fetching posts."""
     NEWEST = 'newest'
     """Sorts posts by most recently created first."""
     TOP = 'top'
     """Sorts posts by highest score first."""
+    RELEVANCE = 'relevance'
+    """Sorts posts by how well their title matches the searched one first. Only for
+    searches (see search_public_posts_by_page())."""
 
 
 def get_public_posts_by_page(
     current_user_id: int | None,
     page: int,
-    sorting: PostSorting
-) -> tuple[dict[str, Any], ...]:
+    sorting: PostSorting,
+    cursor: str | None = None,
+) -> tuple[tuple[dict[str, Any], ...], str | None]:
     """Return a sorted and paginated collection of Posts as dicts, including upvote
-    state.
+    state, and the cursor of the next page (see _fetch_page()).
 
     Attributes:
         current_user_id: The current logged in user's ID. If None (logged out), upvote
             states will always be False.
-        page: The page to fetch.
+        page: The page to fetch, if there's no cursor.
         sorting: The PostSorting option to use.
+        cursor: Where the previous page ended.
     """
-    statement = db.select(
-            Post.post_id,
-            Post.title,
-            Post.thumbnail_url,
-            Post.created_on,
-            Post.updated_on,
-            Post.score,
-            Post.comment_count,
-            Post.views,
-        ).where(
-            Post.is_public == True
-        )
-
-    if current_user_id is None:
-        statement = statement.add_columns(
-            db.literal(False).label('has_upvote')
-        )
-    else:
-        statement = statement.add_columns(
-            db.exists().where(
-                (PostUpvote.post_id == Post.post_id)
-                & (PostUpvote.user_id == current_user_id)
-            ).label('has_upvote')
-        )
-
-    match sorting:
-        case PostSorting.NEWEST:
-            statement = statement.order_by(Post.created_on.desc())
-        case PostSorting.TOP:
-            statement = statement.order_by(
-                Post.score.desc(),
-                Post.created_on.desc(),
-            )
-
-    statement = statement.limit(
-            POSTS_PER_PAGE
-        ).offset(
-            page*POSTS_PER_PAGE
-        )
-
-    result = db.session.execute(statement)
-    return _rows_to_dicts(result)
+    posts, next_cursor = _fetch_page(
+        'public_posts', sorting, page, cursor, POSTS_PER_PAGE
+    )
+    return _add_post_upvote_states(posts, current_user_id), next_cursor
 
 
 def search_public_posts_by_page(
     title: str,
     current_user_id: int | None,
     page: int,
-    sorting: PostSorting
-) -> tuple[dict[str, Any], ...]:
+    sorting: PostSorting,
+    cursor: str | None = None,
+) -> tuple[tuple[dict[str, Any], ...], str | None]:
     """Return a sorted and paginated collection of Posts as dicts, filtered by title,
-    including whether they were upvoted or not.
+    including whether they were upvoted or not, and the cursor of the next page (see
+    _fetch_page()).
 
     Attributes:
-        title: The title to search for.
+        title: The title to search for: posts match if their title has each of its
+            words, or words starting with them (see _full_text_query()).
         current_user_id: The current logged in user's ID. If None (logged out), upvote
             states will always be False.
-        page: The page to fetch.
+        page: The page to fetch, if there's no cursor.
         sorting: The PostSorting option to use.
+        cursor: Where the previous page ended.
     """
-    statement = db.select(
-            Post.post_id,
-            Post.title,
-            Post.thumbnail_url,
-            Post.created_on,
-            Post.updated_on,
-            Post.score,
-            Post.comment_count,
-            Post.views,
-        ).where(
-            Post.is_public == True,
-            Post.title.icontains(title)
-        )
-
-    if current_user_id is None:
-        statement = statement.add_columns(
-            db.literal(False).label('has_upvote')
-        )
-    else:
-        statement = statement.add_columns(
-            db.exists().where(
-                (PostUpvote.post_id == Post.post_id)
-                & (PostUpvote.user_id == current_user_id)
-            ).label('has_upvote')
-        )
-
-    match sorting:
-        case PostSorting.NEWEST:
-            statement = statement.order_by(Post.created_on.desc())
-        case PostSorting.TOP:
-            statement = statement.order_by(
-                Post.score.desc(),
-                Post.created_on.desc(),
-            )
-
-    statement = statement.limit(
-            POSTS_PER_PAGE
-        ).offset(
-            page*POSTS_PER_PAGE
-        )
+    query = _full_text_query(title)
+    if query is None:
+        # no words to search for
+        return (), None
 
-    result = db.session.execute(statement)
-    return _rows_to_dicts(result)
+    posts, next_cursor = _fetch_page(
+        'searched_posts', sorting, page, cursor, POSTS_PER_PAGE, title=query
+    )
+    return _add_post_upvote_states(posts, current_user_id), next_cursor
 
 
-def get_post_media(post_id: str) -> tuple[dict[str, str], ...]:
-    """Return all of a Post's media as dicts."""
+def get_post_media(post_id: str) -> tuple[dict[str, Any], ...]:
+    """Return all of a Post's media as dicts, with their URL, description, and
+    their file's dimensions, size and format (None for files uploaded before these
+    were recorded)."""
     result = db.session.execute(
         db.select(
             PostMedia.media_url,
             PostMedia.description,
+            MediaObject.width,
+            MediaObject.height,
+            MediaObject.size,
+            MediaObject.extension.label('format'),
+        ).outerjoin(
+            MediaObject,
+            MediaObject.content_hash == PostMedia.content_hash
         ).where(PostMedia.post_id == post_id)
     )
     return _rows_to_dicts(result)
 
 
 def get_post_and_media(post_id: str, current_user_id: int | None) -> dict[str, Any]:
-    """Return a Post and all of its media (their URL and description) as dicts,
-    including whether it was upvoted by the logged in user of the given current ID.
+    """Return a Post and all of its media (their URL, description, placeholder,
+    dimensions, size, format and renditions) as dicts, including whether it was
+    upvoted by the logged in user of the given current ID.
+
+    It's all fetched in one query, as this is what every post page needs.
     """
-    post = db.session.execute(
+    if current_user_id is None:
+        has_upvote = db.literal(False)
+    else:
+        has_upvote = db.exists().where(
+            (PostUpvote.post_id == Post.post_id)
+            & (PostUpvote.user_id == current_user_id)
+        )
+
+    row = db.session.execute(
         db.select(
-            Post
+            Post,
+            User.name,
+            has_upvote,
+        ).outerjoin(
+            User,
+            User.id == Post.user_id
+        ).outerjoin(
+            PostFlow,
+            PostFlow.post_id == Post.id
+        ).outerjoin(
+            Flow,
+            Flow.id == PostFlow.flow_id
         ).options(
-            db.selectinload(Post.media)
+            db.joinedload(Post.media)
+                .joinedload(PostMedia.media_object)
+                .joinedload(MediaObject.renditions),
+            # joined above, as joinedload() would join the flows to all of their
+            # posts first
+            db.contains_eager(Post.flows),
         ).where(
             Post.post_id == post_id
         )
-    ).scalars().one_or_none()
+    ).unique().one_or_none()
 
-    if not post:
+    if not row:
         return None
 
-    has_upvote = False
-    if current_user_id is not None:
-        has_upvote = db.session.execute(
-            db.select(
-                db.exists().where(
-                    (PostUpvote.post_id == post_id) &
-                    (PostUpvote.user_id == current_user_id)
-                )
-            )
-        ).scalar()
+    post, username, has_upvote = row
 
     media = tuple(
         {
             'media_url': media_item.media_url,
             'description': media_item.description
-                if media_item.description else None
+                if media_item.description else None,
+            'placeholder': media_item.media_object.placeholder
+                if media_item.media_object else None,
+            'dominant_color': media_item.media_object.dominant_color
+                if media_item.media_object else None,
+            'width': media_item.media_object.width
+                if media_item.media_object else None,
+            'height': media_item.media_object.height
+                if media_item.media_object else None,
+            'size': media_item.media_object.size
+                if media_item.media_object else None,
+            'format': media_item.media_object.extension
+                if media_item.media_object else None,
+            'renditions': tuple(
+                {
+                    'url': rendition.url,
+                    'width': rendition.width,
+                    'height': rendition.height,
+                    'format': rendition.format,
+                } for rendition in media_item.media_object.renditions
+            ) if media_item.media_object else (),
         } for media_item in post.media
     )
 
@@ -340,8 +719,6 @@ def get_post_and_media(post_id: str, current_user_id: int | None) -> dict[str, A
         } for flow in post.flows
     )
 
-    username = get_username_by_id(post.user_id)
-
     result = {
         'post_id': post.post_id,
         'username': username,
@@ -355,6 +732,7 @@ def get_post_and_media(post_id: str, current_user_id: int | None) -> dict[str, A
         'thumbnail_url': post.thumbnail_url,
         'flows': flows,
         'has_upvote': has_upvote,
+        'is_processing': post.is_processing,
     }
     return result
 
@@ -369,22 +747,155 @@ class CommentSorting(Enum):
     """Sorts comments by most recently created last."""
 
 
-def get_post_comments_by_page(
-    post_id: str, current_user_id: int | None, page: int, sorting: CommentSorting
-) -> tuple[dict[str, Any], ...]:
-    """Return a sorted and paginated collection of a Post's comments as dicts, including
-    whether they were upvoted or not.
+_SORT_KEYS = {
+    PostSorting.NEWEST: ((Post.created_on, Post.id), True),
+    PostSorting.TOP: ((Post.score, Post.created_on, Post.id), True),
+    PostSorting.RELEVANCE: (
+        (
+            # see _title_search()
+            db.literal_column('title_search.relevance', db.Float),
+            Post.created_on,
+            Post.id,
+        ),
+        True,
+    ),
+    CommentSorting.NEWEST: ((PostComment.created_on, PostComment.id), True),
+    CommentSorting.MOST_LIKED: (
+        (PostComment.score, PostComment.created_on, PostComment.id), True
+    ),
+    CommentSorting.OLDEST: ((PostComment.created_on, PostComment.id), False),
+}
+"""The columns each sorting option sorts by, ending with a unique one, so the order
+is total; and whether it's descending."""
+
+
+def _encode_cursor(sorting: PostSorting | CommentSorting, values: Sequence) -> str:
+    """Return an opaque cursor pointing right after a row with the given sort key
+    values (see _SORT_KEYS and _cursor_column()), in the given sorting."""
+    cursor = json.dumps([sorting.value, *values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(cursor.encode()).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(
+    cursor: str, sorting: PostSorting | CommentSorting
+) -> list[Any]:
+    """Return the sort key values of a cursor made by _encode_cursor().
+
+    Raises:
+        ValueError: if it's not a valid cursor for the given sorting.
+    """
+    try:
+        cursor_sorting, *values = json.loads(
+            base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        )
+    except (ValueError, TypeError):
+        raise ValueError('Malformed cursor')
 
-    Only top-level comments are included; replies are not.
+    columns, _ = _SORT_KEYS[sorting]
+    if cursor_sorting != sorting.value or len(values) != len(columns):
+        raise ValueError('Cursor of another sorting')
 
-    Args:
-        post_id: The ID of the Post.
-        page: The page to fetch.
-        current_user_id: The current logged in user's ID. If None, upvote states will
-            always be False.
-        sorting: The CommentSorting option to use.
+    for column, value in zip(columns, values):
+        if isinstance(column.type, db.DateTime):
+            if not isinstance(value, str):
+                raise ValueError('Malformed cursor')
+            datetime.fromisoformat(value)
+        elif isinstance(column.type, db.Float):
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                raise ValueError('Malformed cursor')
+        elif not isinstance(value, int) or isinstance(value, bool):
+            raise ValueError('Malformed cursor')
+
+    return values
+
+
+def _cursor_column(column: db.Column) -> db.ColumnElement:
+    """Return how the given sort key column is stored in cursors.
+
+    Datetimes are stored as text, exactly as the database has them: SQLite compares
+    them as text, and they're not always formatted the same way (with or without
+    microseconds) depending on whether the database or SQLAlchemy wrote them.
+    """
+    if isinstance(column.type, db.DateTime):
+        return db.cast(column, db.String)
+    return column
+
+
+def _select_posts() -> db.Select:
+    """Return the query of every post, with the columns post listings have."""
+    return db.select(
+            Post.post_id,
+            Post.title,
+            Post.thumbnail_url,
+            Post.created_on,
+            Post.updated_on,
+            Post.score,
+            Post.comment_count,
+            Post.views,
+            Post.is_processing,
+            MediaObject.placeholder,
+            MediaObject.dominant_color,
+            MediaObject.width.label('cover_width'),
+            MediaObject.height.label('cover_height'),
+        ).outerjoin(
+            MediaObject,
+            MediaObject.content_hash == Post.cover_hash
+        )
+
+
+def _full_text_query(text: str) -> str | None:
+    """Return the full-text query (see _title_search()) matching the titles that
+    have each word of `text`, or a word starting with it, so that a search matches
+    while its last word is still being typed.
+
+    Returns:
+        The query, or None if `text` has no words.
+    """
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    if db.session.get_bind().dialect.name == 'sqlite':
+        # FTS5: phrases, all of which must match
+        return ' '.join(f'"{word}"*' for word in words)
+    # MariaDB, in boolean mode
+    return ' '.join(f'+{word}*' for word in words)
+
+
+def _title_search() -> db.Subquery:
+    """Return the IDs ('post_id') of the posts whose title matches the full-text
+    query bound to 'title' (see _full_text_query()), found through the full-text
+    index of titles (see POST_TITLE_SEARCH), and how relevant each one is
+    ('relevance'; the higher, the more).
+
+    It's written for the app's database, which listing queries are built for once
+    and for all (see _listing_statement()).
     """
-    statement = db.select(
+    if db.session.get_bind().dialect.name == 'sqlite':
+        return db.text(
+            f'SELECT rowid AS post_id, -bm25({POST_TITLE_SEARCH}) AS relevance '
+            f'FROM {POST_TITLE_SEARCH} WHERE {POST_TITLE_SEARCH} MATCH :title'
+        ).columns(post_id=db.Integer, relevance=db.Float).subquery('title_search')
+
+    relevance = mysql.match(Post.title, against=db.bindparam('title')).in_boolean_mode()
+    return db.select(
+            Post.id.label('post_id'),
+            relevance.label('relevance'),
+        ).where(
+            relevance
+        ).subquery('title_search')
+
+
+def _select_searched_posts() -> db.Select:
+    """Return the query of the posts whose title matches the full-text query bound to
+    'title' (see _title_search()), with the columns post listings have."""
+    title_search = _title_search()
+    return _select_posts().join(title_search, title_search.c.post_id == Post.id)
+
+
+def _select_comments() -> db.Select:
+    """Return the query of every comment and reply, with the columns comment
+    listings have."""
+    return db.select(
             PostComment.id,
             User.name.label('username'),
             PostComment.content,
@@ -395,44 +906,181 @@ def get_post_comments_by_page(
         ).join(
             User,
             User.id == PostComment.user_id
-        ).where(
-            PostComment.post_id == post_id,
-            PostComment.parent_id == None, # don't include replies
         )
 
-    if current_user_id is None:
-        statement = statement.add_columns(
-            db.literal(False).label('has_upvote')
+
+_LISTINGS = {
+    'public_posts': lambda: _select_posts().where(
+        Post.is_public == True,
+    ),
+    'searched_posts': lambda: _select_searched_posts().where(
+        Post.is_public == True,
+    ),
+    'user_posts': lambda: _select_posts().where(
+        Post.user_id == db.bindparam('user_id'),
+        Post.is_public == True,
+    ),
+    'flow_posts': lambda: _select_posts().join(Post.flows).where(
+        Flow.id == db.bindparam('flow_id'),
+    ),
+    'comments': lambda: _select_comments().where(
+        PostComment.post_id == db.bindparam('post_id'),
+        PostComment.parent_id == None, # don't include replies
+    ),
+    'replies': lambda: _select_comments().where(
+        PostComment.post_id == db.bindparam('post_id'),
+        PostComment.parent_id == db.bindparam('parent_id'),
+    ),
+}
+"""The query of each listing, filtered by the named parameters it's fetched with
+(see _fetch_page() and _fetch_all())."""
+
+
+@functools.cache
+def _listing_statement(
+    listing: str,
+    sorting: PostSorting | CommentSorting,
+    per_page: int | None = None,
+    is_after_cursor: bool = False,
+) -> db.Select:
+    """Return the query of the given listing, sorted, with its sort key as columns
+    of its own (see _cursor_column()).
+
+    Each query is only built once, and then reused, as the values that change
+    between requests are all bound parameters: SQLAlchemy compiles it once too, and
+    afterwards finds it in its cache by a key it only computes once.
+
+    Args:
+        per_page: How many rows are fetched at once; if None, all of them are.
+        is_after_cursor: Whether only the rows after some sort key values are
+            fetched ('after_0', 'after_1', ...); else, rows are skipped ('offset').
+    """
+    columns, is_descending = _SORT_KEYS[sorting]
+    statement = _LISTINGS[listing]().add_columns(
+        *(
+            _cursor_column(column).label(f'cursor_{index}')
+            for index, column in enumerate(columns)
         )
-    else:
-        statement = statement.add_columns(
-            db.exists().where(
-                (CommentUpvote.comment_id == PostComment.id)
-                & (CommentUpvote.user_id == current_user_id)
-            ).label('has_upvote')
-        )
-
-    match sorting:
-        case CommentSorting.NEWEST:
-            statement = statement.order_by(PostComment.created_on.desc())
-        case CommentSorting.MOST_LIKED:
-            statement = statement.order_by(
-                PostComment.score.desc(),
-                PostComment.created_on.desc(),
-            )
-        case CommentSorting.OLDEST:
-            statement = statement.order_by(
-                PostComment.created_on.asc(),
+    ).order_by(
+        *(column.desc() if is_descending else column.asc() for column in columns)
+    )
+
+    if per_page is None:
+        return statement
+
+    if is_after_cursor:
+        key = db.tuple_(*columns)
+        after = db.tuple_(
+            *(
+                # datetimes as text (see _cursor_column())
+                db.bindparam(
+                    f'after_{index}',
+                    type_=db.String if isinstance(column.type, db.DateTime)
+                        else column.type
+                )
+                for index, column in enumerate(columns)
             )
+        )
+        statement = statement.where(key < after if is_descending else key > after)
+    else:
+        statement = statement.offset(db.bindparam('offset'))
+
+    # one more, to know whether there are more
+    return statement.limit(per_page + 1)
+
+
+def _listing_items(
+    rows: Sequence, sorting: PostSorting | CommentSorting
+) -> tuple[dict[str, Any], ...]:
+    """Convert the given rows of a listing into dicts, without their sort key."""
+    columns, _ = _SORT_KEYS[sorting]
+    items = _rows_to_dicts(rows)
+    for item in items:
+        for index in range(len(columns)):
+            del item[f'cursor_{index}']
+    return items
+
+
+def _fetch_page(
+    listing: str,
+    sorting: PostSorting | CommentSorting,
+    page: int,
+    cursor: str | None,
+    per_page: int,
+    **parameters: Any,
+) -> tuple[tuple[dict[str, Any], ...], str | None]:
+    """Fetch a page of the given listing (see _LISTINGS), filtered by the given
+    parameters.
+
+    With a cursor, the page starts right after the row it points to, found by its
+    sort key (keyset pagination): it's as fast however deep it is, and rows added
+    in the meantime don't shift it. Otherwise, it's the `page`th page.
 
-    statement = statement.limit(
-            COMMENTS_PER_PAGE
-        ).offset(
-            page*COMMENTS_PER_PAGE
+    Returns:
+        The rows as dicts, and a cursor pointing after the last of them; None if
+        there are no more rows.
+
+    Raises:
+        ValueError: if the cursor isn't valid (see _decode_cursor()).
+    """
+    if cursor is not None:
+        statement = _listing_statement(listing, sorting, per_page, True)
+        parameters |= {
+            f'after_{index}': value
+            for index, value in enumerate(_decode_cursor(cursor, sorting))
+        }
+    else:
+        statement = _listing_statement(listing, sorting, per_page)
+        parameters['offset'] = page*per_page
+
+    rows = db.session.execute(statement, parameters).all()
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        columns, _ = _SORT_KEYS[sorting]
+        last_row = rows[-1]._mapping
+        next_cursor = _encode_cursor(
+            sorting, [last_row[f'cursor_{index}'] for index in range(len(columns))]
         )
 
-    result = db.session.execute(statement)
-    return _rows_to_dicts(result)
+    return _listing_items(rows, sorting), next_cursor
+
+
+def _fetch_all(
+    listing: str, sorting: PostSorting | CommentSorting, **parameters: Any
+) -> tuple[dict[str, Any], ...]:
+    """Fetch the whole of the given listing (see _LISTINGS), filtered by the given
+    parameters."""
+    rows = db.session.execute(_listing_statement(listing, sorting), parameters).all()
+    return _listing_items(rows, sorting)
+
+
+def get_post_comments_by_page(
+    post_id: str,
+    current_user_id: int | None,
+    page: int,
+    sorting: CommentSorting,
+    cursor: str | None = None,
+) -> tuple[tuple[dict[str, Any], ...], str | None]:
+    """Return a sorted and paginated collection of a Post's comments as dicts, including
+    whether they were upvoted or not, and the cursor of the next page (see
+    _fetch_page()).
+
+    Only top-level comments are included; replies are not.
+
+    Args:
+        post_id: The ID of the Post.
+        page: The page to fetch, if there's no cursor.
+        current_user_id: The current logged in user's ID. If None, upvote states will
+            always be False.
+        sorting: The CommentSorting option to use.
+        cursor: Where the previous page ended.
+    """
+    comments, next_cursor = _fetch_page(
+        'comments', sorting, page, cursor, COMMENTS_PER_PAGE, post_id=post_id
+    )
+    return _add_comment_upvote_states(comments, current_user_id), next_cursor
 
 
 def get_comment_replies(
@@ -450,58 +1098,23 @@ def get_comment_replies(
             always be False.
         sorting: The CommentSorting option to use.
     """
-    statement = db.select(
-            PostComment.id,
-            User.name.label('username'),
-            PostComment.content,
-            PostComment.parent_id,
-            PostComment.reply_count,
-            PostComment.score,
-            PostComment.created_on,
-        ).join(
-            User,
-            User.id == PostComment.user_id
-        ).where(
-            PostComment.post_id == post_id,
-            PostComment.parent_id == comment_id,
-        )
-
-    if current_user_id is None:
-        statement = statement.add_columns(
-            db.literal(False).label('has_upvote')
-        )
-    else:
-        statement = statement.add_columns(
-            db.exists().where(
-                (CommentUpvote.comment_id == PostComment.id)
-                & (CommentUpvote.user_id == current_user_id)
-            ).label('has_upvote')
-        )
+    replies = _fetch_all('replies', sorting, post_id=post_id, parent_id=comment_id)
+    return _add_comment_upvote_states(replies, current_user_id)
 
 
-    match sorting:
-        case CommentSorting.NEWEST:
-            statement = statement.order_by(PostComment.created_on.desc())
-        case CommentSorting.MOST_LIKED:
-            statement = statement.order_by(
-                PostComment.score.desc(),
-                PostComment.created_on.desc(),
-            )
-        case CommentSorting.OLDEST:
-            statement = statement.order_by(
-                PostComment.created_on.asc(),
-            )
-
-    result = db.session.execute(statement)
-    return _rows_to_dicts(result)
-
-
-def increment_post_views(post_id: str) -> None:
-    """Increase a post's view count by 1."""
+def add_post_views(views: Mapping[str, int]) -> None:
+    """Increase the view counts of the posts of the given IDs by the given amounts,
+    all in one transaction (see view_counts.ViewCounter)."""
+    posts = Post.__table__
     db.session.execute(
-        db.update(Post)
-            .where(Post.post_id == post_id)
-            .values(views=Post.views + 1)
+        db.update(posts)
+            .where(posts.c.post_id == db.bindparam('viewed_post_id'))
+            .values(views=posts.c.views + db.bindparam('new_views')),
+        [
+            {'viewed_post_id': post_id, 'new_views': views[post_id]}
+            # always in the same order, so concurrent flushes can't deadlock
+            for post_id in sorted(views)
+        ]
     )
     db.session.commit()
 
@@ -528,115 +1141,124 @@ def _increment_comment_reply_count(post_id: str, comment_id: int) -> None:
     )
 
 
-def upvote_post(post_id: str, upvoter_user_id: int) -> None:
-    """Record the user's upvote on a post, if not already upvoted, and increase the
-    poster's score.
+def _insert_ignoring_duplicates(model: type[db.Model]) -> db.Insert:
+    """Return an INSERT into the table of the given model that skips the rows whose
+    primary key is taken, rather than failing.
+
+    Its row count then tells whether the row was inserted: even when the same row is
+    inserted by concurrent requests, only one of them inserts it.
     """
-    already_upvoted = db.session.execute(
-        db.select(PostUpvote.user_id)
-            .where(
-                PostUpvote.post_id == post_id,
-                PostUpvote.user_id == upvoter_user_id
-            )
-    ).mappings().one_or_none() is not None
+    if db.session.get_bind().dialect.name == 'sqlite':
+        return sqlite.insert(model).on_conflict_do_nothing()
+    return mysql.insert(model).prefix_with('IGNORE')
 
-    if already_upvoted:
-        return
 
-    post_upvote = PostUpvote(post_id, upvoter_user_id)
-    db.session.add(post_upvote)
+def _add_to_score(
+    model: type[db.Model], where: db.ColumnElement[bool], amount: int
+) -> None:
+    """Add `amount` to the score of the post or comment matching `where`, and to the
+    score of the user who made it.
 
-    db.session.execute(
-        db.update(Post)
-            .where(Post.post_id == post_id)
-            .values(score=Post.score + 1)
-    )
+    On MariaDB, both are updated by the same statement. SQLite can't update two
+    tables at once, so it takes two.
+    """
+    if db.session.get_bind().dialect.name == 'sqlite':
+        db.session.execute(
+            db.update(model)
+                .where(where)
+                .values(score=model.score + amount)
+        )
+        db.session.execute(
+            db.update(User)
+                .where(
+                    User.id == db.select(model.user_id).where(where).scalar_subquery()
+                ).values(score=User.score + amount)
+        )
+        return
 
-    poster_id = db.session.execute(
-        db.select(Post.user_id)
-            .where(Post.post_id == post_id)
-    ).scalar_one()
-    db.session.execute(
-        db.update(User)
-            .where(User.id == poster_id)
-            .values(score=User.score + 1)
+    result = db.session.execute(
+        db.update(model)
+            .where(where, User.id == model.user_id)
+            .values({
+                model.score: model.score + amount,
+                User.score: User.score + amount,
+            })
     )
-    print(poster_id)
+    if result.rowcount == 0:
+        # made by someone who wasn't logged in, so there's no user to join
+        db.session.execute(
+            db.update(model)
+                .where(where)
+                .values(score=model.score + amount)
+        )
 
-    db.session.commit()
 
+def upvote_post(post_id: str, upvoter_user_id: int) -> None:
+    """Record the user's upvote on a post, if it exists and isn't already upvoted,
+    and increase the post's and the poster's score.
 
-def remove_upvote_from_post(post_id: str, upvoter_user_id: int) -> None:
-    """Remove the user's upvote on a post, if upvoted, and decrease the poster's
-    score.
+    On MariaDB, that's one statement for a duplicate upvote, and two for one that
+    counts (see _add_to_score()); plus one offering the post as its flows' top post
+    (see _offer_flows_top_post()), which updates other rows than those.
     """
-    upvote = db.session.execute(
-        db.select(PostUpvote)
-            .where(
-                PostUpvote.post_id == post_id,
-                PostUpvote.user_id == upvoter_user_id
+    result = db.session.execute(
+        _insert_ignoring_duplicates(PostUpvote).from_select(
+            ['post_id', 'user_id'],
+            db.select(
+                Post.post_id,
+                db.literal(upvoter_user_id),
+            ).where(
+                Post.post_id == post_id
             )
-    ).scalars().one_or_none()
-
-    if not upvote:
-        return
-
-    db.session.delete(upvote)
-
-    db.session.execute(
-        db.update(Post)
-            .where(Post.post_id == post_id)
-            .values(score=Post.score - 1)
-    )
-
-    poster_id = db.session.execute(
-        db.select(Post.user_id)
-            .where(Post.post_id == post_id)
-    ).scalar_one()
-    db.session.execute(
-        db.update(User)
-            .where(User.id == poster_id)
-            .values(score=User.score - 1)
+        )
     )
+    # only counted by whoever actually inserted it
+    if result.rowcount == 1:
+        _add_to_score(Post, Post.post_id == post_id, 1)
+        _offer_flows_top_post(post_id)
 
     db.session.commit()
 
 
-def upvote_comment(comment_id: int, upvoter_user_id: int) -> None:
-    """Record the user's upvote on a comment, if not already upvoted, and increase the
-    commenter's score.
+def remove_upvote_from_post(post_id: str, upvoter_user_id: int) -> None:
+    """Remove the user's upvote on a post, if upvoted, and decrease the post's and
+    the poster's score.
     """
+    result = db.session.execute(
+        db.delete(PostUpvote).where(
+            PostUpvote.post_id == post_id,
+            PostUpvote.user_id == upvoter_user_id,
+        )
+    )
+    if result.rowcount == 1:
+        _add_to_score(Post, Post.post_id == post_id, -1)
+        # another post may rank above it now
+        _update_flow_top_posts(
+            Flow.top_post_id
+                == db.select(Post.id).where(Post.post_id == post_id).scalar_subquery()
+        )
 
-    already_upvoted = db.session.execute(
-        db.select(CommentUpvote.user_id)
-            .where(
-                CommentUpvote.comment_id == comment_id,
-                CommentUpvote.user_id == upvoter_user_id
-            )
-    ).mappings().one_or_none() is not None
-
-    if already_upvoted:
-        return
+    db.session.commit()
 
-    comment_upvote = CommentUpvote(comment_id, upvoter_user_id)
-    db.session.add(comment_upvote)
 
-    db.session.execute(
-        db.update(PostComment)
-            .where(
+def upvote_comment(post_id: str, comment_id: int, upvoter_user_id: int) -> None:
+    """Record the user's upvote on a comment, if it exists and isn't already
+    upvoted, and increase the comment's and the commenter's score.
+    """
+    result = db.session.execute(
+        _insert_ignoring_duplicates(CommentUpvote).from_select(
+            ['comment_id', 'user_id'],
+            db.select(
+                PostComment.id,
+                db.literal(upvoter_user_id),
+            ).where(
                 PostComment.id == comment_id,
-            ).values(score=PostComment.score + 1)
-    )
-
-    commenter_id = db.session.execute(
-        db.select(PostComment.user_id)
-            .where(PostComment.id == comment_id)
-    ).scalar_one()
-    db.session.execute(
-        db.update(User)
-            .where(User.id == commenter_id)
-            .values(score=User.score + 1)
+                PostComment.post_id == post_id,
+            )
+        )
     )
+    if result.rowcount == 1:
+        _add_to_score(PostComment, PostComment.id == comment_id, 1)
 
     db.session.commit()
 
@@ -644,39 +1266,19 @@ def upvote_comment(comment_id: int, upvoter_user_id: int) -> None:
 def remove_upvote_from_comment(
     post_id: str, comment_id: int, upvoter_user_id: int
 ) -> None:
-    """Remove the user's upvote on a comment, if upvoted, and decrease the commenter's
-    score."""
-
-    upvote = db.session.execute(
-        db.select(CommentUpvote)
-            .where(
-                CommentUpvote.comment_id == comment_id,
-                CommentUpvote.user_id == upvoter_user_id
-            )
-    ).scalars().one_or_none()
-
-    if not upvote:
-        return
-
-    db.session.delete(upvote)
-
-    db.session.execute(
-        db.update(PostComment)
-            .where(
-                PostComment.id == comment_id,
-                PostComment.post_id == post_id,
-            ).values(score=PostComment.score - 1)
-    )
-
-    commenter_id = db.session.execute(
-        db.select(PostComment.user_id)
-            .where(PostComment.id == comment_id)
-    ).scalar_one()
-    db.session.execute(
-        db.update(User)
-            .where(User.id == commenter_id)
-            .values(score=User.score - 1)
+    """Remove the user's upvote on a comment, if upvoted, and decrease the comment's
+    and the commenter's score."""
+    result = db.session.execute(
+        db.delete(CommentUpvote).where(
+            CommentUpvote.comment_id == comment_id,
+            CommentUpvote.user_id == upvoter_user_id,
+            CommentUpvote.comment_id.in_(
+                db.select(PostComment.id).where(PostComment.post_id == post_id)
+            ),
+        )
     )
+    if result.rowcount == 1:
+        _add_to_score(PostComment, PostComment.id == comment_id, -1)
 
     db.session.commit()
 
@@ -723,80 +1325,116 @@ def _increment_flow_post_count(flow_id: int) -> None:
     )
 
 
+def _decrement_flow_post_count(flow_id: int) -> None:
+    """Decrease a flow's post count by 1."""
+    db.session.execute(
+        db.update(Flow)
+            .where(Flow.id == flow_id)
+            .values(post_count=Flow.post_count - 1)
+    )
+
+
 def get_public_posts_in_flow_by_page(
-    flow_id: int, current_user_id: int, page: int, sorting: PostSorting
-) -> tuple[dict[str, Any], ...]:
+    flow_id: int,
+    current_user_id: int,
+    page: int,
+    sorting: PostSorting,
+    cursor: str | None = None,
+) -> tuple[tuple[dict[str, Any], ...], str | None]:
     """Return a sorted and paginated collection of posts in a flow as dicts, including
-    upvote state.
+    upvote state, and the cursor of the next page (see _fetch_page()).
 
     All returned posts are public, as private posts can't be added to flows.
     """
-    statement = db.select(
-            Post.post_id,
-            Post.title,
-            Post.thumbnail_url,
-            Post.created_on,
-            Post.updated_on,
-            Post.score,
-            Post.comment_count,
-            Post.views,
+    posts, next_cursor = _fetch_page(
+        'flow_posts', sorting, page, cursor, POSTS_PER_PAGE, flow_id=flow_id
+    )
+    return _add_post_upvote_states(posts, current_user_id), next_cursor
+
+
+def _top_post_key(post: type[Post]) -> db.Tuple:
+    """Return the key posts are ranked by in their flows: the highest one is the top
+    post (as in PostSorting.TOP)."""
+    return db.tuple_(post.score, post.created_on, post.id)
+
+
+def _update_flow_top_posts(where: db.ColumnElement[bool]) -> None:
+    """Find the top post (and so the thumbnail) of the flows matching `where` again,
+    among all of their posts."""
+    top_post_id = db.select(
+            Post.id
         ).join(
-            Post.flows
+            PostFlow,
+            PostFlow.post_id == Post.id
         ).where(
-            Flow.id == flow_id,
-        )
+            PostFlow.flow_id == Flow.id
+        ).order_by(
+            Post.score.desc(),
+            Post.created_on.desc(),
+            Post.id.desc(),
+        ).limit(1).correlate(Flow).scalar_subquery()
 
-    if current_user_id is None:
-        statement = statement.add_columns(
-            db.literal(False).label('has_upvote')
-        )
-    else:
-        statement = statement.add_columns(
-            db.exists().where(
-                (PostUpvote.post_id == Post.post_id)
-                & (PostUpvote.user_id == current_user_id)
-            ).label('has_upvote')
-        )
-
-    match sorting:
-        case PostSorting.NEWEST:
-            statement = statement.order_by(Post.created_on.desc())
-        case PostSorting.TOP:
-            statement = statement.order_by(
-                Post.score.desc(),
-                Post.created_on.desc(),
+    # both at once, as `where` may depend on the top post
+    db.session.execute(
+        db.update(Flow)
+            .where(where)
+            .values(
+                top_post_id=top_post_id,
+                thumbnail_url=db.select(Post.thumbnail_url)
+                    .where(Post.id == top_post_id)
+                    .scalar_subquery(),
             )
+    )
 
-    statement = statement.limit(
-            POSTS_PER_PAGE
-        ).offset(
-            page*POSTS_PER_PAGE
-        )
 
-    result = db.session.execute(statement)
-    return _rows_to_dicts(result)
+def _offer_flows_top_post(post_id: str) -> None:
+    """Make the post of the given ID the top post of each of its flows where it now
+    ranks above the current one, after it was added to them or upvoted.
+
+    Its rank only ever goes up in these cases, so the flows' other posts don't need
+    to be looked at.
+    """
+    candidate = db.aliased(Post)
+    top = db.aliased(Post)
+    db.session.execute(
+        db.update(Flow)
+            .where(
+                Flow.id.in_(
+                    db.select(PostFlow.flow_id)
+                        .join(Post, Post.id == PostFlow.post_id)
+                        .where(Post.post_id == post_id)
+                ),
+                ~db.exists().where(
+                    top.id == Flow.top_post_id,
+                    candidate.post_id == post_id,
+                    _top_post_key(top) >= _top_post_key(candidate),
+                ),
+            ).values(
+                top_post_id=db.select(Post.id)
+                    .where(Post.post_id == post_id)
+                    .scalar_subquery(),
+                thumbnail_url=db.select(Post.thumbnail_url)
+                    .where(Post.post_id == post_id)
+                    .scalar_subquery(),
+            )
+    )
 
 
-def thumbnail_by_flow(flow: Flow) -> str:
-    """Return the thumbnail URL of a flow.
+def reconcile_flow_top_posts() -> int:
+    """Find the top post of every flow again, among all of their posts, fixing any
+    that went wrong; e.g. between concurrent upvotes, or for flows from before top
+    posts were kept.
 
-    The thumbnail of a flow is always the thumbnail of the highest-scored post in that
-    flow.
+    Returns:
+        How many flows had the wrong top post.
     """
-    top_post_thumbnail_from_flow = db.session.execute(
-        db.select(
-            Post.thumbnail_url
-        ).join(
-            Post.flows
-        ).order_by(
-            Post.score.desc(),
-            Post.created_on.desc(),
-        ).where(
-            Flow.id == flow.id
-        ).limit(1)
-    ).scalar()
+    select_top_posts = db.select(Flow.id, Flow.top_post_id, Flow.thumbnail_url)
+    before = set(db.session.execute(select_top_posts).all())
+    _update_flow_top_posts(db.true())
+    after = set(db.session.execute(select_top_posts).all())
+    db.session.commit()
 
-    return top_post_thumbnail_from_flow
+    return len(after - before)
 
 
 def get_flows_overview() -> tuple[dict[str, str], ...]:
@@ -804,47 +1442,29 @@ def get_flows_overview() -> tuple[dict[str, str], ...]:
 
     Returns:
         A collection of dicts, each with the flow's name ('name') and its
-        thumbnail ('thumbnail_url'; see thumbnail_by_flow())
+        thumbnail ('thumbnail_url'; see Flow.thumbnail_url)
     """
     # TODO: expand upon this algorithm
-    top_flows = db.session.execute(
+    result = db.session.execute(
         db.select(
-            Flow
+            Flow.name,
+            Flow.thumbnail_url,
         ).order_by(
             Flow.post_count.desc(),
             Flow.name.asc(),
         ).limit(FLOWS_IN_OVERVIEW)
-    ).scalars().all()
-
-    overview = tuple(
-        {
-            'name': flow.name,
-            'thumbnail_url': thumbnail_by_flow(flow)
-        } for flow in top_flows
     )
 
-    return overview
-
-
-def _escaped_search_text(text: str) -> str:
-    """Return `text` with any LIKE special characters (%, _, \) escaped."""
-    return text.replace("%", "\\%").replace("\\", "\\\\").replace("_", "\\_")
+    return _rows_to_dicts(result)
 
 
-def suggest_flows_by_name(partial_name: str) -> tuple[dict[str, Any], ...]:
+def get_flow_post_counts() -> tuple[dict[str, Any], ...]:
+    """Return every Flow as a dict with its name and post count, to build the flow
+    suggestions index (see app.flow_suggestions)."""
     result = db.session.execute(
         db.select(
             Flow.name,
             Flow.post_count
-        ).where(
-            Flow.name.like(
-                _escaped_search_text(partial_name) + '%'
-            )
-        ).order_by(
-            Flow.post_count.desc(),
-            Flow.name.asc(),
-        ).limit(
-            FLOW_SUGGESTIONS_LIMIT
         )
     )
 
@@ -915,51 +1535,445 @@ def get_username_by_id(user_id: int) -> str | None:
 
 
 def get_public_posts_from_user_by_page(
-    user_id: int, current_user_id: int, page: int, sorting: PostSorting
-) -> tuple[dict[str, Any], ...]:
+    user_id: int,
+    current_user_id: int,
+    page: int,
+    sorting: PostSorting,
+    cursor: str | None = None,
+) -> tuple[tuple[dict[str, Any], ...], str | None]:
     """Return a sorted and paginated collection of public posts made by the given user,
-    including upvote state.
+    including upvote state, and the cursor of the next page (see _fetch_page()).
     """
-    statement = db.select(
-            Post.post_id,
-            Post.title,
-            Post.thumbnail_url,
-            Post.created_on,
-            Post.updated_on,
-            Post.score,
-            Post.comment_count,
-            Post.views,
+    posts, next_cursor = _fetch_page(
+        'user_posts', sorting, page, cursor, POSTS_PER_PAGE, user_id=user_id
+    )
+    return _add_post_upvote_states(posts, current_user_id), next_cursor
+
+
+# -- media jobs --
+
+def _utcnow() -> datetime:
+    """Return the current time in UTC, as stored in the database (without a time
+    zone)."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def claim_media_job(stale_after: timedelta) -> dict[str, Any] | None:
+    """Mark the oldest pending media job as running, so no other worker runs it.
+
+    Jobs that have been running for longer than `stale_after` (whose worker probably
+    died) are claimed again.
+
+    Returns:
+        The claimed job's ID ('id'), and the hash ('content_hash') and filename
+        ('filename') of its media file; or None if there are no jobs to run.
+    """
+    now = _utcnow()
+    is_claimable = (
+        (MediaJob.status == MediaJob.PENDING)
+        | (
+            (MediaJob.status == MediaJob.RUNNING)
+            & (MediaJob.started_on < now - stale_after)
+        )
+    )
+
+    job = db.session.execute(
+        db.select(
+            MediaJob.id,
+            MediaJob.content_hash,
+            MediaObject.extension,
+        ).join(
+            MediaObject,
+            MediaObject.content_hash == MediaJob.content_hash
         ).where(
-            Post.user_id == user_id,
-            Post.is_public == True
+            is_claimable
+        ).order_by(
+            MediaJob.id.asc()
+        ).limit(1)
+    ).one_or_none()
+
+    if job is None:
+        return None
+
+    # only one worker's update can match, even if they all found the same job
+    result = db.session.execute(
+        db.update(MediaJob)
+            .where(MediaJob.id == job.id, is_claimable)
+            .values(
+                status=MediaJob.RUNNING,
+                started_on=now,
+                attempts=MediaJob.attempts + 1,
+            )
+    )
+    db.session.commit()
+
+    if result.rowcount == 0:
+        return None
+
+    return {
+        'id': job.id,
+        'content_hash': job.content_hash,
+        'filename': f'{job.content_hash}.{job.extension}',
+    }
+
+
+def complete_media_job(
+    job_id: int,
+    renditions: Iterable[dict[str, Any]],
+    placeholder: str,
+    dominant_color: str,
+) -> bool:
+    """Record the renditions, placeholder and dominant color generated by a media job
+    (see imaging.process_media()), and mark its media file (and the posts where it's
+    the last one being processed) as processed.
+
+    Returns:
+        False if the job no longer exists, because its media file was deleted in the
+        meantime; the generated files should then be deleted too.
+    """
+    job = db.session.get(MediaJob, job_id)
+    if job is None:
+        return False
+
+    media_object = job.media_object
+    media_object.renditions = [
+        MediaRendition(
+            rendition['width'],
+            rendition['height'],
+            rendition['format'],
+            rendition['filename'],
+        ) for rendition in renditions
+    ]
+    media_object.placeholder = placeholder
+    media_object.dominant_color = dominant_color
+    _finish_media_processing(media_object)
+    db.session.delete(job)
+    db.session.commit()
+
+    return True
+
+
+def fail_media_job(job_id: int, max_attempts: int) -> None:
+    """Queue a failed media job to be retried; or, if it was attempted `max_attempts`
+    times already, give up on it, leaving its media file without renditions.
+    """
+    job = db.session.get(MediaJob, job_id)
+    if job is None:
+        return
+
+    if job.attempts < max_attempts:
+        job.status = MediaJob.PENDING
+    else:
+        job.status = MediaJob.FAILED
+        _finish_media_processing(job.media_object)
+
+    db.session.commit()
+
+
+def _finish_media_processing(media_object: MediaObject) -> None:
+    """Mark a media file as processed, and so the posts it's in, unless they have
+    other media files still being processed."""
+    media_object.is_processing = False
+    db.session.flush()
+
+    other_media_processing = db.exists().where(
+        PostMedia.post_id == Post.post_id,
+        PostMedia.content_hash == MediaObject.content_hash,
+        MediaObject.is_processing == True,
+    )
+    db.session.execute(
+        db.update(Post)
+            .where(
+                Post.is_processing == True,
+                Post.post_id.in_(
+                    db.select(PostMedia.post_id)
+                        .where(PostMedia.content_hash == media_object.content_hash)
+                ),
+                ~other_media_processing,
+            ).values(is_processing=False)
+    )
+
+
+# -- media cache --
+
+def use_media_cache_entry(filename: str) -> bool:
+    """Return whether the media cache has an entry for the given file, marking it as
+    recently used.
+    """
+    last_used_on = db.session.execute(
+        db.select(
+            MediaCacheEntry.last_used_on
+        ).where(
+            MediaCacheEntry.filename == filename
         )
+    ).scalar()
 
-    if current_user_id is None:
-        statement = statement.add_columns(
-            db.literal(False).label('has_upvote')
+    if last_used_on is None:
+        return False
+
+    now = _utcnow()
+    if now - last_used_on > MEDIA_CACHE_TOUCH_INTERVAL:
+        db.session.execute(
+            db.update(MediaCacheEntry)
+                .where(MediaCacheEntry.filename == filename)
+                .values(last_used_on=now)
         )
-    else:
-        statement = statement.add_columns(
-            db.exists().where(
-                (PostUpvote.post_id == Post.post_id)
-                & (PostUpvote.user_id == current_user_id)
-            ).label('has_upvote')
-        )
-
-    match sorting:
-        case PostSorting.NEWEST:
-            statement = statement.order_by(Post.created_on.desc())
-        case PostSorting.TOP:
-            statement = statement.order_by(
-                Post.score.desc(),
-                Post.created_on.desc(),
-            )
+        db.session.commit()
 
-    statement = statement.limit(
-            POSTS_PER_PAGE
-        ).offset(
-            page*POSTS_PER_PAGE
+    return True
+
+
+def add_media_cache_entry(filename: str, size: int) -> None:
+    """Record a file added to (or replaced in) the media cache."""
+    replaced_size = db.session.execute(
+        db.select(MediaCacheEntry.size).where(MediaCacheEntry.filename == filename)
+    ).scalar()
+    db.session.merge(MediaCacheEntry(filename, size, _utcnow()))
+    try:
+        db.session.flush()
+        _add_media_cache_usage(size - (replaced_size or 0))
+        db.session.commit()
+    except IntegrityError:
+        # added by a concurrent request in the meantime, which is just as good
+        db.session.rollback()
+
+
+def _add_media_cache_usage(amount: int) -> None:
+    """Add `amount` bytes to the media cache's total size (see MediaCacheUsage)."""
+    result = db.session.execute(
+        db.update(MediaCacheUsage).values(size=MediaCacheUsage.size + amount)
+    )
+    if result.rowcount == 1:
+        return
+
+    # first used: add up the entries there already are (the new one included)
+    result = db.session.execute(
+        _insert_ignoring_duplicates(MediaCacheUsage).values(
+            id=1,
+            size=db.select(
+                db.func.coalesce(db.func.sum(MediaCacheEntry.size), 0)
+            ).scalar_subquery(),
+        )
+    )
+    if result.rowcount == 0:
+        # by a concurrent request, since
+        db.session.execute(
+            db.update(MediaCacheUsage).values(size=MediaCacheUsage.size + amount)
         )
 
-    result = db.session.execute(statement)
-    return _rows_to_dicts(result)
+
+def evict_media_cache_entries(max_bytes: int) -> tuple[str, ...]:
+    """Forget the least recently used media cache entries if the cache is bigger than
+    `max_bytes`, until it's down to `MEDIA_CACHE_LOW_WATERMARK` of that.
+
+    Returns:
+        The filenames of the evicted entries, which should be deleted.
+    """
+    total_size = db.session.execute(db.select(MediaCacheUsage.size)).scalar()
+
+    if total_size is None or total_size <= max_bytes:
+        return ()
+
+    bytes_to_free = total_size - int(max_bytes * MEDIA_CACHE_LOW_WATERMARK)
+    evicted = []
+    least_recently_used = db.session.execute(
+        db.select(
+            MediaCacheEntry.filename,
+            MediaCacheEntry.size,
+        ).order_by(
+            MediaCacheEntry.last_used_on.asc()
+        )
+    )
+    for filename, size in least_recently_used:
+        if bytes_to_free <= 0:
+            break
+        evicted.append((filename, size))
+        bytes_to_free -= size
+    least_recently_used.close()
+
+    freed = 0
+    for filename, size in evicted:
+        result = db.session.execute(
+            db.delete(MediaCacheEntry).where(MediaCacheEntry.filename == filename)
+        )
+        # unless a concurrent eviction got to it first
+        if result.rowcount == 1:
+            freed += size
+    _add_media_cache_usage(-freed)
+    db.session.commit()
+
+    return tuple(filename for filename, _ in evicted)
+
+
+# -- chunked uploads --
+
+def create_chunked_upload(user_id: int | None, size: int) -> str:
+    """Start a chunked upload of a `size` bytes file, and return its upload ID."""
+    upload = ChunkedUpload(
+        secrets.token_hex(ChunkedUpload.UPLOAD_ID_LENGTH // 2), user_id, size
+    )
+    db.session.add(upload)
+    db.session.commit()
+
+    return upload.upload_id
+
+
+def get_chunked_upload(upload_id: str, user_id: int | None) -> dict[str, Any] | None:
+    """Return the given user's chunked upload of the given ID as a dict with its
+    'upload_id', 'size', 'offset', 'content_hash' and 'extension' (None until it's
+    finalized); or None if there's no such upload.
+    """
+    row = db.session.execute(
+        db.select(
+            ChunkedUpload.upload_id,
+            ChunkedUpload.size,
+            ChunkedUpload.offset,
+            ChunkedUpload.content_hash,
+            ChunkedUpload.extension,
+        ).where(
+            ChunkedUpload.upload_id == upload_id,
+            ChunkedUpload.user_id == user_id,
+        )
+    ).one_or_none()
+
+    return row._asdict() if row else None
+
+
+def claim_chunked_upload(upload_id: str, offset: int, stale_after: timedelta) -> bool:
+    """Claim the right to write the next chunk of a chunked upload, from `offset` on,
+    before it's written; see advance_chunked_upload().
+
+    A claim older than `stale_after` is assumed to be left by a request that died,
+    and can be claimed again.
+
+    Returns:
+        False if its offset is no longer `offset`, or if a concurrent request is
+        writing the chunk already.
+    """
+    now = _utcnow()
+    # only one request's update can match, even if they all found the same offset
+    result = db.session.execute(
+        db.update(ChunkedUpload)
+            .where(
+                ChunkedUpload.upload_id == upload_id,
+                ChunkedUpload.offset == offset,
+                ChunkedUpload.content_hash == None,
+                (ChunkedUpload.receiving_since == None)
+                | (ChunkedUpload.receiving_since < now - stale_after),
+            ).values(receiving_since=now)
+    )
+    db.session.commit()
+
+    return result.rowcount == 1
+
+
+def advance_chunked_upload(upload_id: str, new_offset: int) -> None:
+    """Record that a chunked upload received the bytes up to `new_offset`, releasing
+    its claim (see claim_chunked_upload())."""
+    db.session.execute(
+        db.update(ChunkedUpload)
+            .where(ChunkedUpload.upload_id == upload_id)
+            .values(offset=new_offset, receiving_since=None)
+    )
+    db.session.commit()
+
+
+def finalize_chunked_upload(upload_id: str, content_hash: str, extension: str) -> None:
+    """Mark a complete chunked upload as finalized, with its contents' hash and its
+    format's extension, so it can be included in a post."""
+    db.session.execute(
+        db.update(ChunkedUpload)
+            .where(ChunkedUpload.upload_id == upload_id)
+            .values(content_hash=content_hash, extension=extension)
+    )
+    db.session.commit()
+
+
+def get_finalized_chunked_uploads(
+    upload_ids: Sequence[str], user_id: int | None
+) -> tuple[dict[str, Any], ...] | None:
+    """Return the given user's finalized chunked uploads of the given IDs, in the same
+    order, as dicts (see get_chunked_upload()); or None if any of them isn't one.
+    """
+    rows = db.session.execute(
+        db.select(
+            ChunkedUpload.upload_id,
+            ChunkedUpload.size,
+            ChunkedUpload.offset,
+            ChunkedUpload.content_hash,
+            ChunkedUpload.extension,
+        ).where(
+            ChunkedUpload.upload_id.in_(upload_ids),
+            ChunkedUpload.user_id == user_id,
+            ChunkedUpload.content_hash != None,
+        )
+    )
+    uploads = {row.upload_id: row._asdict() for row in rows}
+
+    # duplicates included
+    if len(uploads) != len(upload_ids):
+        return None
+
+    return tuple(uploads[upload_id] for upload_id in upload_ids)
+
+
+def delete_chunked_uploads(upload_ids: Iterable[str]) -> None:
+    """Forget the chunked uploads of the given IDs (whose staging files are gone)."""
+    db.session.execute(
+        db.delete(ChunkedUpload).where(ChunkedUpload.upload_id.in_(upload_ids))
+    )
+    db.session.commit()
+
+
+def consume_chunked_uploads(upload_ids: Sequence[str]) -> bool:
+    """Forget the given chunked uploads as they're included in a post, so that they
+    can't be included in another one.
+
+    Returns:
+        False if any of them was consumed (or deleted) by a concurrent request; then
+        none of them is.
+    """
+    result = db.session.execute(
+        db.delete(ChunkedUpload).where(ChunkedUpload.upload_id.in_(upload_ids))
+    )
+    if result.rowcount != len(upload_ids):
+        db.session.rollback()
+        return False
+
+    db.session.commit()
+    return True
+
+
+def delete_expired_chunked_uploads(expiry: timedelta) -> tuple[str, ...]:
+    """Forget the chunked uploads left unused for longer than `expiry` (since their
+    last chunk, or since they were started), which were never included in a post.
+
+    Returns:
+        The IDs of the deleted uploads, whose staging files should be deleted.
+    """
+    expires_before = _utcnow() - expiry
+    expired = (ChunkedUpload.updated_on < expires_before) | (
+        (ChunkedUpload.updated_on == None)
+        & (ChunkedUpload.created_on < expires_before)
+    )
+    upload_ids = db.session.execute(
+        db.select(ChunkedUpload.upload_id).where(expired)
+    ).scalars().all()
+
+    # one by one, checked again: only the ones deleted here are done with, not the
+    # ones included in a post or sent a chunk since they were found
+    deleted_upload_ids = []
+    for upload_id in upload_ids:
+        result = db.session.execute(
+            db.delete(
+                ChunkedUpload
+            ).where(
+                ChunkedUpload.upload_id == upload_id,
+                expired,
+            )
+        )
+        if result.rowcount == 1:
+            deleted_upload_ids.append(upload_id)
+    db.session.commit()
+
+    return tuple(deleted_upload_ids)
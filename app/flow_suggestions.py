@@ -0,0 +1,213 @@
+import atexit
+from collections.abc import Iterable, Iterator, Mapping
+from contextlib import contextmanager
+import heapq
+import threading
+from typing import Any
+
+from flask import Flask, current_app
+
+from app.dbapi import get_flow_post_counts
+
+
+class _Node:
+    """A node of FlowSuggestions' trie: the flows whose folded name starts with the
+    characters on the way to it."""
+    __slots__ = ('children', 'names', 'top')
+
+    def __init__(self):
+        self.children: dict[str, _Node] = {}
+        # the flows whose folded name ends here (more than one if only their case
+        # differs)
+        self.names: list[str] = []
+        # the flows under this node with the most posts, in order
+        self.top: list[str] = []
+
+
+def _top_flows(node: _Node, post_counts: Mapping[str, int], limit: int) -> list[str]:
+    """Return the `limit` flows under the given node with the most posts (and then,
+    by name), picked from its own and its children's top flows."""
+    return heapq.nsmallest(
+        limit,
+        [
+            *node.names,
+            *(name for child in node.children.values() for name in child.top),
+        ],
+        key=lambda name: (-post_counts[name], name),
+    )
+
+
+def _fold(name: str) -> str:
+    """Return the given (partial) flow name as it's indexed: case-folded, so that
+    flow names match whatever the case of their letters, in any language (see
+    api.routes.flow_regex_pattern)."""
+    return name.casefold()
+
+
+class FlowSuggestions:
+    """An in-memory prefix index of flow names, suggesting the flows with the most
+    posts whose name starts with what's typed, without querying the database.
+
+    It's a trie of case-folded names, each node of which keeps the `limit` flows
+    under it with the most posts: a suggestion only walks down the typed name, and
+    a flow's post count only changes the nodes on the way to it.
+
+    The index is loaded from the database when it's first used. Post counts are
+    updated as this process changes them (see changing_posts()), and the whole index
+    is reloaded every `refresh_interval` seconds once started, to pick up the
+    changes made by other processes.
+    """
+
+    def __init__(self, app: Flask, limit: int, refresh_interval: float):
+        self.app = app
+        self.limit = limit
+        self.refresh_interval = refresh_interval
+        self._post_counts: dict[str, int] = {}
+        self._root = _Node()
+        self._is_loaded = False
+        self._lock = threading.Lock()
+        # only one reload at a time
+        self._refresh_lock = threading.Lock()
+        # posts being changed (see changing_posts()), and whether they're held back
+        # by a reload
+        self._changes = threading.Condition()
+        self._changing_count = 0
+        self._is_refreshing = False
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def suggest(self, partial_name: str) -> list[dict[str, Any]]:
+        """Return the flows whose name starts with `partial_name`, ignoring case, as
+        dicts with their name and post count, the ones with the most posts first."""
+        if not self._is_loaded:
+            self.refresh()
+
+        with self._lock:
+            node = self._root
+            for char in _fold(partial_name):
+                node = node.children.get(char)
+                if node is None:
+                    return []
+            return [
+                {'name': name, 'post_count': self._post_counts[name]}
+                for name in node.top
+            ]
+
+    @contextmanager
+    def changing_posts(self) -> Iterator[None]:
+        """Mark posts as being changed, from before their changes are committed to
+        the database until their post counts are added (see add_posts()).
+
+        A reload waits for the changes in progress, and holds back new ones until
+        the index is replaced: so each change is either read from the database, or
+        added to the new index, never both nor neither.
+        """
+        with self._changes:
+            self._changes.wait_for(lambda: not self._is_refreshing)
+            self._changing_count += 1
+        try:
+            yield
+        finally:
+            with self._changes:
+                self._changing_count -= 1
+                self._changes.notify_all()
+
+    def add_posts(self, flow_names: Iterable[str], amount: int = 1) -> None:
+        """Add `amount` to the post count of each of the given flows, adding the new
+        ones to the index. The posts should be changed in the database within
+        changing_posts()."""
+        with self._lock:
+            if not self._is_loaded:
+                # they're in the database, where they'll be loaded from
+                return
+
+            for name in flow_names:
+                self._post_counts[name] = self._post_counts.get(name, 0) + amount
+
+                path = [self._root]
+                for char in _fold(name):
+                    path.append(path[-1].children.setdefault(char, _Node()))
+                if name not in path[-1].names:
+                    path[-1].names.append(name)
+                # bottom-up, as each node's top flows are picked from its children's
+                for node in reversed(path):
+                    node.top = _top_flows(node, self._post_counts, self.limit)
+
+    def load(self, post_counts: Mapping[str, int]) -> None:
+        """Replace the index with one of the given flows (by name) and their post
+        counts."""
+        root = _Node()
+        nodes = [root]
+        for name in post_counts:
+            node = root
+            for char in _fold(name):
+                child = node.children.get(char)
+                if child is None:
+                    child = node.children[char] = _Node()
+                    nodes.append(child)
+                node = child
+            node.names.append(name)
+
+        # children were added after their parents
+        for node in reversed(nodes):
+            node.top = _top_flows(node, post_counts, self.limit)
+
+        with self._lock:
+            self._post_counts = dict(post_counts)
+            self._root = root
+            self._is_loaded = True
+
+    def refresh(self) -> None:
+        """Reload the index from the database (see changing_posts())."""
+        with self._refresh_lock:
+            with self._changes:
+                self._is_refreshing = True
+                self._changes.wait_for(lambda: self._changing_count == 0)
+            try:
+                with self.app.app_context():
+                    flows = get_flow_post_counts()
+                self.load({flow['name']: flow['post_count'] for flow in flows})
+            finally:
+                with self._changes:
+                    self._is_refreshing = False
+                    self._changes.notify_all()
+
+    def start(self) -> None:
+        """Start reloading the index in the background, until the app exits."""
+        self._thread = threading.Thread(
+            target=self._run, name='flow-suggestions', daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self) -> None:
+        """Stop reloading the index in the background."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stopping.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception:
+                self.app.logger.exception('Could not reload flow suggestions')
+
+
+def init_flow_suggestions(app: Flask) -> FlowSuggestions:
+    """Create the flow suggestions index of the given app (see
+    get_flow_suggestions()). It's only reloaded once started (see
+    app.start_background_work()), unless `FLOW_SUGGESTIONS_REFRESH_INTERVAL` is 0."""
+    suggestions = FlowSuggestions(
+        app,
+        app.config['FLOW_SUGGESTIONS_LIMIT'],
+        app.config['FLOW_SUGGESTIONS_REFRESH_INTERVAL'],
+    )
+
+    app.extensions['flow_suggestions'] = suggestions
+    return suggestions
+
+
+def get_flow_suggestions() -> FlowSuggestions:
+    """Return the app's flow suggestions index."""
+    return current_app.extensions['flow_suggestions']
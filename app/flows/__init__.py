@@ -3,4 +3,4 @@ from flask import Blueprint
 
 bp = Blueprint('flows', __name__)
 
-from app.flows import routes
+from app.flows import routes, commands
@@ -0,0 +1,22 @@
+import time
+
+import click
+
+from app.dbapi import reconcile_flow_top_posts
+from app.flows import bp
+
+
+@bp.cli.command('reconcile')
+def reconcile():
+    """Find the top post (and so the thumbnail) of every flow again.
+
+    Top posts are kept up to date as posts are added, upvoted and deleted; this
+    fixes the few that concurrent votes can get wrong. Run it periodically (e.g.
+    hourly, from cron), and once after 'flask db upgrade' adds top posts to flows.
+    """
+    start = time.perf_counter()
+    fixed = reconcile_flow_top_posts()
+    click.echo(
+        f'Done: {fixed} flows had the wrong top post'
+        f' ({time.perf_counter() - start:.1f}s)'
+    )
@@ -0,0 +1,432 @@
+import atexit
+import base64
+from collections.abc import Iterable, Sequence
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+import io
+import math
+import os
+import threading
+import time
+from typing import Any
+
+from flask import Flask, current_app
+import PIL
+from PIL import Image
+from werkzeug.datastructures import MIMEAccept
+
+
+MAX_THUMBNAIL_SIZE = (256, 256)
+"""The maximum size (width, height) for thumbnails, in pixels."""
+
+IMAGE_ENCODERS = {
+    'avif': ('image/avif', 'AVIF', {'quality': 60, 'speed': 8}),
+    'webp': ('image/webp', 'WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('image/jpeg', 'JPEG', {'quality': 85}),
+    'png': ('image/png', 'PNG', {}),
+}
+"""The formats renditions and transformed images can be encoded in: their MIME
+type, Pillow format and default save options."""
+
+
+def can_encode(image_format: str) -> bool:
+    """Return whether Pillow can encode images in the given format (see
+    IMAGE_ENCODERS): AVIF and WebP need it to be built with their libraries, and
+    AVIF a recent enough version."""
+    _, pillow_format, _ = IMAGE_ENCODERS[image_format]
+    # their plugins only register an encoder if it's there
+    Image.init()
+    return pillow_format in Image.SAVE
+
+
+def init_rendition_formats(app: Flask) -> None:
+    """Leave the formats Pillow can't encode out of the given app's
+    `MEDIA_RENDITION_FORMATS`, with a warning, rather than fail every media job on
+    them."""
+    rendition_formats = []
+    for image_format in app.config['MEDIA_RENDITION_FORMATS']:
+        if can_encode(image_format):
+            rendition_formats.append(image_format)
+        else:
+            app.logger.warning(
+                'Pillow %s cannot encode %s: no such renditions are made',
+                PIL.__version__, image_format,
+            )
+    app.config['MEDIA_RENDITION_FORMATS'] = tuple(rendition_formats)
+
+PLACEHOLDER_SIZE = (16, 16)
+"""The maximum size (width, height) for placeholders, in pixels."""
+PLACEHOLDER_QUALITY = 30
+"""The WebP quality placeholders are encoded with; they're blurred when shown, so
+this keeps them at a few hundred bytes at most."""
+
+
+def thumbnail_from_image(
+    image: Image.Image, reducing_gap: float | None = 2.0
+) -> Image.Image:
+    """Return a thumbnail (smaller, lower quality) copy of the given image.
+
+    See _draft() for `reducing_gap`.
+    """
+    thumbnail = image.copy()
+    thumbnail.thumbnail(MAX_THUMBNAIL_SIZE, reducing_gap=reducing_gap)
+    return thumbnail
+
+
+def placeholder_from_image(image: Image.Image) -> tuple[str, str]:
+    """Return a placeholder for the given image, to be shown while it loads: a tiny
+    preview of it, as a data URI; and its dominant color, as a hex color.
+    """
+    preview = _resizable(image).copy()
+    preview.thumbnail(PLACEHOLDER_SIZE)
+
+    buffer = io.BytesIO()
+    preview.save(buffer, 'WEBP', quality=PLACEHOLDER_QUALITY)
+    data_uri = (
+        'data:image/webp;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+    )
+
+    # the most common of a few representative colors
+    palette_image = preview.convert('RGB').quantize(colors=4)
+    _, dominant_index = max(palette_image.getcolors())
+    palette = palette_image.getpalette()
+    red, green, blue = palette[dominant_index * 3:dominant_index * 3 + 3]
+
+    return data_uri, f'#{red:02x}{green:02x}{blue:02x}'
+
+
+def _check_pixel_count(image: Image.Image, max_pixels: int) -> None:
+    """Make sure the given (not yet loaded) image isn't too big to be decoded.
+
+    Raises:
+        Image.DecompressionBombError: if it has more than `max_pixels` pixels.
+    """
+    pixel_count = image.width * image.height
+    if pixel_count > max_pixels:
+        raise Image.DecompressionBombError(
+            f'Image has {pixel_count} pixels, more than the limit of {max_pixels}'
+        )
+
+
+def read_image_size(path: str, max_pixels: int) -> tuple[int, int]:
+    """Return the (width, height) of the image at `path`, reading only its header.
+
+    Raises:
+        PIL.UnidentifiedImageError: if it's not an image Pillow can open.
+        Image.DecompressionBombError: if it has more than `max_pixels` pixels.
+    """
+    with Image.open(path) as image:
+        _check_pixel_count(image, max_pixels)
+        return image.size
+
+
+def probe_image_size(header: bytes, max_pixels: int) -> tuple[int, int] | None:
+    """Return the (width, height) of an image from only the start of its file (e.g.
+    while it's still being uploaded), or None if that's not enough to tell, or it's
+    not an image Pillow can open.
+
+    Raises:
+        Image.DecompressionBombError: if it has more than `max_pixels` pixels.
+    """
+    try:
+        image = Image.open(io.BytesIO(header))
+    except Image.DecompressionBombError:
+        raise
+    except Exception:
+        # cut off before its dimensions, most likely
+        return None
+
+    with image:
+        _check_pixel_count(image, max_pixels)
+        return image.size
+
+
+def _draft(
+    image: Image.Image, size: tuple[int, int], reducing_gap: float | None
+) -> None:
+    """Let the given (not yet loaded) image be decoded at a reduced scale, as long as
+    it's still `reducing_gap` times as big as `size`.
+
+    Only JPEGs support this (at 1/2, 1/4 or 1/8 scale), and it's much faster than
+    decoding at full scale: a 48-megapixel photo decoded at 1/4 scale is only 3
+    megapixels. Other formats are left alone.
+
+    The same gap is given to Pillow's resizing, which first reduces images with a
+    fast box filter down to `reducing_gap` times the target size. The lower the gap,
+    the faster (and lower quality) it is; if None, images are always decoded and
+    resized at full quality.
+    """
+    if reducing_gap is not None:
+        image.draft(
+            None,
+            (math.ceil(size[0] * reducing_gap), math.ceil(size[1] * reducing_gap))
+        )
+
+
+def rendition_widths(original_width: int, ladder: Iterable[int]) -> list[int]:
+    """Return the widths to render an image of the given width at.
+
+    Images are never upscaled: ladder steps wider than the image are skipped, and
+    the widest rendition is either the image's own width or the ladder's top.
+    """
+    ladder = sorted(ladder)
+    widths = [width for width in ladder if width < original_width]
+    widest = min(original_width, ladder[-1])
+    if widest not in widths:
+        widths.append(widest)
+    return widths
+
+
+def _resizable(image: Image.Image) -> Image.Image:
+    """Return the image in a mode that can be resized smoothly (RGB or RGBA)."""
+    if image.mode in ('RGB', 'RGBA'):
+        return image
+    return image.convert('RGBA' if image.has_transparency_data else 'RGB')
+
+
+def _savable(image: Image.Image, pillow_format: str) -> Image.Image:
+    """Return the image in a mode the given Pillow format can save."""
+    if pillow_format == 'JPEG' and image.mode != 'RGB':
+        return image.convert('RGB')
+    return image
+
+
+def _save_renditions(
+    image: Image.Image,
+    original_size: tuple[int, int],
+    directory: str,
+    name: str,
+    widths: Iterable[int],
+    formats: Iterable[str],
+    reducing_gap: float | None,
+) -> tuple[list[dict[str, Any]], Image.Image]:
+    """Save resized and re-encoded copies of the given image to `directory`.
+
+    Each rendition is resized from the previous, bigger one rather than from the
+    image itself, which is much cheaper and just as good.
+
+    Args:
+        original_size: The image's size before being drafted (see _draft()).
+        reducing_gap: See _draft().
+
+    Returns:
+        Every rendition as a dict with its 'width', 'height', 'format' and
+        'filename'; and the smallest rendition's image.
+    """
+    original_width, original_height = original_size
+    resized = _resizable(image)
+
+    renditions = []
+    for width in sorted(widths, reverse=True):
+        height = max(1, round(original_height * width / original_width))
+        if resized.size != (width, height):
+            resized = resized.resize(
+                (width, height), Image.Resampling.LANCZOS, reducing_gap=reducing_gap
+            )
+
+        for rendition_format in formats:
+            _, pillow_format, options = IMAGE_ENCODERS[rendition_format]
+            filename = f'{name}-{width}w.{rendition_format}'
+            _savable(resized, pillow_format).save(
+                os.path.join(directory, filename), pillow_format, **options
+            )
+
+            renditions.append({
+                'width': width,
+                'height': height,
+                'format': rendition_format,
+                'filename': filename,
+            })
+
+    return renditions, resized
+
+
+def process_media(
+    media_path: str,
+    thumbnail_path: str,
+    renditions_directory: str,
+    rendition_ladder: Sequence[int],
+    rendition_formats: Sequence[str],
+    reducing_gap: float | None,
+    max_pixels: int,
+) -> dict[str, Any]:
+    """Decode the media file at `media_path` once, and save its renditions (see
+    rendition_widths()) to `renditions_directory` and its thumbnail to
+    `thumbnail_path`.
+
+    The file is decoded only as big as the widest rendition needs (see _draft()),
+    the thumbnail is made from the smallest rendition, and the placeholder from the
+    thumbnail.
+
+    Runs inside the media processing pool, so it only takes and returns picklable
+    values.
+
+    Args:
+        reducing_gap: See _draft().
+        max_pixels: The maximum number of pixels the file can have.
+
+    Returns:
+        A dict with how long it all took, in milliseconds ('duration'); the saved
+        renditions ('renditions'; see _save_renditions()); and the file's placeholder
+        ('placeholder') and dominant color ('dominant_color'; see
+        placeholder_from_image()).
+
+    Raises:
+        PIL.UnidentifiedImageError: if it's not an image Pillow can open.
+        Image.DecompressionBombError: if the file has more than `max_pixels` pixels.
+    """
+    start = time.perf_counter()
+
+    # uploads were checked already (see read_image_size()), but not files stored
+    # before the limit was lowered
+    with Image.open(media_path) as image:
+        _check_pixel_count(image, max_pixels)
+
+        original_size = image.size
+        widths = rendition_widths(image.width, rendition_ladder)
+        widest_height = round(image.height * widths[-1] / image.width)
+        _draft(image, (widths[-1], widest_height), reducing_gap)
+
+        name, _ = os.path.splitext(os.path.basename(media_path))
+        renditions, smallest = _save_renditions(
+            image,
+            original_size,
+            renditions_directory,
+            name,
+            widths,
+            rendition_formats,
+            reducing_gap,
+        )
+
+        # the smallest rendition is never smaller than the thumbnail
+        thumbnail = thumbnail_from_image(smallest, reducing_gap)
+        thumbnail.save(thumbnail_path)
+        placeholder, dominant_color = placeholder_from_image(thumbnail)
+
+    return {
+        'duration': (time.perf_counter() - start) * 1000,
+        'renditions': renditions,
+        'placeholder': placeholder,
+        'dominant_color': dominant_color,
+    }
+
+
+def transform_image(
+    source_path: str,
+    destination_path: str,
+    max_width: int | None,
+    max_height: int | None,
+    image_format: str,
+    quality: int | None,
+    reducing_gap: float | None,
+) -> int:
+    """Save the image at `source_path` to `destination_path`, resized to fit the
+    given bounds (keeping its aspect ratio, never upscaling) and encoded in the given
+    format (see IMAGE_ENCODERS).
+
+    Runs inside the media processing pool, so it only takes and returns picklable
+    values.
+
+    Args:
+        max_width: The maximum width, in pixels. If None, only the height is bound.
+        max_height: The maximum height, in pixels. If None, only the width is bound.
+        image_format: The format to encode in.
+        quality: The encoder quality, from 1 to 100; if None (or irrelevant for the
+            format), the format's default is used.
+        reducing_gap: See _draft().
+
+    Returns:
+        The size of the saved file, in bytes.
+    """
+    _, pillow_format, options = IMAGE_ENCODERS[image_format]
+    if quality is not None and 'quality' in options:
+        options = options | {'quality': quality}
+
+    with Image.open(source_path) as image:
+        bounds = (max_width or image.width, max_height or image.height)
+        _draft(image, bounds, reducing_gap)
+        image = _resizable(image)
+        image.thumbnail(bounds, reducing_gap=reducing_gap)
+        _savable(image, pillow_format).save(destination_path, pillow_format, **options)
+
+    return os.path.getsize(destination_path)
+
+
+def negotiate_rendition_format(
+    accept_mimetypes: MIMEAccept, formats: Iterable[str]
+) -> str | None:
+    """Return the first of the given rendition formats that the client explicitly
+    accepts, or None if it accepts none of them.
+
+    Wildcards (such as */*) don't count, as they're sent by clients regardless of
+    what they can decode.
+    """
+    accepted = {
+        mimetype for mimetype, quality in accept_mimetypes if quality > 0
+    }
+    for rendition_format in formats:
+        mimetype, _, _ = IMAGE_ENCODERS[rendition_format]
+        if mimetype in accepted:
+            return rendition_format
+
+    return None
+
+
+def srcset(
+    renditions: Iterable[dict[str, Any]], rendition_format: str | None
+) -> str | None:
+    """Return a srcset attribute value listing the renditions of the given format, or
+    None if there are none.
+    """
+    if rendition_format is None:
+        return None
+
+    candidates = [
+        f"{rendition['url']} {rendition['width']}w"
+        for rendition in sorted(renditions, key=lambda rendition: rendition['width'])
+        if rendition['format'] == rendition_format
+    ]
+    return ', '.join(candidates) or None
+
+
+class _InlineExecutor(Executor):
+    """An Executor that runs every task immediately, in the calling thread."""
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as exception:
+            future.set_exception(exception)
+        return future
+
+
+def create_media_executor(max_workers: int) -> Executor:
+    """Return a pool of `max_workers` worker processes; or, if that's 0, an executor
+    that runs tasks in the calling thread instead."""
+    if max_workers > 0:
+        return ProcessPoolExecutor(max_workers=max_workers)
+    return _InlineExecutor()
+
+
+_media_executor_lock = threading.Lock()
+
+
+def get_media_executor() -> Executor:
+    """Return the app's media processing pool, creating it on first use, and shutting
+    it down when the process exits.
+
+    The pool has `MEDIA_PROCESSING_WORKERS` worker processes; if that's 0, tasks run
+    in the calling thread instead.
+    """
+    executor = current_app.extensions.get('media_executor')
+    if executor is None:
+        # concurrent first uses would each start a pool otherwise
+        with _media_executor_lock:
+            executor = current_app.extensions.get('media_executor')
+            if executor is None:
+                executor = create_media_executor(
+                    current_app.config['MEDIA_PROCESSING_WORKERS']
+                )
+                atexit.register(executor.shutdown)
+                current_app.extensions['media_executor'] = executor
+
+    return executor
@@ -0,0 +1,314 @@
+from collections.abc import Iterator, Sequence
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+import json
+import os
+import tempfile
+from typing import Any
+
+from flask import current_app
+
+from app.dbapi import get_stored_media_hashes, get_user_by_name, import_posts
+from app.imaging import process_media, read_image_size
+from app.models.post import Flow, Post
+from app.storage import MEDIA, RENDITIONS, THUMBNAILS, get_media_storage
+from app.uploads import sniff_image_format, stage_upload, SNIFF_LENGTH
+
+
+@dataclass
+class ImportEntry:
+    """A post to be imported (see read_import_entries())."""
+    source: str
+    """Where it comes from (a file, or a manifest line), to report it by."""
+    files: list[str]
+    """The paths of its media files."""
+    title: str | None = None
+    descriptions: list[str] = field(default_factory=list)
+    """The descriptions of its media files, in the same order (optional)."""
+    flow_names: list[str] = field(default_factory=list)
+    user_name: str | None = None
+    """The name of the user to post it as; if None, the import's."""
+    is_public: bool | None = None
+    """Whether it's public; if None, as set for the import."""
+    error: str | None = None
+    """Why it couldn't be read, if it couldn't (it's then skipped)."""
+
+
+@dataclass
+class ImportResult:
+    """What was imported from a batch of entries (see import_batch())."""
+    post_ids: list[str]
+    file_count: int
+    """How many media files the imported posts have."""
+    failures: list[tuple[ImportEntry, str]]
+    """The entries that weren't imported, and why."""
+
+
+def _is_image_file(path: str) -> bool:
+    with open(path, 'rb') as file:
+        return sniff_image_format(file.read(SNIFF_LENGTH)) is not None
+
+
+def read_import_entries(source: str) -> Iterator[ImportEntry]:
+    """Yield the posts to import from `source`, always in the same order, so an
+    import can be resumed by skipping the ones imported before.
+
+    `source` is either a directory, where every supported image (searched
+    recursively, in name order) is a post of its own; or a manifest, a JSON Lines
+    file where each line is a post, as an object with its 'files' (relative to the
+    manifest's directory) and, optionally, its 'title', 'descriptions', 'flows',
+    'user' and 'is_public'. A line that can't be read is yielded all the same, with
+    its error, so it's reported and counted as done.
+    """
+    if os.path.isdir(source):
+        for directory, subdirectories, filenames in os.walk(source):
+            subdirectories.sort()
+            for filename in sorted(filenames):
+                path = os.path.join(directory, filename)
+                if _is_image_file(path):
+                    yield ImportEntry(path, [path])
+        return
+
+    manifest_directory = os.path.dirname(os.path.abspath(source))
+    with open(source, encoding='utf-8') as manifest:
+        for line_number, line in enumerate(manifest, start=1):
+            if not line.strip():
+                continue
+
+            entry_source = f'{source}:{line_number}'
+            try:
+                post = json.loads(line)
+                yield ImportEntry(
+                    entry_source,
+                    [os.path.join(manifest_directory, path) for path in post['files']],
+                    post.get('title'),
+                    post.get('descriptions', []),
+                    post.get('flows', []),
+                    post.get('user'),
+                    post.get('is_public'),
+                )
+            except json.JSONDecodeError as error:
+                yield ImportEntry(entry_source, [], error=f'invalid JSON: {error}')
+            except KeyError as error:
+                yield ImportEntry(entry_source, [], error=f'missing {error}')
+            except (TypeError, AttributeError):
+                yield ImportEntry(entry_source, [], error='invalid entry')
+
+
+def prepare_import_file(
+    path: str,
+    output_directory: str,
+    rendition_ladder: Sequence[int],
+    rendition_formats: Sequence[str],
+    reducing_gap: float | None,
+    max_pixels: int,
+) -> dict[str, Any]:
+    """Copy the image at `path` to a directory of its own in `output_directory`,
+    named after its contents, and generate its thumbnail and renditions there (see
+    imaging.process_media()).
+
+    Runs inside a process pool, so it only takes and returns picklable values.
+
+    Returns:
+        The results of process_media(), along with where they were generated
+        ('directory'), the copy's name ('filename'), the path of the thumbnail
+        ('thumbnail_path'), and the file's hash ('content_hash'), extension
+        ('extension'), size in bytes ('size') and dimensions in pixels ('width' and
+        'height').
+
+    Raises:
+        ValueError: if it's not a supported image format.
+        PIL.UnidentifiedImageError: if it's not an image Pillow can open.
+        Image.DecompressionBombError: if it has more than `max_pixels` pixels.
+    """
+    directory = tempfile.mkdtemp(dir=output_directory)
+    with open(path, 'rb') as file:
+        # hashed while it's copied, as uploads are
+        staged = stage_upload(file, directory)
+    if staged is None:
+        raise ValueError('Not a supported image format')
+
+    media_path = os.path.join(directory, staged.filename)
+    os.rename(staged.path, media_path)
+    width, height = read_image_size(media_path, max_pixels)
+
+    thumbnail_path = os.path.join(directory, f'thumbnail.{staged.extension}')
+    result = process_media(
+        media_path,
+        thumbnail_path,
+        directory,
+        rendition_ladder,
+        rendition_formats,
+        reducing_gap,
+        max_pixels,
+    )
+
+    return result | {
+        'directory': directory,
+        'filename': staged.filename,
+        'thumbnail_path': thumbnail_path,
+        'content_hash': staged.content_hash,
+        'extension': staged.extension,
+        'size': staged.size,
+        'width': width,
+        'height': height,
+    }
+
+
+def _check_entry(entry: ImportEntry, is_public: bool) -> str | None:
+    """Return why the given entry can't be imported, or None if it can: the same
+    checks as for posts created through the API (see api.routes.api_posts())."""
+    # imported here, as the API isn't needed otherwise
+    from app.api.routes import MAX_DESCRIPTION_LENGTH, flow_regex_pattern
+
+    if entry.error is not None:
+        return entry.error
+    if not entry.files:
+        return 'no files'
+    if entry.title and len(entry.title.strip()) > Post.MAX_TITLE_LENGTH:
+        return 'title too long'
+    if len(entry.descriptions) > len(entry.files):
+        return 'more descriptions than files'
+    for description in entry.descriptions:
+        if description and len(description.strip()) > MAX_DESCRIPTION_LENGTH:
+            return 'description too long'
+    if is_public:
+        if len(entry.flow_names) > Post.MAX_FLOWS_PER_POST:
+            return 'too many flows'
+        for flow_name in entry.flow_names:
+            if not (
+                Flow.MIN_NAME_LENGTH <= len(flow_name) <= Flow.MAX_NAME_LENGTH
+                and flow_regex_pattern.fullmatch(flow_name)
+            ):
+                return f'invalid flow name: {flow_name}'
+
+    return None
+
+
+def import_batch(
+    entries: Sequence[ImportEntry],
+    executor: Executor,
+    user_name: str | None,
+    is_public: bool,
+) -> ImportResult:
+    """Import a batch of posts: process all of their media files in parallel, in
+    `executor`, then store the new ones and create every post at once (see
+    dbapi.import_posts()).
+
+    An entry is skipped (and reported in the result) if it's invalid, or if any of
+    its files can't be processed; the rest of the batch is imported regardless. If
+    the posts can't be created, the files stored for them are deleted.
+
+    Args:
+        user_name: The name of the user to post as, unless set by the entry. If
+            None, posts are anonymous (and can't be public).
+        is_public: Whether posts are public, unless set by the entry.
+    """
+    config = current_app.config
+    storage = get_media_storage()
+    failures = []
+    users = {}
+
+    with tempfile.TemporaryDirectory(dir=config['UPLOADS_STAGING_PATH']) as output:
+        submitted = []
+        for entry in entries:
+            entry_is_public = is_public if entry.is_public is None else entry.is_public
+            error = _check_entry(entry, entry_is_public)
+
+            user = None
+            entry_user_name = entry.user_name or user_name
+            if error is None and entry_user_name is not None:
+                if entry_user_name not in users:
+                    users[entry_user_name] = get_user_by_name(entry_user_name)
+                user = users[entry_user_name]
+                if user is None:
+                    error = f'no such user: {entry_user_name}'
+            if error is None and entry_is_public and user is None:
+                error = 'public posts need a user'
+
+            if error is not None:
+                failures.append((entry, error))
+                continue
+
+            processing = [
+                executor.submit(
+                    prepare_import_file,
+                    path,
+                    output,
+                    config['MEDIA_RENDITION_WIDTHS'],
+                    config['MEDIA_RENDITION_FORMATS'],
+                    config['MEDIA_REDUCING_GAP'],
+                    config['MEDIA_MAX_IMAGE_PIXELS'],
+                ) for path in entry.files
+            ]
+            submitted.append((entry, user, entry_is_public, processing))
+
+        prepared_entries = []
+        for entry, user, entry_is_public, processing in submitted:
+            try:
+                prepared_files = [future.result() for future in processing]
+            except Exception as error:
+                failures.append((entry, f'{type(error).__name__}: {error}'))
+                continue
+            prepared_entries.append((entry, user, entry_is_public, prepared_files))
+
+        # files are named after their contents, so a known file is stored already
+        stored_hashes = get_stored_media_hashes(
+            prepared['content_hash']
+            for *_, prepared_files in prepared_entries
+            for prepared in prepared_files
+        )
+
+        posts = []
+        file_count = 0
+        new_files = []
+        try:
+            for entry, user, entry_is_public, prepared_files in prepared_entries:
+                media_list = []
+                for index, prepared in enumerate(prepared_files):
+                    filename = prepared['filename']
+                    if prepared['content_hash'] not in stored_hashes:
+                        stored_hashes.add(prepared['content_hash'])
+                        directory = prepared['directory']
+                        new_files.append(prepared)
+                        storage.put(MEDIA, filename, os.path.join(directory, filename))
+                        storage.put(THUMBNAILS, filename, prepared['thumbnail_path'])
+                        for rendition in prepared['renditions']:
+                            storage.put(
+                                RENDITIONS,
+                                rendition['filename'],
+                                os.path.join(directory, rendition['filename']),
+                            )
+
+                    description = (
+                        entry.descriptions[index] if index < len(entry.descriptions)
+                        else None
+                    )
+                    # as the API cleans them
+                    description = description.strip() if description else None
+                    media_list.append(prepared | {
+                        'media_url': storage.url(MEDIA, filename),
+                        'thumbnail_url': storage.url(THUMBNAILS, filename),
+                        'description': description,
+                    })
+
+                posts.append({
+                    'user_id': user.id if user is not None else None,
+                    'title': (entry.title.strip() or None) if entry.title else None,
+                    'media_list': media_list,
+                    'is_public': entry_is_public,
+                    'flow_names': list(dict.fromkeys(entry.flow_names)),
+                })
+                file_count += len(media_list)
+
+            post_ids = import_posts(posts) if posts else []
+        except Exception:
+            # nothing references the files that were stored for it
+            for prepared in new_files:
+                storage.delete(MEDIA, prepared['filename'])
+                storage.delete(THUMBNAILS, prepared['filename'])
+                for rendition in prepared['renditions']:
+                    storage.delete(RENDITIONS, rendition['filename'])
+            raise
+
+    return ImportResult(post_ids, file_count, failures)
@@ -0,0 +1,161 @@
+from concurrent.futures import Future
+from contextlib import ExitStack
+from datetime import timedelta
+import os
+import tempfile
+import threading
+from typing import Any
+
+from flask import Flask, current_app
+
+from app.dbapi import claim_media_job, complete_media_job, fail_media_job
+from app.imaging import process_media, get_media_executor
+from app.storage import MEDIA, RENDITIONS, THUMBNAILS, get_media_storage
+
+
+def _submit_media_job(job: dict[str, Any], resources: ExitStack) -> Future:
+    """Start processing a claimed media job (see claim_media_job()) in the media
+    processing pool.
+
+    Its media file is read from a local copy, and its outputs are written to a
+    staging directory (see _finish_media_job()), both kept until `resources` exits.
+    """
+    config = current_app.config
+    try:
+        media_path = resources.enter_context(
+            get_media_storage().local_copy(MEDIA, job['filename'])
+        )
+    except FileNotFoundError as error:
+        failed = Future()
+        failed.set_exception(error)
+        return failed
+
+    job['output_directory'] = resources.enter_context(
+        tempfile.TemporaryDirectory(dir=config['UPLOADS_STAGING_PATH'])
+    )
+    return get_media_executor().submit(
+        process_media,
+        media_path,
+        os.path.join(job['output_directory'], job['filename']),
+        job['output_directory'],
+        config['MEDIA_RENDITION_WIDTHS'],
+        config['MEDIA_RENDITION_FORMATS'],
+        config['MEDIA_REDUCING_GAP'],
+        config['MEDIA_MAX_IMAGE_PIXELS'],
+    )
+
+
+def _finish_media_job(job: dict[str, Any], processing: Future) -> float | None:
+    """Wait for a media job to be processed, put its outputs in the media storage and
+    record its results.
+
+    Returns:
+        How long it took to process, in milliseconds; or None if it failed.
+    """
+    try:
+        result = processing.result()
+    except Exception:
+        current_app.logger.exception('Media job %s failed', job['id'])
+        fail_media_job(job['id'], current_app.config['MEDIA_JOB_MAX_ATTEMPTS'])
+        return None
+
+    # stored before they're recorded, so they exist once the post isn't processing
+    storage = get_media_storage()
+    outputs = [(THUMBNAILS, job['filename'])] + [
+        (RENDITIONS, rendition['filename']) for rendition in result['renditions']
+    ]
+    for kind, filename in outputs:
+        storage.put(kind, filename, os.path.join(job['output_directory'], filename))
+
+    if not complete_media_job(
+        job['id'], result['renditions'], result['placeholder'], result['dominant_color']
+    ):
+        # its media file was deleted while it was being processed
+        for kind, filename in outputs:
+            storage.delete(kind, filename)
+
+    return result['duration']
+
+
+def _run_media_job(job: dict[str, Any]) -> float | None:
+    """Process a claimed media job, waiting for it to finish.
+
+    Returns:
+        How long it took to process, in milliseconds; or None if it failed.
+    """
+    with ExitStack() as resources:
+        return _finish_media_job(job, _submit_media_job(job, resources))
+
+
+def run_pending_media_jobs() -> dict[str, float | None]:
+    """Claim every pending media job and process them all in parallel, waiting for
+    them to finish.
+
+    This is how jobs are run when there are no job workers (`MEDIA_JOB_WORKERS` is
+    0): right after the upload, in its request. `flask media work --once` runs them
+    this way too.
+
+    Returns:
+        How long each job took to process, in milliseconds (None if it failed), by
+        the hash of its media file.
+    """
+    stale_after = timedelta(seconds=current_app.config['MEDIA_JOB_TIMEOUT'])
+
+    with ExitStack() as resources:
+        running = []
+        while (job := claim_media_job(stale_after)) is not None:
+            running.append((job, _submit_media_job(job, resources)))
+
+        return {
+            job['content_hash']: _finish_media_job(job, processing)
+            for job, processing in running
+        }
+
+
+class MediaJobWorker(threading.Thread):
+    """A background thread that keeps running media jobs, one at a time, so uploads
+    don't wait for their thumbnails and renditions."""
+
+    def __init__(self, app: Flask, name: str):
+        super().__init__(name=name, daemon=True)
+        self.app = app
+        self._stopping = threading.Event()
+
+    def stop(self) -> None:
+        """Stop once the current job (if any) is done."""
+        self._stopping.set()
+
+    def run(self) -> None:
+        stale_after = timedelta(seconds=self.app.config['MEDIA_JOB_TIMEOUT'])
+        poll_interval = self.app.config['MEDIA_JOB_POLL_INTERVAL']
+
+        while not self._stopping.is_set():
+            with self.app.app_context():
+                try:
+                    job = claim_media_job(stale_after)
+                    if job is not None:
+                        _run_media_job(job)
+                except Exception:
+                    # keep working: the job will be claimed again once stale
+                    self.app.logger.exception('Media job worker error')
+                    job = None
+
+            if job is None:
+                self._stopping.wait(poll_interval)
+
+
+def start_media_job_workers(
+    app: Flask, count: int | None = None
+) -> list[MediaJobWorker]:
+    """Start `count` media job workers for the given app (by default,
+    `MEDIA_JOB_WORKERS`)."""
+    if count is None:
+        count = app.config['MEDIA_JOB_WORKERS']
+    workers = [
+        MediaJobWorker(app, f'media-job-worker-{index}') for index in range(count)
+    ]
+    for worker in workers:
+        worker.start()
+
+    app.extensions['media_job_workers'] = workers
+    return workers
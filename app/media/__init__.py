@@ -0,0 +1,8 @@
+from flask import Blueprint
+
+
+bp = Blueprint('media', __name__)
+storage_bp = Blueprint('storage', __name__)
+"""Serves the files in the media storage (see app.storage)."""
+
+from app.media import routes, commands
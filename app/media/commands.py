@@ -0,0 +1,168 @@
+import itertools
+import json
+import os
+import time
+
+import click
+from flask import current_app
+
+from app.imaging import create_media_executor
+from app.imports import import_batch, read_import_entries
+from app.jobs import run_pending_media_jobs, start_media_job_workers
+from app.media import bp
+from app.storage import get_media_storage, local_directories, migrate_local_files
+
+
+@bp.cli.command('reshard')
+@click.option(
+    '--workers', default=16, show_default=True,
+    help='How many files are moved at the same time.'
+)
+def reshard(workers):
+    """Move the files in the local upload directories into the media storage.
+
+    With the 'local' storage, this moves the files stored before sharding into their
+    shards; with the 's3' storage, it uploads every local file to the bucket. It's
+    safe to run while the app is up, and to run again if interrupted: files are
+    found wherever they are in the meantime.
+    """
+    start = time.perf_counter()
+
+    def report(moved):
+        elapsed = time.perf_counter() - start
+        click.echo(f'{moved} files moved ({moved / elapsed:.0f} files/s)')
+
+    moved = migrate_local_files(
+        get_media_storage(),
+        local_directories(current_app.config),
+        workers,
+        on_progress=report,
+    )
+    click.echo(f'Done: {moved} files moved in {time.perf_counter() - start:.1f}s')
+
+
+@bp.cli.command('work')
+@click.option(
+    '--workers', type=int,
+    help='How many jobs are run at the same time.  [default: MEDIA_JOB_WORKERS]'
+)
+@click.option('--once', is_flag=True, help='Run the pending jobs, then exit.')
+def work(workers, once):
+    """Run media jobs (generating new files' thumbnails and renditions), until
+    interrupted.
+
+    The app runs them itself, unless it's configured not to (BACKGROUND_WORK=0):
+    then, this is how they're run, as a process of its own. Any number of them can
+    run at the same time, each job being run by a single one.
+    """
+    if once:
+        durations = run_pending_media_jobs()
+        click.echo(f'{len(durations)} media jobs run')
+        return
+
+    job_workers = start_media_job_workers(
+        current_app._get_current_object(),
+        workers or current_app.config['MEDIA_JOB_WORKERS'] or 1,
+    )
+    click.echo(f'Running media jobs with {len(job_workers)} workers')
+    try:
+        for worker in job_workers:
+            worker.join()
+    except KeyboardInterrupt:
+        click.echo('Stopping once the current jobs are done')
+        for worker in job_workers:
+            worker.stop()
+        for worker in job_workers:
+            worker.join()
+
+
+def _read_checkpoint(path: str, source: str) -> int:
+    """Return how many entries of `source` were imported, according to the
+    checkpoint at `path` (0 if there's none)."""
+    try:
+        with open(path, encoding='utf-8') as file:
+            checkpoint = json.load(file)
+    except FileNotFoundError:
+        return 0
+
+    if checkpoint['source'] != source:
+        raise click.UsageError(
+            f"{path} is the checkpoint of another import ({checkpoint['source']})"
+        )
+    return checkpoint['done']
+
+
+def _write_checkpoint(path: str, source: str, done: int) -> None:
+    # replaced whole, so an interrupted import never leaves it half-written
+    partial_path = path + '.part'
+    with open(partial_path, 'w', encoding='utf-8') as file:
+        json.dump({'source': source, 'done': done}, file)
+    os.replace(partial_path, path)
+
+
+@bp.cli.command('import')
+@click.argument('source', type=click.Path(exists=True))
+@click.option('--user', help='The name of the user to post as.')
+@click.option(
+    '--public/--private', default=False, show_default=True,
+    help='Whether posts are public (which requires --user).'
+)
+@click.option(
+    '--checkpoint',
+    help='Where to record the progress, to resume from.  [default: SOURCE.checkpoint]'
+)
+@click.option(
+    '--workers', default=os.cpu_count(), show_default=True,
+    help='How many processes process images at the same time (0 for none).'
+)
+@click.option(
+    '--batch-size', default=200, show_default=True,
+    help='How many posts are created at a time.'
+)
+def import_media(source, user, public, checkpoint, workers, batch_size):
+    """Create posts in bulk from the images in SOURCE.
+
+    SOURCE is either a directory, where every image (searched recursively) becomes
+    a post of its own; or a manifest, a JSON Lines file where each line is a post,
+    such as {"files": ["a.jpg", "b.png"], "title": "...", "descriptions": [...],
+    "flows": [...], "user": "...", "is_public": true}, with files relative to it.
+    The thumbnails and renditions of every image are generated right away.
+
+    Progress is recorded after every batch, so an interrupted import resumes where
+    it left off when run again.
+    """
+    source = os.path.abspath(source)
+    checkpoint = checkpoint or source.rstrip(os.sep) + '.checkpoint'
+    done = _read_checkpoint(checkpoint, source)
+    if done:
+        click.echo(f'Resuming after {done} entries')
+
+    entries = itertools.islice(read_import_entries(source), done, None)
+    executor = create_media_executor(workers)
+
+    start = time.perf_counter()
+    post_count = 0
+    file_count = 0
+    failure_count = 0
+    with executor:
+        while batch := list(itertools.islice(entries, batch_size)):
+            result = import_batch(batch, executor, user, public)
+            for entry, error in result.failures:
+                click.echo(f'Skipped {entry.source}: {error}', err=True)
+
+            done += len(batch)
+            _write_checkpoint(checkpoint, source, done)
+
+            post_count += len(result.post_ids)
+            file_count += result.file_count
+            failure_count += len(result.failures)
+            elapsed = time.perf_counter() - start
+            click.echo(
+                f'{post_count} posts ({file_count} images) imported'
+                f' ({file_count / elapsed:.1f} images/s)'
+            )
+
+    click.echo(
+        f'Done: {post_count} posts ({file_count} images) imported,'
+        f' {failure_count} skipped, in {time.perf_counter() - start:.1f}s'
+    )
@@ -0,0 +1,132 @@
+import os
+import uuid
+
+from flask import current_app, jsonify, request
+
+from app.media import bp, storage_bp
+from app.dbapi import (
+    use_media_cache_entry, add_media_cache_entry, evict_media_cache_entries,
+)
+from app.imaging import (
+    IMAGE_ENCODERS, can_encode, transform_image, get_media_executor
+)
+from app.storage import MEDIA, get_media_storage, send_media_file
+
+
+TRANSFORM_ARGS = frozenset({'w', 'h', 'fmt', 'q'})
+
+
+def _int_arg(name: str) -> int | None:
+    """Return the given query argument as an int, or None if missing.
+
+    Raises:
+        ValueError: if it's not an integer.
+    """
+    value = request.args.get(name)
+    return int(value) if value else None
+
+
+@bp.route('/<name>')
+def serve_media(name):
+    """Serve a stored media file; or, if any of the w (max width), h (max height), fmt
+    (format) and q (quality) query arguments are given, a copy transformed
+    accordingly, cached on first request.
+
+    Any other query argument is rejected, rather than taken as a transformation
+    which changes nothing (but still makes a copy).
+    """
+    storage = get_media_storage()
+    if not storage.exists(MEDIA, name):
+        return '', 404
+
+    if not request.args.keys() <= TRANSFORM_ARGS:
+        return jsonify({'error': 'invalid_transform'}), 400
+    if not any(request.args.get(arg) for arg in TRANSFORM_ARGS):
+        return storage.serve(MEDIA, name)
+
+    try:
+        width = _int_arg('w')
+        height = _int_arg('h')
+        quality = _int_arg('q')
+    except ValueError:
+        return jsonify({'error': 'invalid_transform'}), 400
+
+    allowed_sizes = current_app.config['MEDIA_TRANSFORM_SIZES']
+    if (
+        (width is not None and width not in allowed_sizes)
+        or (height is not None and height not in allowed_sizes)
+    ):
+        return jsonify({'error': 'invalid_size'}), 400
+
+    if (
+        quality is not None
+        and quality not in current_app.config['MEDIA_TRANSFORM_QUALITIES']
+    ):
+        return jsonify({'error': 'invalid_quality'}), 400
+
+    stem, extension = os.path.splitext(name)
+    image_format = request.args.get('fmt') or extension.lstrip('.')
+    if image_format not in IMAGE_ENCODERS or not can_encode(image_format):
+        return jsonify({'error': 'invalid_format'}), 400
+
+    cache_path = current_app.config['MEDIA_CACHE_PATH']
+    cached_name = f'{stem}-w{width or 0}-h{height or 0}-q{quality or 0}.{image_format}'
+    cached_path = os.path.join(cache_path, cached_name)
+
+    mimetype, _, _ = IMAGE_ENCODERS[image_format]
+    max_cache_size = current_app.config['MEDIA_CACHE_MAX_BYTES']
+    if not use_media_cache_entry(cached_name) or not os.path.isfile(cached_path):
+        # written elsewhere first, so a concurrent request never serves half a file
+        staging_path = os.path.join(cache_path, f'{uuid.uuid4().hex}.{image_format}')
+        try:
+            with storage.local_copy(MEDIA, name) as media_path:
+                size = get_media_executor().submit(
+                    transform_image,
+                    media_path,
+                    staging_path,
+                    width,
+                    height,
+                    image_format,
+                    quality,
+                    current_app.config['MEDIA_REDUCING_GAP'],
+                ).result()
+        except FileNotFoundError:
+            return '', 404
+
+        if size > max_cache_size:
+            # bigger than the whole cache: served anyway, just not kept
+            return send_media_file(
+                staging_path, f'cache/{cached_name}', mimetype, is_temporary=True
+            )
+
+        os.replace(staging_path, cached_path)
+        add_media_cache_entry(cached_name, size)
+
+        is_evicted = False
+        for evicted_name in evict_media_cache_entries(max_cache_size):
+            if evicted_name == cached_name:
+                # evicted right away, to get the cache down to its low watermark:
+                # not kept either, once served
+                is_evicted = True
+                continue
+            try:
+                os.remove(os.path.join(cache_path, evicted_name))
+            except FileNotFoundError:
+                pass
+
+        if is_evicted:
+            return send_media_file(
+                cached_path, f'cache/{cached_name}', mimetype, is_temporary=True
+            )
+
+    return send_media_file(cached_path, f'cache/{cached_name}', mimetype)
+
+
+@storage_bp.route('/<any(media, thumbnails, renditions):kind>/<filename>')
+def serve_stored_file(kind, filename):
+    """Serve a file in the media storage, wherever it's stored (see
+    app.storage.MediaStorage.serve())."""
+    try:
+        return get_media_storage().serve(kind, filename)
+    except FileNotFoundError:
+        return '', 404
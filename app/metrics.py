@@ -0,0 +1,70 @@
+from collections import defaultdict
+import threading
+
+from flask import current_app
+
+
+class Metrics:
+    """Counters, gauges and summaries of what the app does, to be scraped in the
+    Prometheus text format.
+
+    They're kept in memory, per process: with several worker processes, each one
+    reports its own.
+    """
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._counters: dict[tuple[str, tuple], float] = defaultdict(float)
+        self._summaries: dict[str, list[float]] = {}
+        self._gauges: dict[tuple[str, tuple], float] = {}
+
+    @staticmethod
+    def _labels_key(labels: dict[str, str]) -> tuple:
+        return tuple(sorted(labels.items()))
+
+    def increment(self, name: str, amount: float = 1, **labels: str) -> None:
+        """Add to a counter."""
+        with self._lock:
+            self._counters[(name, self._labels_key(labels))] += amount
+
+    def observe(self, name: str, value: float) -> None:
+        """Record a value of a summary (how many, their sum and the largest)."""
+        with self._lock:
+            summary = self._summaries.setdefault(name, [0, 0, value])
+            summary[0] += 1
+            summary[1] += value
+            summary[2] = max(summary[2], value)
+
+    def set_gauge(self, name: str, value: float, **labels: str) -> None:
+        """Set a gauge."""
+        with self._lock:
+            self._gauges[(name, self._labels_key(labels))] = value
+
+    def _line(self, name: str, labels: tuple, value: float) -> str:
+        label_text = ','.join(f'{key}="{label}"' for key, label in labels)
+        if label_text:
+            label_text = '{' + label_text + '}'
+        if float(value).is_integer():
+            value = int(value)
+        return f'{self.prefix}_{name}{label_text} {value}'
+
+    def render(self) -> str:
+        """Return every metric, in the Prometheus text format."""
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self._gauges.items()):
+                lines.append(self._line(name, labels, value))
+            for (name, labels), value in sorted(self._counters.items()):
+                lines.append(self._line(name, labels, value))
+            for name, (count, total, largest) in sorted(self._summaries.items()):
+                lines.append(self._line(f'{name}_count', (), count))
+                lines.append(self._line(f'{name}_sum', (), total))
+                lines.append(self._line(f'{name}_max', (), largest))
+
+        return '\n'.join(lines) + '\n'
+
+
+def get_metrics() -> Metrics:
+    """Return the app's metrics."""
+    return current_app.extensions['metrics']
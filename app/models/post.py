@@ -1,9 +1,13 @@
 from collections.abc import Iterable
+from datetime import datetime
 import random
 import string
 
+from sqlalchemy import event
+
 from app.extensions import db
 from app.models.util import utcnow
+from app.storage import RENDITIONS, get_media_storage
 
 
 _post_id_charset = string.ascii_letters + string.digits # a-z A-Z 0-9
@@ -21,6 +25,16 @@ class Post(db.Model):
     POST_ID_LENGTH = 8
     MAX_TITLE_LENGTH = 128
     MAX_FLOWS_PER_POST = 3
+    __table_args__ = (
+        # the feeds, in each sorting (see dbapi._SORT_KEYS)
+        db.Index('ix_Post_public_newest', 'is_public', 'created_on', 'id'),
+        db.Index('ix_Post_public_top', 'is_public', 'score', 'created_on', 'id'),
+        # user profiles
+        db.Index('ix_Post_user_newest', 'user_id', 'is_public', 'created_on', 'id'),
+        db.Index(
+            'ix_Post_user_top', 'user_id', 'is_public', 'score', 'created_on', 'id'
+        ),
+    )
     id = db.Column(db.Integer, primary_key=True)
     post_id = db.Column(db.String(POST_ID_LENGTH), unique=True, nullable=False)
     """The post ID string used in URLs."""
@@ -28,8 +42,8 @@ class Post(db.Model):
     """The ID of the user who made the post."""
     title = db.Column(db.String(MAX_TITLE_LENGTH), nullable=True)
     """The post title (optional)."""
-    media = db.relationship('PostMedia', backref='post')
-    """One or more media files."""
+    media = db.relationship('PostMedia', backref='post', order_by='PostMedia.id')
+    """One or more media files, in the order they were added."""
     thumbnail_url = db.Column(db.String(128), nullable=False)
     """The URL of the auto-generated thumbnail, based on the 1st media item."""
     score = db.Column(db.Integer, nullable=False)
@@ -49,6 +63,14 @@ class Post(db.Model):
     the URL)."""
     flows = db.relationship('Flow', secondary='PostFlow', backref='posts')
     """The flows this post belongs to."""
+    is_processing = db.Column(db.Boolean, nullable=False, default=False)
+    """Whether the thumbnail or renditions of any of the post's media are still being
+    generated (see MediaJob)."""
+    cover_hash = db.Column(
+        db.String(64), db.ForeignKey('MediaObject.content_hash'), nullable=True
+    )
+    """The hash of the stored file of the 1st media item, which the thumbnail is
+    based on. None for posts made before files were content-addressed."""
 
     def __init__(
         self,
@@ -70,11 +92,282 @@ class Post(db.Model):
         self.views = 0
         self.is_public = is_public
         self.flows = flows
+        self.is_processing = False
 
     def __repr__(self):
         return f'<Post title:"{self.title}" id:{self.id} post_id:{self.post_id}>'
 
 
+POST_TITLE_SEARCH = 'PostTitleSearch'
+"""The full-text index of post titles: on SQLite, an FTS5 table of the same name
+(whose rowid is the post's id); on MariaDB, a FULLTEXT index of Post.title."""
+
+_SQLITE_TITLE_SEARCH_DDL = (
+    f"""CREATE VIRTUAL TABLE {POST_TITLE_SEARCH} USING fts5(
+        title, content='Post', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    # an external content table, so it's kept in sync with Post by triggers
+    f"""CREATE TRIGGER {POST_TITLE_SEARCH}_insert AFTER INSERT ON Post BEGIN
+        INSERT INTO {POST_TITLE_SEARCH}(rowid, title) VALUES (new.id, new.title);
+    END""",
+    f"""CREATE TRIGGER {POST_TITLE_SEARCH}_delete AFTER DELETE ON Post BEGIN
+        INSERT INTO {POST_TITLE_SEARCH}({POST_TITLE_SEARCH}, rowid, title)
+            VALUES ('delete', old.id, old.title);
+    END""",
+    f"""CREATE TRIGGER {POST_TITLE_SEARCH}_update AFTER UPDATE OF title ON Post BEGIN
+        INSERT INTO {POST_TITLE_SEARCH}({POST_TITLE_SEARCH}, rowid, title)
+            VALUES ('delete', old.id, old.title);
+        INSERT INTO {POST_TITLE_SEARCH}(rowid, title) VALUES (new.id, new.title);
+    END""",
+    # index the posts already there
+    f"INSERT INTO {POST_TITLE_SEARCH}({POST_TITLE_SEARCH}) VALUES ('rebuild')",
+)
+
+
+def create_title_search_index(connection: db.Connection) -> bool:
+    """Create the full-text index of post titles (see POST_TITLE_SEARCH), if it's
+    missing. The database keeps it up to date from then on.
+
+    Returns:
+        Whether it was created.
+    """
+    if connection.dialect.name == 'sqlite':
+        is_missing = connection.exec_driver_sql(
+            'SELECT 1 FROM sqlite_master WHERE name = ?', (POST_TITLE_SEARCH,)
+        ).first() is None
+        statements = _SQLITE_TITLE_SEARCH_DDL
+    else:
+        is_missing = connection.exec_driver_sql(
+            f"SHOW INDEX FROM Post WHERE Key_name = '{POST_TITLE_SEARCH}'"
+        ).first() is None
+        statements = (f'CREATE FULLTEXT INDEX {POST_TITLE_SEARCH} ON Post (title)',)
+
+    if is_missing:
+        for statement in statements:
+            connection.exec_driver_sql(statement)
+    return is_missing
+
+
+event.listen(
+    Post.__table__,
+    'after_create',
+    lambda target, connection, **kwargs: create_title_search_index(connection),
+)
+
+
+class MediaObject(db.Model):
+    """A stored media file, shared by every media item with the same contents."""
+    __tablename__ = 'MediaObject'
+    CONTENT_HASH_LENGTH = 64
+    content_hash = db.Column(db.String(CONTENT_HASH_LENGTH), primary_key=True)
+    """The SHA-256 hex digest of the file's contents, which also names the file."""
+    extension = db.Column(db.String(8), nullable=False)
+    """The extension of the file's format."""
+    size = db.Column(db.Integer, nullable=False)
+    """The size of the file, in bytes."""
+    width = db.Column(db.Integer, nullable=True)
+    """The width of the image, in pixels."""
+    height = db.Column(db.Integer, nullable=True)
+    """The height of the image, in pixels."""
+    ref_count = db.Column(db.Integer, nullable=False)
+    """How many media items use this file. Once it reaches 0, the file is deleted."""
+    created_on = db.Column(db.DateTime, server_default=utcnow())
+    """When the file was first uploaded."""
+    renditions = db.relationship(
+        'MediaRendition', backref='media_object', cascade='all, delete-orphan'
+    )
+    """Resized and re-encoded versions of the file."""
+    is_processing = db.Column(db.Boolean, nullable=False, default=False)
+    """Whether the file's thumbnail and renditions are still being generated."""
+    job = db.relationship(
+        'MediaJob', backref='media_object', cascade='all, delete-orphan', uselist=False
+    )
+    """The job generating the file's thumbnail and renditions, if not done yet."""
+    placeholder = db.Column(db.Text, nullable=True)
+    """A tiny preview of the file, as a data URI, to be shown while it loads; None
+    until it's processed."""
+    dominant_color = db.Column(db.String(7), nullable=True)
+    """The file's dominant color, as a hex color (#rrggbb); None until it's processed.
+    """
+
+    def __init__(
+        self, content_hash: str, extension: str, size: int, width: int, height: int
+    ):
+        self.content_hash = content_hash
+        self.extension = extension
+        self.size = size
+        self.width = width
+        self.height = height
+        self.ref_count = 0
+        self.is_processing = False
+
+    @property
+    def filename(self) -> str:
+        """The name of the stored file (and of its thumbnail)."""
+        return f'{self.content_hash}.{self.extension}'
+
+    def __repr__(self):
+        return (
+            f'<MediaObject content_hash:{self.content_hash} ref_count:{self.ref_count}>'
+        )
+
+
+class MediaJob(db.Model):
+    """A queued job to generate a stored media file's thumbnail and renditions.
+
+    Jobs are deleted once they're done.
+    """
+    __tablename__ = 'MediaJob'
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(
+        db.String(MediaObject.CONTENT_HASH_LENGTH),
+        db.ForeignKey('MediaObject.content_hash'),
+        unique=True,
+        nullable=False
+    )
+    """The hash of the media file to process."""
+    status = db.Column(db.String(8), nullable=False)
+    """Either PENDING, RUNNING or FAILED (after too many attempts)."""
+    attempts = db.Column(db.Integer, nullable=False)
+    """How many times the job was started."""
+    started_on = db.Column(db.DateTime, nullable=True)
+    """When the job was last started."""
+    created_on = db.Column(db.DateTime, server_default=utcnow())
+    """When the job was queued."""
+
+    def __init__(self):
+        self.status = MediaJob.PENDING
+        self.attempts = 0
+
+    def __repr__(self):
+        return f'<MediaJob id:{self.id} status:{self.status}>'
+
+
+class MediaRendition(db.Model):
+    """A resized and re-encoded version of a stored media file."""
+    __tablename__ = 'MediaRendition'
+    id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(
+        db.String(MediaObject.CONTENT_HASH_LENGTH),
+        db.ForeignKey('MediaObject.content_hash'),
+        nullable=False
+    )
+    """The hash of the media file this is a version of."""
+    width = db.Column(db.Integer, nullable=False)
+    """The width, in pixels."""
+    height = db.Column(db.Integer, nullable=False)
+    """The height, in pixels."""
+    format = db.Column(db.String(8), nullable=False)
+    """The format it's encoded in (see imaging.IMAGE_ENCODERS)."""
+    filename = db.Column(db.String(128), nullable=False)
+    """The name of the stored file."""
+
+    __table_args__ = (
+        db.Index('ix_MediaRendition_content_hash', 'content_hash'),
+    )
+
+    def __init__(self, width: int, height: int, format: str, filename: str):
+        self.width = width
+        self.height = height
+        self.format = format
+        self.filename = filename
+
+    @property
+    def url(self) -> str:
+        """The URL of the stored file."""
+        return get_media_storage().url(RENDITIONS, self.filename)
+
+    def __repr__(self):
+        return f'<MediaRendition filename:"{self.filename}" id:{self.id}>'
+
+
+class MediaCacheEntry(db.Model):
+    """A transformed (resized and/or re-encoded) copy of a stored media file, cached
+    on disk."""
+    __tablename__ = 'MediaCacheEntry'
+    filename = db.Column(db.String(128), primary_key=True)
+    """The name of the cached file, which identifies the original and the
+    transformation."""
+    size = db.Column(db.Integer, nullable=False)
+    """The size of the cached file, in bytes."""
+    last_used_on = db.Column(db.DateTime, nullable=False, index=True)
+    """When the cached file was last served (roughly), for evicting the least
+    recently used ones."""
+
+    def __init__(self, filename: str, size: int, last_used_on: datetime):
+        self.filename = filename
+        self.size = size
+        self.last_used_on = last_used_on
+
+    def __repr__(self):
+        return f'<MediaCacheEntry filename:"{self.filename}" size:{self.size}>'
+
+
+class MediaCacheUsage(db.Model):
+    """The total size of the media cache's entries, kept up to date as they're added
+    and evicted, so that it never has to be added up. There's only ever one row."""
+    __tablename__ = 'MediaCacheUsage'
+    id = db.Column(db.Integer, primary_key=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    """The total size of the cached files, in bytes."""
+
+    def __repr__(self):
+        return f'<MediaCacheUsage size:{self.size}>'
+
+
+class ChunkedUpload(db.Model):
+    """A media file being uploaded in chunks, so the upload can be resumed after a
+    dropped connection.
+
+    Chunks are written to a staging file (see UPLOADS_STAGING_PATH) as they arrive.
+    Once complete, the upload is finalized: its format is sniffed and its contents
+    hashed, and it can then be included in a post.
+    """
+    __tablename__ = 'ChunkedUpload'
+    UPLOAD_ID_LENGTH = 32
+    upload_id = db.Column(db.String(UPLOAD_ID_LENGTH), primary_key=True)
+    """The random upload ID string used in URLs; it's also the staging file's name."""
+    user_id = db.Column(db.Integer, db.ForeignKey('User.id'), nullable=True)
+    """The ID of the user uploading the file; None if they're not logged in."""
+    size = db.Column(db.Integer, nullable=False)
+    """The size of the whole file, in bytes."""
+    offset = db.Column(db.Integer, nullable=False)
+    """How many bytes have been received so far."""
+    receiving_since = db.Column(db.DateTime, nullable=True)
+    """When the chunk being received (from `offset` on) started to arrive; None if
+    there's none. Only one chunk is written at a time."""
+    content_hash = db.Column(db.String(MediaObject.CONTENT_HASH_LENGTH), nullable=True)
+    """The SHA-256 hex digest of the file's contents; None until finalized."""
+    extension = db.Column(db.String(8), nullable=True)
+    """The extension of the file's format; None until finalized."""
+    created_on = db.Column(db.DateTime, server_default=utcnow(), index=True)
+    """When the upload was started."""
+    updated_on = db.Column(db.DateTime, onupdate=utcnow(), index=True)
+    """When a chunk last started or finished arriving (or the upload was finalized);
+    None if none did yet. It expires this long after (see UPLOAD_EXPIRY)."""
+
+    def __init__(self, upload_id: str, user_id: int | None, size: int):
+        self.upload_id = upload_id
+        self.user_id = user_id
+        self.size = size
+        self.offset = 0
+
+    @property
+    def is_finalized(self) -> bool:
+        """Whether the upload is complete, and can be included in a post."""
+        return self.content_hash is not None
+
+    def __repr__(self):
+        return (
+            f'<ChunkedUpload upload_id:{self.upload_id} offset:{self.offset}'
+            f' size:{self.size}>'
+        )
+
+
 class PostMedia(db.Model):
     """A media item belonging to a post."""
     __tablename__ = 'PostMedia'
@@ -85,6 +378,21 @@ class PostMedia(db.Model):
     """An optional description."""
     post_id = db.Column(db.String(Post.POST_ID_LENGTH), db.ForeignKey('Post.post_id'))
     """The ID of the post this media item belongs to."""
+    content_hash = db.Column(
+        db.String(MediaObject.CONTENT_HASH_LENGTH),
+        db.ForeignKey('MediaObject.content_hash'),
+        nullable=True
+    )
+    """The hash of the stored file, which may be shared with other media items. None
+    for media uploaded before files were content-addressed."""
+    media_object = db.relationship('MediaObject')
+    """The stored file."""
+
+    __table_args__ = (
+        db.Index('ix_PostMedia_post_id', 'post_id'),
+        # finding the posts a file is in, once processed or released
+        db.Index('ix_PostMedia_content_hash', 'content_hash'),
+    )
 
     def __repr__(self):
         return f'<Media media_url:"{self.media_url}" id:{self.id} post_id:{self.post_id}>'
@@ -110,6 +418,15 @@ class PostComment(db.Model):
     post_id = db.Column(db.String(Post.POST_ID_LENGTH), db.ForeignKey('Post.post_id'))
     """The post this comment belongs to."""
 
+    __table_args__ = (
+        # the comments (parent_id is NULL) and the replies of a post, in each sorting
+        db.Index('ix_PostComment_newest', 'post_id', 'parent_id', 'created_on', 'id'),
+        db.Index(
+            'ix_PostComment_most_liked',
+            'post_id', 'parent_id', 'score', 'created_on', 'id'
+        ),
+    )
+
     def __init__(
         self,
         user_id: int,
@@ -174,6 +491,19 @@ class Flow(db.Model):
     """The name of the flow."""
     post_count = db.Column(db.Integer, nullable=False)
     """How many posts belong to this flow."""
+    top_post_id = db.Column(db.Integer, db.ForeignKey('Post.id'), nullable=True)
+    """The ID of the flow's highest-scored post (the newest, among equals); None if
+    it has no posts. Kept up to date as posts are added, upvoted and deleted (see
+    dbapi.reconcile_flow_top_posts())."""
+    thumbnail_url = db.Column(db.String(128), nullable=True)
+    """The thumbnail URL of the flow's top post, which is the flow's thumbnail."""
+
+    __table_args__ = (
+        # the overview and suggestions: most posts first, then by name
+        db.Index('ix_Flow_post_count', db.desc('post_count'), 'name'),
+        # finding the flows to update when their top post is unvoted or deleted
+        db.Index('ix_Flow_top_post_id', 'top_post_id'),
+    )
 
     def __init__(self, name: str):
         self.name = name
@@ -187,3 +517,8 @@ class PostFlow(db.Model):
     """The ID of the post in the flow."""
     flow_id = db.Column(db.Integer, db.ForeignKey('Flow.id'), primary_key=True)
     """The ID of the flow the post belongs to."""
+
+    __table_args__ = (
+        # the posts of a flow (the primary key only finds the flows of a post)
+        db.Index('ix_PostFlow_flow_id', 'flow_id', 'post_id'),
+    )
@@ -1,8 +1,10 @@
-from flask import render_template
+from flask import current_app, render_template, request
 from flask_login import current_user
 
 from app.posts import bp
-from app.dbapi import get_post_and_media, increment_post_views
+from app.dbapi import get_post_and_media
+from app.imaging import negotiate_rendition_format, srcset
+from app.view_counts import get_view_counter
 
 
 @bp.route('/<post_id>')
@@ -14,7 +16,17 @@ def show_post(post_id):
     if not full_post:
         return render_template('posts/404.html')
 
-    increment_post_views(post_id)
+    # renditions in the best format the browser says it supports
+    rendition_format = negotiate_rendition_format(
+        request.accept_mimetypes, current_app.config['MEDIA_RENDITION_FORMATS']
+    )
+    for media_item in full_post['media']:
+        media_item['srcset'] = srcset(media_item['renditions'], rendition_format)
+
+    view_counter = get_view_counter()
+    # including the views not written yet, and this one
+    views = full_post['views'] + view_counter.pending(post_id) + 1
+    view_counter.add(post_id)
     return render_template(
         'posts/index.html',
         post_id=full_post['post_id'],
@@ -22,9 +34,9 @@ def show_post(post_id):
         post_title=full_post['title'],
         post_score=full_post['score'],
         post_comment_count=full_post['comment_count'],
-        post_views=full_post['views'] + 1, # because it was just viewed
+        post_views=views,
         post_created_on=full_post['created_on'].isoformat() + 'Z',
         media=full_post['media'],
         flows=full_post['flows'],
         has_upvote=full_post['has_upvote'],
-    )
+    ), {'Vary': 'Accept'}
@@ -0,0 +1,90 @@
+import click
+from flask.cli import AppGroup
+from sqlalchemy.schema import CreateColumn
+
+from app.extensions import db
+from app.models.post import POST_TITLE_SEARCH, create_title_search_index
+
+
+db_cli = AppGroup('db', help='Manage the database schema.')
+
+
+def _column_definition(column: db.Column, dialect) -> str:
+    """Return the DDL adding `column` to an existing table.
+
+    Rows that are already there get the column's server default or, failing that,
+    its Python default, if it has a constant one.
+    """
+    definition = str(CreateColumn(column).compile(dialect=dialect))
+    default = column.default
+    if column.server_default is None and default is not None and default.is_scalar:
+        value = db.literal(default.arg, column.type).compile(
+            dialect=dialect, compile_kwargs={'literal_binds': True}
+        )
+        definition += f' DEFAULT {value}'
+    return definition
+
+
+def upgrade_schema() -> list[str]:
+    """Bring the database schema up to date with the models, without losing any
+    data: create the missing tables, then add the missing columns and indexes to the
+    existing ones, and the full-text index of post titles.
+
+    Nothing is ever dropped or altered, so it's safe to run again, and on a database
+    that's up to date already.
+
+    Returns:
+        What was created, as "table", "table.column" or "table.index".
+    """
+    created = []
+    inspector = db.inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                # along with its indexes
+                table.create(connection)
+                created.append(table.name)
+                continue
+
+            existing_columns = {
+                column['name'] for column in inspector.get_columns(table.name)
+            }
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                table_name = connection.dialect.identifier_preparer.quote(table.name)
+                definition = _column_definition(column, connection.dialect)
+                connection.execute(
+                    db.text(f'ALTER TABLE {table_name} ADD COLUMN {definition}')
+                )
+                created.append(f'{table.name}.{column.name}')
+
+            existing_indexes = {
+                index['name'] for index in inspector.get_indexes(table.name)
+            }
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(connection)
+                    created.append(f'{table.name}.{index.name}')
+
+        # not one of the models' indexes, as it's made differently on each database
+        if create_title_search_index(connection):
+            created.append(f'Post.{POST_TITLE_SEARCH}')
+
+    return created
+
+
+@db_cli.command('upgrade')
+def upgrade():
+    """Create the missing tables, columns and indexes.
+
+    Run after updating the app: new tables are created on startup, but new columns
+    and indexes of existing tables are not. Creating an index on a large table can
+    take a while, and may block writes to it in the meantime.
+    """
+    created = upgrade_schema()
+    for name in created:
+        click.echo(f'Created {name}')
+    click.echo('Done: the schema is up to date' if created else 'Already up to date')
@@ -19,6 +19,17 @@ const Api = {
         setPostSorting(sorting) {
             return localStorage.setItem(this._POST_SORTING_KEY, sorting);
         },
+
+        // searches have a sorting of their own, which the other listings lack
+        _SEARCH_SORTING_KEY: 'search-sorting',
+
+        getSearchSorting() {
+            return localStorage.getItem(this._SEARCH_SORTING_KEY);
+        },
+
+        setSearchSorting(sorting) {
+            return localStorage.setItem(this._SEARCH_SORTING_KEY, sorting);
+        },
     },
 
 
@@ -35,32 +46,127 @@ const Api = {
 
     // -- posts --
 
-    fetchPublicPostsByPage(page, sorting) {
-        return fetch(`/api/posts?page=${page}&sort=${sorting}`);
+    // listings are fetched a page at a time: each page's response has the cursor
+    // of the next one (if any) in its X-Next-Cursor header. the first page has no
+    // cursor
+    _cursorParameter(cursor) {
+        return cursor ? `&cursor=${encodeURIComponent(cursor)}` : '';
     },
 
-    searchPublicPostsByPage(title, page, sorting) {
+    fetchPublicPosts(cursor, sorting) {
+        return fetch(`/api/posts?sort=${sorting}` + this._cursorParameter(cursor));
+    },
+
+    searchPublicPosts(title, cursor, sorting) {
         return fetch(
             '/api/posts'
             + `?title=${encodeURIComponent(title)}`
-            + `&page=${page}`
             + `&sort=${sorting}`
+            + this._cursorParameter(cursor)
         );
     },
 
-    fetchUserPublicPostsByPage(username, page, sorting) {
-        return fetch(`/api/users/${username}/posts?page=${page}&sort=${sorting}`);
+    fetchUserPublicPosts(username, cursor, sorting) {
+        return fetch(
+            `/api/users/${username}/posts?sort=${sorting}`
+            + this._cursorParameter(cursor)
+        );
     },
 
     fetchPost(postId) {
         return fetch(`/api/posts/${postId}`);
     },
 
-    fetchPostCommentsByPage(postId, page, sorting) {
-        return fetch(`/api/posts/${postId}/comments?page=${page}&sort=${sorting}`);
+    fetchPostComments(postId, cursor, sorting) {
+        return fetch(
+            `/api/posts/${postId}/comments?sort=${sorting}`
+            + this._cursorParameter(cursor)
+        );
+    },
+
+    _UPLOAD_CHUNK_SIZE: 4 * 1024 * 1024,
+    _UPLOAD_MAX_RETRIES: 5,
+    _UPLOAD_RETRY_DELAY_MS: 1000,
+
+    async _sendUploadChunk(uploadId, file, offset) {
+        const chunk = file.slice(offset, offset + this._UPLOAD_CHUNK_SIZE);
+        const response = await fetch(`/api/uploads/${uploadId}`, {
+            method: 'PATCH',
+            headers: {
+                'Content-Type': 'application/octet-stream',
+                'Upload-Offset': offset,
+            },
+            body: chunk,
+        });
+
+        const result = await response.json();
+        if (response.ok) {
+            return result.offset;
+        }
+        if (response.status === 409 && result.offset !== undefined) {
+            // the server has more (or less) than we thought: resume from there
+            return result.offset;
+        }
+        const error = new Error(result.error);
+        // rejected for good, e.g. an image that's too large: retrying won't help
+        error.isRejected = response.status === 413
+            || result.error === 'image_too_large';
+        throw error;
+    },
+
+    async _fetchUploadOffset(uploadId) {
+        const response = await fetch(`/api/uploads/${uploadId}`);
+        const upload = await response.json();
+        return upload.offset;
+    },
+
+    // uploads a file in chunks, resuming after dropped connections. resolves to its
+    // upload ID, to be included in a post
+    async uploadFile(file) {
+        const response = await fetch('/api/uploads', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({
+                'filename': file.name,
+                'size': file.size,
+            }),
+        });
+        const upload = await response.json();
+        if (!response.ok) {
+            throw new Error(upload.error);
+        }
+
+        let offset = 0;
+        let retries = 0;
+        while (offset < file.size) {
+            try {
+                offset = await this._sendUploadChunk(upload.upload_id, file, offset);
+                retries = 0;
+            } catch (error) {
+                if (error.isRejected || ++retries > this._UPLOAD_MAX_RETRIES) {
+                    throw error;
+                }
+                await new Promise(resolve => setTimeout(
+                    resolve, this._UPLOAD_RETRY_DELAY_MS * 2 ** (retries - 1)
+                ));
+                // part of the chunk may have arrived before the connection dropped
+                offset = await this._fetchUploadOffset(upload.upload_id)
+                    .catch(() => offset);
+            }
+        }
+
+        const finalized = await fetch(
+            `/api/uploads/${upload.upload_id}/finalize`, { method: 'POST' }
+        );
+        if (!finalized.ok) {
+            throw new Error((await finalized.json()).error);
+        }
+        return upload.upload_id;
     },
 
-    createPost(title, files, isPublic, flows) {
+    async createPost(title, files, isPublic, flows) {
         const formData = new FormData()
         formData.append('title', title);
         formData.append('is_public', isPublic);
@@ -68,9 +174,11 @@ const Api = {
             formData.append('flow', flow)
         }
 
-        for (const file of files) {
-            // TODO: description
-            formData.append('media_file', file.media_file);
+        const uploadIds = await Promise.all(
+            files.map(file => this.uploadFile(file.media_file))
+        );
+        for (const [index, file] of files.entries()) {
+            formData.append('upload_id', uploadIds[index]);
             formData.append('description', file.description);
         }
 
@@ -133,8 +241,11 @@ const Api = {
 
     // -- flows & posts --
 
-    fetchPublicPostsInFlowByPage(flowName, page, sorting) {
-        return fetch(`/api/flows/${flowName}/posts?page=${page}&sort=${sorting}`);
+    fetchPublicPostsInFlow(flowName, cursor, sorting) {
+        return fetch(
+            `/api/flows/${flowName}/posts?sort=${sorting}`
+            + this._cursorParameter(cursor)
+        );
     },
 
 
@@ -1,7 +1,5 @@
 document.addEventListener('DOMContentLoaded', () => {
 
-    const POSTS_PER_PAGE = 20;
-
     // Sorting
     let preferredSorting = Api.Preferences.getPostSorting();
     if (preferredSorting === null) {
@@ -11,10 +9,9 @@ document.addEventListener('DOMContentLoaded', () => {
 
     const gallery = new Gallery({
         containerId: 'gallery',
-        postsPerPage: POSTS_PER_PAGE,
-        fetchDataByPage: (page) => {
-            return Api.fetchPublicPostsInFlowByPage(
-                currentFlow.name, page, Api.Preferences.getPostSorting()
+        fetchPosts: (cursor) => {
+            return Api.fetchPublicPostsInFlow(
+                currentFlow.name, cursor, Api.Preferences.getPostSorting()
             )
         }
     });
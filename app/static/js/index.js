@@ -27,8 +27,6 @@ function createFlowCard(flowName, thumbnailUrl) {
 
 document.addEventListener('DOMContentLoaded', () => {
 
-    const POSTS_PER_PAGE = 20;
-
     // Sorting
     let preferredSorting = Api.Preferences.getPostSorting();
     if (preferredSorting === null) {
@@ -38,9 +36,8 @@ document.addEventListener('DOMContentLoaded', () => {
 
     const gallery = new Gallery({
         containerId: 'gallery',
-        postsPerPage: POSTS_PER_PAGE,
-        fetchDataByPage: (page) => {
-            return Api.fetchPublicPostsByPage(page, Api.Preferences.getPostSorting())
+        fetchPosts: (cursor) => {
+            return Api.fetchPublicPosts(cursor, Api.Preferences.getPostSorting())
         },
     });
 
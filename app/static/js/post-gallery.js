@@ -6,13 +6,18 @@
 class Gallery {
     // amount of pixels from the bottom that, once reached, triggers a fetch
     #SCROLL_FETCH_THRESHOLD = 400;
+    // how often to retry loading the thumbnail of a post still being processed
+    #PROCESSING_RETRY_DELAY_MS = 3000;
 
     #container;
     #macy;
 
     #isFetching = false;
-    #fetchDataByPage = null;
-    #postsPerPage;
+    #fetchPosts = null;
+    // where the next page starts (see Api), or null if there are no more
+    #nextCursor = null;
+    // bumped on every reload, so pages fetched before it are dropped
+    #reloadCount = 0;
 
     #states = {
         FIRST_FETCH:       'first-fetch',
@@ -40,14 +45,13 @@ class Gallery {
             margin: { x: 16, y: 16, },
         });
 
-        this.#fetchDataByPage = options.fetchDataByPage;
-        this.#postsPerPage = options.postsPerPage;
+        this.#fetchPosts = options.fetchPosts;
 
         // ensure the method gets the correct 'this' value when triggered
         this.#scrollHandler = this.#onScroll.bind(this);
         window.addEventListener('scroll', this.#scrollHandler, { passive: true });
 
-        this.#fetchAndAddPostsByPage(0);
+        this.#fetchAndAddPostsByPage(0, null);
     }
 
     #runOnceAllImagesLoad(images, func) {
@@ -60,14 +64,45 @@ class Gallery {
         ).then(func);
     }
 
+    #waitForThumbnail(post, thumbnail, thumbnailUrl) {
+        // its thumbnail doesn't exist until it's processed: keep trying
+        post.classList.add('processing');
+        thumbnail.addEventListener('error', () => {
+            setTimeout(() => {
+                thumbnail.src = `${thumbnailUrl}?retry=${Date.now()}`;
+            }, this.#PROCESSING_RETRY_DELAY_MS);
+        });
+        thumbnail.addEventListener('load', () => {
+            if (post.classList.contains('processing')) {
+                post.classList.remove('processing');
+                this.#macy.recalculate(true, true);
+            }
+        });
+    }
+
     #createPostCard(
-        postId, thumbnailUrl, title, upvotes, commentCount, views, hasUpvote
+        postId, thumbnailUrl, title, upvotes, commentCount, views, hasUpvote,
+        isProcessing, placeholder, dominantColor, coverWidth, coverHeight
     ) {
         const post = document.createElement('a');
         post.className = 'post';
         post.href = `/posts/${postId}`;
 
         const thumbnail = document.createElement('img');
+        if (coverWidth && coverHeight) {
+            // the card's size is known without waiting for the thumbnail
+            thumbnail.width = coverWidth;
+            thumbnail.height = coverHeight;
+            thumbnail.style.aspectRatio = `${coverWidth} / ${coverHeight}`;
+        }
+        if (placeholder) {
+            // shown until the thumbnail loads
+            thumbnail.style.backgroundColor = dominantColor;
+            thumbnail.style.backgroundImage = `url(${placeholder})`;
+        }
+        if (isProcessing) {
+            this.#waitForThumbnail(post, thumbnail, thumbnailUrl);
+        }
         thumbnail.src = thumbnailUrl;
 
         const postInfo = document.createElement('div');
@@ -124,15 +159,27 @@ class Gallery {
                 post.comment_count,
                 post.views,
                 post.has_upvote,
+                post.is_processing,
+                post.placeholder,
+                post.dominant_color,
+                post.cover_width,
+                post.cover_height,
             );
 
-            const image = postCard.firstElementChild;
-            images.push(image);
+            if (!post.cover_width || !post.cover_height) {
+                // only these have to load before they can be laid out
+                const image = postCard.firstElementChild;
+                images.push(image);
+            }
 
             fragment.append(postCard);
         }
 
         this.#container.append(fragment);
+        if (images.length > 0) {
+            // lay out the sized cards now; the rest once their thumbnails load
+            this.#macy.recalculate(true, true);
+        }
 
         this.#runOnceAllImagesLoad(images, () => {
             this.#macy.recalculate(true, true);
@@ -144,7 +191,7 @@ class Gallery {
         });
     }
 
-    #fetchAndAddPostsByPage(page) {
+    #fetchAndAddPostsByPage(page, cursor) {
         this.#isFetching = true;
         this.#container.dataset.currentPage = page;
 
@@ -154,16 +201,26 @@ class Gallery {
             this.#state = this.#states.SUBSEQUENT_FETCH;
         }
 
-        this.#fetchDataByPage(page)
-            .then((response) => response.json())
+        const reloadCount = this.#reloadCount;
+        this.#fetchPosts(cursor)
+            .then((response) => {
+                if (reloadCount !== this.#reloadCount) {
+                    return null;
+                }
+                this.#nextCursor = response.headers.get('X-Next-Cursor');
+                return response.json();
+            })
             .then((posts) => {
+                if (posts === null) {
+                    return;
+                }
+
                 if (page === 0 && posts.length === 0) {
                     this.#state = this.#states.NO_POSTS;
                     return;
                 }
 
-                const isFullPage = posts.length >= this.#postsPerPage;
-                if (!isFullPage) {
+                if (this.#nextCursor === null) {
                     // no more posts to fetch
                     window.removeEventListener(
                         'scroll', this.#scrollHandler, { passive: true }
@@ -176,9 +233,10 @@ class Gallery {
     }
 
     reloadAll() {
+        this.#reloadCount++;
         this.#container.innerHTML = '';
         this.#macy.recalculate(true, true); // reset the height accordingly
-        this.#fetchAndAddPostsByPage(0);
+        this.#fetchAndAddPostsByPage(0, null);
 
         // user might've scrolled it all, which removes the scroll handler. reset it
         window.removeEventListener('scroll', this.#scrollHandler, { passive: true });
@@ -195,7 +253,7 @@ class Gallery {
             this.#isFetching = true;
 
             const nextPage = Number(this.#container.dataset.currentPage) + 1;
-            this.#fetchAndAddPostsByPage(nextPage);
+            this.#fetchAndAddPostsByPage(nextPage, this.#nextCursor);
         }
     }
 }
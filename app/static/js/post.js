@@ -417,7 +417,8 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
 
-    const COMMENTS_PER_PAGE = 30;
+    // where the next page of comments starts, or null if there are no more
+    let nextCommentsCursor = null;
 
     function fetchNextPage() {
         const nextPage = Number(commentsDestination.dataset.currentPage) + 1;
@@ -430,18 +431,18 @@ document.addEventListener('DOMContentLoaded', () => {
     function fetchAndAddComments(page, sorting) {
         commentsDestination.classList.add('loading');
         // TODO: actual loading indicators
-        Api.fetchPostCommentsByPage(
+        Api.fetchPostComments(
             currentPost.post_id,
-            page,
+            page === 0 ? null : nextCommentsCursor,
             Api.Preferences.getCommentSorting()
-        ).then(
-            (response) => response.json()
-        ).then((comments) => {
+        ).then((response) => {
+            nextCommentsCursor = response.headers.get('X-Next-Cursor');
+            return response.json();
+        }).then((comments) => {
             commentsDestination.dataset.currentPage = page;
             addComments(comments);
 
-            const isFullPage = comments.length >= COMMENTS_PER_PAGE;
-            if (!isFullPage) {
+            if (nextCommentsCursor === null) {
                 // no more comments to fetch
                 commentsDestination.dataset.allCommentsFetched = true;
             }
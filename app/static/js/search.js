@@ -29,17 +29,15 @@ function createFlowCard(flowName, thumbnailUrl) {
 
 document.addEventListener('DOMContentLoaded', () => {
 
-    const POSTS_PER_PAGE = 20;
-
     // Sorting
-    let preferredSorting = Api.Preferences.getPostSorting();
+    let preferredSorting = Api.Preferences.getSearchSorting();
     if (preferredSorting === null) {
-        preferredSorting = 'newest';
-        Api.Preferences.setPostSorting(preferredSorting);
+        preferredSorting = 'relevance';
+        Api.Preferences.setSearchSorting(preferredSorting);
     }
 
     const urlParams = new URLSearchParams(window.location.search);
-    const titleQuery = urlParams.get('title').trim();
+    let titleQuery = urlParams.get('title').trim();
     if (!titleQuery) {
         document.location.href = '/';
     }
@@ -47,21 +45,43 @@ document.addEventListener('DOMContentLoaded', () => {
     const searchInput = document.getElementById('search');
     searchInput.value = titleQuery;
     const searchQueryDisplays = document.getElementsByClassName('search-query');
-    for (const element of searchQueryDisplays) {
-        element.textContent = titleQuery;
-        element.title = titleQuery;
+    function displayTitleQuery() {
+        for (const element of searchQueryDisplays) {
+            element.textContent = titleQuery;
+            element.title = titleQuery;
+        }
     }
+    displayTitleQuery();
 
     const gallery = new Gallery({
         containerId: 'gallery',
-        postsPerPage: POSTS_PER_PAGE,
-        fetchDataByPage: (page) => {
-            return Api.searchPublicPostsByPage(
-                titleQuery, page, Api.Preferences.getPostSorting()
+        fetchPosts: (cursor) => {
+            return Api.searchPublicPosts(
+                titleQuery, cursor, Api.Preferences.getSearchSorting()
             )
         },
     });
 
+    // search as you type; words still being typed match the words they start
+    const SEARCH_AS_YOU_TYPE_DELAY_MS = 300;
+    let searchTimeout = null;
+    searchInput.addEventListener('input', () => {
+        clearTimeout(searchTimeout);
+        searchTimeout = setTimeout(() => {
+            const newTitleQuery = searchInput.value.trim();
+            if (!newTitleQuery || newTitleQuery === titleQuery) {
+                return;
+            }
+
+            titleQuery = newTitleQuery;
+            history.replaceState(
+                null, '', `/search?title=${encodeURIComponent(titleQuery)}`
+            );
+            displayTitleQuery();
+            gallery.reloadAll();
+        }, SEARCH_AS_YOU_TYPE_DELAY_MS);
+    });
+
     let currentlySelectedSorting = null;
     const sortingOptions = document.getElementById('posts-sorting').children;
     for (const option of sortingOptions) {
@@ -78,7 +98,7 @@ document.addEventListener('DOMContentLoaded', () => {
             currentlySelectedSorting.classList.remove('selected');
             option.classList.add('selected');
             currentlySelectedSorting = option;
-            Api.Preferences.setPostSorting(option.dataset.sort);
+            Api.Preferences.setSearchSorting(option.dataset.sort);
 
             // need to reload it all
             gallery.reloadAll();
@@ -1,6 +1,5 @@
 
 document.addEventListener('DOMContentLoaded', () => {
-    const POSTS_PER_PAGE = 20;
 
     const createdOn = document.getElementById('created-on');
     createdOn.textContent = new Date(createdOn.textContent).toLocaleDateString();
@@ -9,10 +8,9 @@ document.addEventListener('DOMContentLoaded', () => {
 
     const gallery = new Gallery({
         containerId: 'gallery',
-        postsPerPage: POSTS_PER_PAGE,
-        fetchDataByPage: (page) => {
-            return Api.fetchUserPublicPostsByPage(
-                thisUser.username, page, currentlySelectedSorting.dataset.sort
+        fetchPosts: (cursor) => {
+            return Api.fetchUserPublicPosts(
+                thisUser.username, cursor, currentlySelectedSorting.dataset.sort
             )
         },
     });
@@ -0,0 +1,428 @@
+from abc import ABC, abstractmethod
+from collections.abc import Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AbstractContextManager, contextmanager
+import itertools
+import mimetypes
+import os
+import tempfile
+from typing import Any
+
+from flask import current_app, redirect, request, Response
+from werkzeug.utils import send_file
+from werkzeug.wsgi import ClosingIterator
+
+
+MEDIA = 'media'
+"""Stored media files, named after their contents' hash."""
+THUMBNAILS = 'thumbnails'
+"""Thumbnails of stored media files, named like them."""
+RENDITIONS = 'renditions'
+"""Renditions (resized versions) of stored media files, named after them."""
+STORAGE_KINDS = (MEDIA, THUMBNAILS, RENDITIONS)
+"""The kinds of files kept in the media storage."""
+
+URL_PATH = '/static/uploads'
+"""Where files in the media storage are served from, by kind (see
+app.media.routes.serve_stored_file()). Posts made before the media storage keep
+their URLs, which is where the files used to be served from as static files."""
+
+SHARD_DEPTH = 2
+"""How many levels of directories files are sharded in."""
+SHARD_WIDTH = 2
+"""How many characters of a file's hash name each level of directories."""
+
+
+def shard_path(filename: str) -> str:
+    """Return the relative path a file is sharded to: the first characters of its
+    name (its hash, or the hash of the file it's a version of) as directories.
+
+    For instance, 'e3b0c442...png' is sharded to 'e3/b0/e3b0c442...png', so that no
+    directory holds more than a few thousand files, even with billions of them.
+    """
+    shards = [
+        filename[level * SHARD_WIDTH:(level + 1) * SHARD_WIDTH]
+        for level in range(SHARD_DEPTH)
+    ]
+    return '/'.join(shards + [filename])
+
+
+def _check_filename(filename: str) -> None:
+    """Make sure the given name can't refer to a file outside its kind's storage.
+
+    Raises:
+        FileNotFoundError: if it can.
+    """
+    if (
+        not filename
+        or filename.startswith('.')
+        or '/' in filename
+        or '\\' in filename
+        or len(filename) <= SHARD_DEPTH * SHARD_WIDTH
+    ):
+        raise FileNotFoundError(filename)
+
+
+def send_media_file(
+    path: str, location: str, mimetype: str | None = None, is_temporary: bool = False
+) -> Response:
+    """Return a response serving a local media file (stored, or cached; see
+    app.media.routes.serve_media()), which is never changed once written.
+
+    It's cached by clients for `MEDIA_MAX_AGE` seconds as immutable, with its name as
+    a strong ETag; and it supports conditional and range requests. If
+    `MEDIA_SENDFILE` is set, the file isn't sent by the app at all, but by the front
+    proxy.
+
+    Args:
+        location: The file's path relative to the directories shared with the front
+            proxy, for `MEDIA_SENDFILE = 'x-accel-redirect'` (see
+            MEDIA_ACCEL_REDIRECT_PREFIX).
+        mimetype: The file's MIME type; if None, guessed from its name.
+        is_temporary: Whether to delete the file once it's sent. It's then always
+            sent by the app, as it wouldn't be there anymore for the front proxy.
+    """
+    config = current_app.config
+    filename = os.path.basename(location)
+    if mimetype is None:
+        mimetype, _ = mimetypes.guess_type(filename)
+
+    if config['MEDIA_SENDFILE'] == 'x-accel-redirect' and not is_temporary:
+        # nginx sends the file, handling range requests itself
+        response = current_app.response_class(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = (
+            f"{config['MEDIA_ACCEL_REDIRECT_PREFIX']}/{location}"
+        )
+        response.set_etag(filename)
+        response.make_conditional(request)
+    else:
+        response = send_file(
+            path,
+            request.environ,
+            mimetype=mimetype,
+            etag=filename,
+            # else, it's sent as no-cache: revalidated on every use
+            max_age=config['MEDIA_MAX_AGE'],
+            use_x_sendfile=(
+                config['MEDIA_SENDFILE'] == 'x-sendfile' and not is_temporary
+            ),
+            response_class=current_app.response_class,
+        )
+        if is_temporary:
+            # removed once sent: by the server closing the body, as it's passed
+            # through (not by the response's call_on_close())
+            response.response = ClosingIterator(
+                response.response, lambda: os.remove(path)
+            )
+
+    # named after their contents (or what they were made from): never changed
+    response.cache_control.public = True
+    response.cache_control.max_age = config['MEDIA_MAX_AGE']
+    response.cache_control.immutable = True
+    return response
+
+
+class MediaStorage(ABC):
+    """Where stored media files, and their thumbnails and renditions, are kept.
+
+    Files are written to a local staging file first (to be hashed, checked and
+    processed), then put in the storage by name and kind (see STORAGE_KINDS).
+    """
+
+    @abstractmethod
+    def put(self, kind: str, filename: str, local_path: str) -> None:
+        """Move the file at `local_path` into the storage, replacing any file of the
+        same name and kind."""
+
+    @abstractmethod
+    def local_copy(self, kind: str, filename: str) -> AbstractContextManager[str]:
+        """Return a context manager giving the path of a local copy of a stored file,
+        to be read until it exits.
+
+        Raises:
+            FileNotFoundError: if there's no such file.
+        """
+
+    @abstractmethod
+    def exists(self, kind: str, filename: str) -> bool:
+        """Return whether a file of the given name and kind is stored (False if it's
+        not even a valid name)."""
+
+    @abstractmethod
+    def delete(self, kind: str, filename: str) -> None:
+        """Delete a stored file, if it exists."""
+
+    @abstractmethod
+    def url(self, kind: str, filename: str) -> str:
+        """Return the URL a stored file is served from."""
+
+    @abstractmethod
+    def serve(self, kind: str, filename: str) -> Response:
+        """Return a response serving a stored file (or redirecting to it).
+
+        Raises:
+            FileNotFoundError: if there's no such file.
+        """
+
+
+class LocalMediaStorage(MediaStorage):
+    """Keeps files in a local directory per kind, sharded by their hash (see
+    shard_path()).
+
+    Files stored before sharding, directly in their kind's directory, are still
+    found there until they're moved (see `flask media reshard`).
+    """
+
+    def __init__(self, directories: dict[str, str]):
+        """
+        Args:
+            directories: The directory of each kind of file.
+        """
+        self.directories = directories
+
+    def path(self, kind: str, filename: str) -> str:
+        """Return where a file of the given name and kind is (or would be) stored."""
+        _check_filename(filename)
+        return os.path.join(self.directories[kind], *shard_path(filename).split('/'))
+
+    def find(self, kind: str, filename: str) -> str:
+        """Return the path of a stored file, sharded or not.
+
+        Raises:
+            FileNotFoundError: if there's no such file.
+        """
+        path = self.path(kind, filename)
+        if os.path.isfile(path):
+            return path
+
+        unsharded_path = os.path.join(self.directories[kind], filename)
+        if os.path.isfile(unsharded_path):
+            return unsharded_path
+
+        raise FileNotFoundError(path)
+
+    def put(self, kind: str, filename: str, local_path: str) -> None:
+        path = self.path(kind, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # atomic, and on the same filesystem: never copied
+        os.replace(local_path, path)
+
+    @contextmanager
+    def local_copy(self, kind: str, filename: str) -> Iterator[str]:
+        yield self.find(kind, filename)
+
+    def exists(self, kind: str, filename: str) -> bool:
+        try:
+            self.find(kind, filename)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def delete(self, kind: str, filename: str) -> None:
+        for path in (
+            self.path(kind, filename),
+            os.path.join(self.directories[kind], filename),
+        ):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def url(self, kind: str, filename: str) -> str:
+        return f'{URL_PATH}/{kind}/{filename}'
+
+    def serve(self, kind: str, filename: str) -> Response:
+        path = self.find(kind, filename)
+        location = os.path.relpath(path, self.directories[kind]).replace(os.sep, '/')
+        return send_media_file(path, f'{kind}/{location}')
+
+
+class S3MediaStorage(MediaStorage):
+    """Keeps files in an S3-compatible bucket (AWS S3, MinIO, etc.), keyed by kind and
+    sharded like LocalMediaStorage, and served straight from the bucket's public URL.
+
+    Requires boto3, unless a client is given.
+    """
+
+    _MISSING_CODES = ('404', 'NoSuchKey', 'NotFound')
+    """The error codes of S3 client errors meaning a file doesn't exist."""
+
+    def __init__(
+        self,
+        bucket: str,
+        public_url: str,
+        staging_directory: str,
+        endpoint_url: str | None = None,
+        client: Any = None,
+    ):
+        """
+        Args:
+            bucket: The name of the bucket.
+            public_url: The URL the bucket's objects are publicly served from (the
+                bucket itself or a CDN in front of it).
+            staging_directory: Where local copies of stored files are downloaded to.
+            endpoint_url: The URL of the S3-compatible service; if None, AWS S3.
+            client: The S3 client to use; if None, one is created with boto3, from
+                the environment's credentials.
+        """
+        if client is None:
+            import boto3
+            client = boto3.client('s3', endpoint_url=endpoint_url)
+
+        self.client = client
+        self.bucket = bucket
+        self.public_url = public_url.rstrip('/')
+        self.staging_directory = staging_directory
+
+    @classmethod
+    def _is_missing_error(cls, error: Exception) -> bool:
+        """Return whether the given S3 client error means a file doesn't exist."""
+        response = getattr(error, 'response', None) or {}
+        return response.get('Error', {}).get('Code') in cls._MISSING_CODES
+
+    def key(self, kind: str, filename: str) -> str:
+        """Return the key of a file of the given name and kind."""
+        _check_filename(filename)
+        return f'{kind}/{shard_path(filename)}'
+
+    def put(self, kind: str, filename: str, local_path: str) -> None:
+        mimetype, _ = mimetypes.guess_type(filename)
+        self.client.upload_file(
+            local_path,
+            self.bucket,
+            self.key(kind, filename),
+            ExtraArgs={
+                'ContentType': mimetype or 'application/octet-stream',
+                # named after their contents: never changed
+                'CacheControl': 'public, max-age=31536000, immutable',
+            },
+        )
+        os.remove(local_path)
+
+    @contextmanager
+    def local_copy(self, kind: str, filename: str) -> Iterator[str]:
+        file_descriptor, path = tempfile.mkstemp(
+            suffix=os.path.splitext(filename)[1], dir=self.staging_directory
+        )
+        os.close(file_descriptor)
+        try:
+            try:
+                self.client.download_file(self.bucket, self.key(kind, filename), path)
+            except Exception as error:
+                if self._is_missing_error(error):
+                    raise FileNotFoundError(filename) from error
+                raise
+            yield path
+        finally:
+            os.remove(path)
+
+    def exists(self, kind: str, filename: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key(kind, filename))
+        except FileNotFoundError:
+            return False
+        except Exception as error:
+            if self._is_missing_error(error):
+                return False
+            raise
+        return True
+
+    def delete(self, kind: str, filename: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(kind, filename))
+
+    def url(self, kind: str, filename: str) -> str:
+        return f'{self.public_url}/{self.key(kind, filename)}'
+
+    def serve(self, kind: str, filename: str) -> Response:
+        # for URLs of files that were stored locally
+        return redirect(self.url(kind, filename), 301)
+
+
+def _local_files(directories: dict[str, str]) -> Iterator[tuple[str, str, str]]:
+    """Yield the (kind, filename, path) of every file in the given directory of each
+    kind, sharded or not."""
+    for kind, directory in directories.items():
+        for parent, _, filenames in os.walk(directory):
+            for filename in filenames:
+                yield kind, filename, os.path.join(parent, filename)
+
+
+def migrate_local_files(
+    storage: MediaStorage,
+    directories: dict[str, str],
+    workers: int,
+    on_progress: Callable[[int], None] | None = None,
+    batch_size: int = 1000,
+) -> int:
+    """Move every file in the given local directory of each kind into `storage`, in
+    parallel: unsharded files into their shard, if it's a LocalMediaStorage of the
+    same directories, or into the bucket, if it's an S3MediaStorage.
+
+    Files are listed and moved `batch_size` at a time, so millions of them never
+    have to be listed in memory at once.
+
+    Args:
+        workers: How many files are moved at the same time.
+        on_progress: Called with how many files were moved so far, after every batch.
+
+    Returns:
+        How many files were moved.
+    """
+    def move(local_file: tuple[str, str, str]) -> bool:
+        kind, filename, path = local_file
+        try:
+            if (
+                isinstance(storage, LocalMediaStorage)
+                and storage.path(kind, filename) == path
+            ):
+                return False
+            storage.put(kind, filename, path)
+        except FileNotFoundError:
+            # not a stored file (e.g. a dotfile), or moved by someone else
+            return False
+        return True
+
+    moved = 0
+    files = _local_files(directories)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while batch := list(itertools.islice(files, batch_size)):
+            moved += sum(executor.map(move, batch))
+            if on_progress is not None:
+                on_progress(moved)
+
+    return moved
+
+
+def local_directories(config: dict[str, Any]) -> dict[str, str]:
+    """Return the local directory of each kind of file in the given config."""
+    return {
+        MEDIA: config['UPLOADS_MEDIA_PATH'],
+        THUMBNAILS: config['UPLOADS_THUMBNAILS_PATH'],
+        RENDITIONS: config['UPLOADS_RENDITIONS_PATH'],
+    }
+
+
+def create_media_storage(config: dict[str, Any]) -> MediaStorage:
+    """Return the media storage selected by `MEDIA_STORAGE` in the given config."""
+    match config['MEDIA_STORAGE']:
+        case 'local':
+            return LocalMediaStorage(local_directories(config))
+        case 's3':
+            return S3MediaStorage(
+                config['MEDIA_S3_BUCKET'],
+                config['MEDIA_S3_PUBLIC_URL'],
+                config['UPLOADS_STAGING_PATH'],
+                config['MEDIA_S3_ENDPOINT_URL'],
+            )
+        case storage:
+            raise ValueError(f'Unknown media storage: {storage}')
+
+
+def get_media_storage() -> MediaStorage:
+    """Return the app's media storage, creating it on first use."""
+    storage = current_app.extensions.get('media_storage')
+    if storage is None:
+        storage = create_media_storage(current_app.config)
+        current_app.extensions['media_storage'] = storage
+
+    return storage
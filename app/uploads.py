@@ -0,0 +1,277 @@
+from dataclasses import dataclass
+import hashlib
+import os
+import tempfile
+from typing import BinaryIO
+import uuid
+
+from PIL import Image
+from werkzeug.exceptions import BadRequest, ClientDisconnected, RequestEntityTooLarge
+
+from app.imaging import probe_image_size
+
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+"""How many bytes of an upload are read (and written) at a time."""
+
+_IMAGE_SIGNATURES = (
+    (0, b'\x89PNG\r\n\x1a\n', 'png'),
+    (0, b'\xff\xd8\xff', 'jpg'),
+    (8, b'WEBP', 'webp'),
+)
+"""(offset, magic bytes, extension) of the supported image formats."""
+
+SNIFF_LENGTH = 16
+"""How many bytes from the start of a file are needed to sniff its format."""
+
+
+IMAGE_PROBE_LENGTH = 64 * 1024
+"""How many bytes from the start of an upload are kept to read its dimensions while
+it's still arriving: enough for the header of nearly any image, EXIF included."""
+_FIRST_PROBE_LENGTH = 1024
+"""How many bytes of an upload arrive before its dimensions are first read; each
+further attempt waits for 4 times as many."""
+
+
+class FileTooLarge(RequestEntityTooLarge):
+    description = 'An uploaded file is larger than the limit.'
+
+
+class ImageTooLarge(BadRequest):
+    description = 'An uploaded image has more pixels than the limit.'
+
+
+class LimitedUploadFile:
+    """A file that an upload is written to while it's parsed out of the request,
+    which rejects it as soon as it's known to be too big: once it's over `max_size`
+    bytes, or once its header says it has over `max_pixels` pixels. Either way, the
+    rest of it isn't read.
+
+    The upload is also hashed, and its first bytes kept to sniff its format, as it's
+    written, so that it can be staged without being read again (see stage_upload()).
+
+    Everything but writing is left to the wrapped file.
+    """
+
+    def __init__(self, file: BinaryIO, max_size: int, max_pixels: int):
+        self._file = file
+        self._max_size = max_size
+        self._max_pixels = max_pixels
+        self._size = 0
+        self._header: bytearray | None = bytearray()
+        self._next_probe_length = _FIRST_PROBE_LENGTH
+        self._content_hash = hashlib.sha256()
+        self._start = b''
+
+    def write(self, data: bytes) -> int:
+        """Write to the wrapped file.
+
+        Raises:
+            FileTooLarge: if the upload is now over `max_size` bytes.
+            ImageTooLarge: if the upload's header says it has over `max_pixels`
+                pixels.
+        """
+        self._size += len(data)
+        if self._size > self._max_size:
+            raise FileTooLarge()
+
+        if self._header is not None:
+            self._probe(data)
+        if len(self._start) < SNIFF_LENGTH:
+            self._start += data[:SNIFF_LENGTH - len(self._start)]
+        self._content_hash.update(data)
+
+        return self._file.write(data)
+
+    @property
+    def size(self) -> int:
+        """How many bytes were written."""
+        return self._size
+
+    @property
+    def content_hash(self) -> str:
+        """The SHA-256 hex digest of what was written."""
+        return self._content_hash.hexdigest()
+
+    @property
+    def extension(self) -> str | None:
+        """The extension matching the image format of what was written, or None if
+        it's not a supported format (see sniff_image_format())."""
+        return sniff_image_format(self._start)
+
+    def _probe(self, data: bytes) -> None:
+        """Try to read the dimensions of the upload from what arrived of it so far."""
+        self._header += data[:IMAGE_PROBE_LENGTH - len(self._header)]
+        is_header_full = len(self._header) == IMAGE_PROBE_LENGTH
+        if len(self._header) < self._next_probe_length and not is_header_full:
+            return
+
+        try:
+            image_size = probe_image_size(bytes(self._header), self._max_pixels)
+        except Image.DecompressionBombError:
+            raise ImageTooLarge()
+
+        if image_size is not None or is_header_full:
+            # known to be small enough, or left to be checked once it's stored
+            self._header = None
+        else:
+            self._next_probe_length *= 4
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+def create_upload_file(
+    directory: str, max_size: int, max_pixels: int
+) -> LimitedUploadFile:
+    """Return a file in `directory` for an upload to be written to while it's parsed
+    out of the request (see LimitedUploadFile). It's deleted once closed, which the
+    request does when it ends, unless it was staged (see stage_upload()).
+    """
+    return LimitedUploadFile(
+        tempfile.NamedTemporaryFile(dir=directory, suffix='.upload'),
+        max_size,
+        max_pixels,
+    )
+
+
+def sniff_image_format(header: bytes) -> str | None:
+    """Return the extension matching the image format of the given file header
+    (its first `SNIFF_LENGTH` bytes), or None if it's not a supported format.
+    """
+    for offset, signature, extension in _IMAGE_SIGNATURES:
+        if header[offset:offset + len(signature)] == signature:
+            if extension == 'webp' and not header.startswith(b'RIFF'):
+                continue
+            return extension
+
+    return None
+
+
+@dataclass
+class StagedUpload:
+    """An uploaded file that was written to a staging file, to be put in the media
+    storage (see app.storage)."""
+    filename: str
+    """The name to store it with: its content hash and extension."""
+    path: str
+    """Where it was staged."""
+    extension: str
+    """The extension of its real (sniffed) format."""
+    content_hash: str
+    """The SHA-256 hex digest of its contents."""
+    size: int
+    """Its size, in bytes."""
+
+
+def stage_upload(stream: BinaryIO, directory: str) -> StagedUpload | None:
+    """Write an uploaded file to a staging file in `directory`, reading it only once.
+
+    The stream is read in `UPLOAD_CHUNK_SIZE` chunks; each one is hashed and written
+    to the staging file as it arrives, so the file is never held in memory as a
+    whole. The file is to be stored named after the hash, so uploads with the same
+    contents end up as the same file.
+
+    An upload parsed out of the request into a file in `directory` (see
+    create_upload_file()) was hashed and sniffed already, and isn't read at all: the
+    staging file is a hard link to it, which outlives the request.
+
+    Returns:
+        The staged file, or None if it's not a supported image format (in which case
+        nothing is written).
+    """
+    if isinstance(stream, LimitedUploadFile):
+        extension = stream.extension
+        if extension is None:
+            return None
+
+        stream.flush()
+        staging_path = os.path.join(directory, uuid.uuid4().hex + '.part')
+        os.link(stream.name, staging_path)
+        content_hash = stream.content_hash
+        return StagedUpload(
+            content_hash + '.' + extension,
+            staging_path,
+            extension,
+            content_hash,
+            stream.size,
+        )
+
+    header = stream.read(SNIFF_LENGTH)
+    extension = sniff_image_format(header)
+    if extension is None:
+        return None
+
+    content_hash = hashlib.sha256()
+    staging_path = os.path.join(directory, uuid.uuid4().hex + '.part')
+    size = 0
+
+    with open(staging_path, 'wb') as destination:
+        chunk = header
+        while chunk:
+            content_hash.update(chunk)
+            destination.write(chunk)
+            size += len(chunk)
+            chunk = stream.read(UPLOAD_CHUNK_SIZE)
+
+    hex_digest = content_hash.hexdigest()
+    return StagedUpload(
+        hex_digest + '.' + extension, staging_path, extension, hex_digest, size
+    )
+
+
+def write_upload_chunk(
+    stream: BinaryIO, path: str, offset: int, max_length: int
+) -> tuple[int, bool]:
+    """Write a chunk of a chunked upload to its staging file at `offset`, as it's
+    read from `stream`.
+
+    The stream is read in `UPLOAD_CHUNK_SIZE` chunks, so only that much of the chunk
+    is ever held in memory, however big the chunk or the file.
+
+    Returns:
+        How many bytes were written, and whether the chunk was received as a whole.
+        If the client disconnected midway, whatever was received is kept, so the
+        upload can be resumed from there.
+
+    Raises:
+        ValueError: if the chunk is longer than `max_length`; nothing is kept then.
+    """
+    written = 0
+    is_complete = True
+    with open(path, 'r+b') as destination:
+        destination.seek(offset)
+        # leftovers of an interrupted chunk, past what was recorded as received
+        destination.truncate()
+
+        try:
+            while chunk := stream.read(min(UPLOAD_CHUNK_SIZE, max_length + 1 - written)):
+                written += len(chunk)
+                if written > max_length:
+                    destination.truncate(offset)
+                    raise ValueError(f'Chunk is longer than {max_length} bytes')
+                destination.write(chunk)
+        except ClientDisconnected:
+            is_complete = False
+
+    return written, is_complete
+
+
+def identify_staged_file(path: str) -> tuple[str, str] | None:
+    """Return the extension matching the image format of a complete chunked upload's
+    staging file, and the SHA-256 hex digest of its contents; or None if it's not a
+    supported format.
+
+    The file is read in `UPLOAD_CHUNK_SIZE` chunks, never as a whole.
+    """
+    with open(path, 'rb') as file:
+        header = file.read(SNIFF_LENGTH)
+        extension = sniff_image_format(header)
+        if extension is None:
+            return None
+
+        content_hash = hashlib.sha256(header)
+        while chunk := file.read(UPLOAD_CHUNK_SIZE):
+            content_hash.update(chunk)
+
+    return extension, content_hash.hexdigest()
@@ -0,0 +1,112 @@
+import atexit
+from collections import Counter
+import threading
+
+from flask import Flask, current_app
+
+from app.dbapi import add_post_views
+
+
+class ViewCounter:
+    """Counts post views in memory, and writes them to the database in batches
+    (see dbapi.add_post_views()), so that views don't each need a transaction.
+
+    Views are written every `flush_interval` seconds by a background thread, or
+    earlier if `max_pending_posts` posts have views waiting, and when the app exits.
+    Until then, view counts read from the database are a bit behind.
+    """
+
+    def __init__(self, app: Flask, flush_interval: float, max_pending_posts: int):
+        self.app = app
+        self.flush_interval = flush_interval
+        self.max_pending_posts = max_pending_posts
+        self._pending = Counter()
+        self._lock = threading.Lock()
+        self._flush_needed = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def add(self, post_id: str) -> None:
+        """Count a view of the post of the given ID."""
+        if not self.flush_interval:
+            add_post_views({post_id: 1})
+            return
+
+        with self._lock:
+            self._pending[post_id] += 1
+            is_full = len(self._pending) >= self.max_pending_posts
+        if is_full:
+            self._flush_needed.set()
+
+    def pending(self, post_id: str) -> int:
+        """Return how many views of the post of the given ID weren't written yet."""
+        with self._lock:
+            return self._pending[post_id]
+
+    def flush(self) -> int:
+        """Write the views counted so far to the database.
+
+        If that fails, they're kept, to be written on the next flush.
+
+        Returns:
+            How many posts had views written.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+        if not pending:
+            return 0
+
+        try:
+            with self.app.app_context():
+                add_post_views(pending)
+        except Exception:
+            with self._lock:
+                self._pending.update(pending)
+            raise
+        return len(pending)
+
+    def start(self) -> None:
+        """Start writing views in the background, until the app exits."""
+        self._thread = threading.Thread(
+            target=self._run, name='view-counter', daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self) -> None:
+        """Stop writing views in the background, and write the remaining ones."""
+        self._stopping.set()
+        self._flush_needed.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            self._flush_needed.wait(self.flush_interval)
+            self._flush_needed.clear()
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception('Could not write post views')
+
+
+def init_view_counter(app: Flask) -> ViewCounter:
+    """Create the view counter of the given app (see get_view_counter()). It writes
+    views right away if `VIEW_COUNTER_FLUSH_INTERVAL` is 0, or if there's no
+    `BACKGROUND_WORK` to write them later; otherwise, once it's started (see
+    app.start_background_work())."""
+    flush_interval = app.config['VIEW_COUNTER_FLUSH_INTERVAL']
+    if not app.config['BACKGROUND_WORK']:
+        flush_interval = 0
+    counter = ViewCounter(
+        app, flush_interval, app.config['VIEW_COUNTER_MAX_PENDING_POSTS']
+    )
+
+    app.extensions['view_counter'] = counter
+    return counter
+
+
+def get_view_counter() -> ViewCounter:
+    """Return the app's view counter."""
+    return current_app.extensions['view_counter']
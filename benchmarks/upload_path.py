@@ -0,0 +1,398 @@
+"""Benchmarks of the upload path: checking, staging, reading, processing and encoding
+uploaded images, over a generated corpus of sizes from 0.1 to 50 megapixels in
+every allowed format.
+
+Every case runs in a fresh process, so its peak RSS is its own. Results are
+printed as a table and saved as JSON; given the results of an earlier run, cases
+whose median latency regressed past a threshold are reported, and the run fails.
+
+    python -m benchmarks.upload_path --output results.json
+    python -m benchmarks.upload_path --quick --baseline results.json
+"""
+import argparse
+from collections.abc import Callable, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any
+
+import PIL
+from PIL import Image
+
+from config import Config
+from app.api.routes import is_file_allowed
+from app.imaging import IMAGE_ENCODERS, process_media, read_image_size, transform_image
+from app.uploads import stage_upload
+
+
+CORPUS_MEGAPIXELS = (0.1, 1, 12, 24, 50)
+"""The sizes of the generated images, in megapixels (at a 4:3 aspect ratio)."""
+QUICK_MEGAPIXELS = (0.1, 1)
+CORPUS_FORMATS = {'jpg': 'JPEG', 'png': 'PNG', 'webp': 'WEBP'}
+"""The Pillow format of each allowed extension (see api.routes.ALLOWED_EXTENSIONS;
+'jpeg' is the same format as 'jpg')."""
+CORPUS_SEED = 2024
+"""What the corpus is generated from, so every run benchmarks the same images."""
+DEFAULT_CORPUS_PATH = os.path.join(os.path.dirname(__file__), '.corpus')
+
+ENCODE_WIDTH = 1280
+"""The width images are encoded at (as by a transform or rendition), in pixels."""
+STAGES = ('stage', 'read_size', 'process') + tuple(
+    f'encode_{image_format}' for image_format in IMAGE_ENCODERS
+)
+"""The stages each corpus image goes through. is_file_allowed() is only
+benchmarked once, as it only depends on the filename."""
+
+
+@dataclass
+class BenchmarkResult:
+    case: str
+    stage: str
+    image_format: str | None
+    megapixels: float | None
+    file_size: int | None
+    """The size of the corpus image, in bytes."""
+    iterations: int
+    images_per_second: float
+    p50_ms: float
+    p99_ms: float
+    peak_rss_mib: float
+    """The peak resident memory of the process that ran the case."""
+
+
+def _image_size(megapixels: float) -> tuple[int, int]:
+    width = round(math.sqrt(megapixels * 1_000_000 * 4 / 3))
+    return width, round(width * 3 / 4)
+
+
+def _generate_image(size: tuple[int, int], seed: int) -> Image.Image:
+    """Return an image of the given size that compresses like a photo: smooth
+    gradients (which compress well) with fine-grained detail (which doesn't)."""
+    base = Image.merge('RGB', (
+        Image.linear_gradient('L').resize(size),
+        Image.radial_gradient('L').resize(size),
+        Image.linear_gradient('L').rotate(90).resize(size),
+    ))
+
+    tile_size = 256
+    noise_tile = Image.frombytes(
+        'RGB',
+        (tile_size, tile_size),
+        random.Random(seed).randbytes(tile_size * tile_size * 3),
+    )
+    detail = Image.new('RGB', size)
+    for x in range(0, size[0], tile_size):
+        for y in range(0, size[1], tile_size):
+            detail.paste(noise_tile, (x, y))
+
+    return Image.blend(base, detail, 0.2)
+
+
+def corpus_path(directory: str, megapixels: float, extension: str) -> str:
+    return os.path.join(directory, f'{megapixels:g}mp.{extension}')
+
+
+def generate_corpus(
+    directory: str, megapixels_list: Sequence[float], extensions: Sequence[str]
+) -> None:
+    """Generate the corpus images that aren't in `directory` yet."""
+    os.makedirs(directory, exist_ok=True)
+    for megapixels in megapixels_list:
+        image = None
+        for extension in extensions:
+            path = corpus_path(directory, megapixels, extension)
+            if os.path.exists(path):
+                continue
+
+            if image is None:
+                image = _generate_image(_image_size(megapixels), CORPUS_SEED)
+            partial_path = path + '.part'
+            image.save(partial_path, CORPUS_FORMATS[extension])
+            os.replace(partial_path, path)
+
+
+def _stage_function(stage: str, path: str, output: str) -> Callable[[], None]:
+    """Return a function running the given stage once, on the image at `path`,
+    writing to the `output` directory."""
+    if stage == 'stage':
+        def run():
+            with open(path, 'rb') as file:
+                staged = stage_upload(file, output)
+            os.remove(staged.path)
+    elif stage == 'read_size':
+        def run():
+            read_image_size(path, Config.MEDIA_MAX_IMAGE_PIXELS)
+    elif stage == 'process':
+        # the thumbnail, renditions and placeholder, as a media job does
+        def run():
+            with tempfile.TemporaryDirectory(dir=output) as directory:
+                process_media(
+                    path,
+                    os.path.join(directory, os.path.basename(path)),
+                    directory,
+                    Config.MEDIA_RENDITION_WIDTHS,
+                    Config.MEDIA_RENDITION_FORMATS,
+                    Config.MEDIA_REDUCING_GAP,
+                    Config.MEDIA_MAX_IMAGE_PIXELS,
+                )
+    elif stage.startswith('encode_'):
+        image_format = stage.removeprefix('encode_')
+        def run():
+            transform_image(
+                path,
+                os.path.join(output, f'encoded.{image_format}'),
+                ENCODE_WIDTH,
+                None,
+                image_format,
+                None,
+                Config.MEDIA_REDUCING_GAP,
+            )
+    else:
+        raise ValueError(f'Unknown stage: {stage}')
+
+    return run
+
+
+def _check_filenames() -> None:
+    for filename in ('photo.jpg', 'photo.JPEG', 'scan.png', 'document.pdf', 'no-dot'):
+        is_file_allowed(filename)
+
+
+def _peak_rss_mib() -> float:
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # in bytes on macOS, and KiB elsewhere
+    return peak_rss / 1024**2 if sys.platform == 'darwin' else peak_rss / 1024
+
+
+def run_case(
+    stage: str,
+    path: str | None,
+    min_iterations: int,
+    max_iterations: int,
+    max_seconds: float,
+) -> dict:
+    """Run a benchmark case at least `min_iterations` times, and then until it's run
+    `max_iterations` times or for `max_seconds`, whichever's first.
+
+    Meant to run in a fresh process (see run_benchmarks()).
+
+    Returns:
+        How long each iteration took, in seconds ('durations'), and the peak RSS
+        ('peak_rss_mib').
+    """
+    with tempfile.TemporaryDirectory() as output:
+        if stage == 'is_file_allowed':
+            run = _check_filenames
+        else:
+            run = _stage_function(stage, path, output)
+
+        # warm-up: imports, codec initialization and the page cache
+        run()
+
+        durations = []
+        start = time.perf_counter()
+        while len(durations) < max_iterations and (
+            len(durations) < min_iterations
+            or time.perf_counter() - start < max_seconds
+        ):
+            iteration_start = time.perf_counter()
+            run()
+            durations.append(time.perf_counter() - iteration_start)
+
+    return {'durations': durations, 'peak_rss_mib': _peak_rss_mib()}
+
+
+def _percentile(durations: Sequence[float], percentile: int) -> float:
+    if len(durations) == 1:
+        return durations[0]
+    return statistics.quantiles(durations, n=100, method='inclusive')[percentile - 1]
+
+
+def run_benchmarks(
+    corpus_directory: str,
+    megapixels_list: Sequence[float],
+    extensions: Sequence[str],
+    stages: Sequence[str],
+    min_iterations: int = 3,
+    max_iterations: int = 30,
+    max_seconds: float = 10.0,
+    on_result: Callable[[BenchmarkResult], None] | None = None,
+) -> list[BenchmarkResult]:
+    """Run every stage over every corpus image of the given sizes and formats
+    (generating them first if needed), each case in a fresh process.
+
+    Args:
+        on_result: Called with each result as soon as it's known.
+    """
+    generate_corpus(corpus_directory, megapixels_list, extensions)
+
+    cases = [('is_file_allowed', None, None, None)] + [
+        (
+            stage,
+            extension,
+            megapixels,
+            corpus_path(corpus_directory, megapixels, extension),
+        )
+        for megapixels in megapixels_list
+        for extension in extensions
+        for stage in stages
+    ]
+
+    results = []
+    for stage, extension, megapixels, path in cases:
+        # a fresh process for each case, so its peak RSS isn't any other's (or the
+        # corpus generation's)
+        with ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context('spawn')
+        ) as executor:
+            measured = executor.submit(
+                run_case, stage, path, min_iterations, max_iterations, max_seconds
+            ).result()
+
+        durations = measured['durations']
+        result = BenchmarkResult(
+            case=stage if path is None else f'{stage}/{megapixels:g}mp.{extension}',
+            stage=stage,
+            image_format=extension,
+            megapixels=megapixels,
+            file_size=os.path.getsize(path) if path is not None else None,
+            iterations=len(durations),
+            images_per_second=len(durations) / sum(durations),
+            p50_ms=_percentile(durations, 50) * 1000,
+            p99_ms=_percentile(durations, 99) * 1000,
+            peak_rss_mib=measured['peak_rss_mib'],
+        )
+        results.append(result)
+        if on_result is not None:
+            on_result(result)
+
+    return results
+
+
+def environment() -> dict[str, Any]:
+    """Return what the results depend on, besides the code."""
+    return {
+        'python': platform.python_version(),
+        'pillow': PIL.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def find_regressions(
+    results: Sequence[BenchmarkResult], baseline: dict, threshold: float
+) -> list[tuple[BenchmarkResult, float]]:
+    """Return the results whose median latency is over `threshold` (e.g. 0.2 for
+    20%) slower than in the baseline (saved results of an earlier run), along with
+    how much slower they are."""
+    baseline_p50 = {result['case']: result['p50_ms'] for result in baseline['results']}
+    regressions = []
+    for result in results:
+        previous = baseline_p50.get(result.case)
+        if previous and result.p50_ms > previous * (1 + threshold):
+            regressions.append((result, result.p50_ms / previous - 1))
+
+    return regressions
+
+
+def _format_result(result: BenchmarkResult) -> str:
+    return (
+        f'{result.case:<32} {result.iterations:>5} {result.images_per_second:>12.1f}'
+        f' {result.p50_ms:>10.2f} {result.p99_ms:>10.2f} {result.peak_rss_mib:>9.1f}'
+    )
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.upload_path', description=__doc__.split('\n\n')[0]
+    )
+    parser.add_argument(
+        '--quick', action='store_true',
+        help=f'only the smallest sizes ({", ".join(map(str, QUICK_MEGAPIXELS))} MP),'
+        ' with fewer iterations',
+    )
+    parser.add_argument(
+        '--megapixels', type=float, nargs='+',
+        help='the corpus sizes to benchmark, in megapixels',
+    )
+    parser.add_argument(
+        '--formats', nargs='+', choices=CORPUS_FORMATS, default=list(CORPUS_FORMATS),
+        help='the corpus formats to benchmark',
+    )
+    parser.add_argument(
+        '--stages', nargs='+', choices=STAGES, default=list(STAGES),
+        help='the stages to benchmark',
+    )
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS_PATH,
+                        help='where the generated corpus is kept')
+    parser.add_argument('--max-iterations', type=int, default=30)
+    parser.add_argument('--max-seconds', type=float, default=10.0,
+                        help='how long each case runs for, at most (after 3 runs)')
+    parser.add_argument('--output', help='where to save the results, as JSON')
+    parser.add_argument('--baseline',
+                        help='the saved results of an earlier run, to compare to')
+    parser.add_argument(
+        '--threshold', type=float, default=0.2,
+        help='how much slower (e.g. 0.2 for 20%%) a case can get before it fails the'
+        ' comparison with the baseline',
+    )
+    args = parser.parse_args(argv)
+
+    megapixels_list = args.megapixels or (
+        QUICK_MEGAPIXELS if args.quick else CORPUS_MEGAPIXELS
+    )
+    max_iterations = 5 if args.quick else args.max_iterations
+    max_seconds = 2.0 if args.quick else args.max_seconds
+
+    print(
+        f"{'case':<32} {'runs':>5} {'images/s':>12} {'p50 ms':>10} {'p99 ms':>10}"
+        f" {'RSS MiB':>9}"
+    )
+    results = run_benchmarks(
+        args.corpus,
+        megapixels_list,
+        args.formats,
+        args.stages,
+        min_iterations=min(3, max_iterations),
+        max_iterations=max_iterations,
+        max_seconds=max_seconds,
+        on_result=lambda result: print(_format_result(result), flush=True),
+    )
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump({
+                'created_on': datetime.now(timezone.utc).isoformat(),
+                'environment': environment(),
+                'results': [asdict(result) for result in results],
+            }, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            baseline = json.load(file)
+        if baseline.get('environment') != environment():
+            print('Warning: the baseline was run in a different environment')
+
+        regressions = find_regressions(results, baseline, args.threshold)
+        for result, slowdown in regressions:
+            print(f'Regression: {result.case} is {slowdown:.0%} slower (p50)')
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
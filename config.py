@@ -13,7 +13,140 @@ class Config:
         or 'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    MEDIA_STORAGE = os.environ.get('MEDIA_STORAGE') or 'local'
+    """Where media files, thumbnails and renditions are stored (see app.storage):
+    'local', in the UPLOADS_*_PATH directories; or 's3', in the MEDIA_S3_BUCKET
+    bucket (requires boto3). Run `flask media reshard` after switching, to move the
+    files stored so far."""
+    MEDIA_S3_BUCKET = os.environ.get('MEDIA_S3_BUCKET')
+    """The bucket of the 's3' media storage."""
+    MEDIA_S3_PUBLIC_URL = os.environ.get('MEDIA_S3_PUBLIC_URL')
+    """The URL the 's3' media storage's files are publicly served from (the bucket,
+    or a CDN in front of it)."""
+    MEDIA_S3_ENDPOINT_URL = os.environ.get('MEDIA_S3_ENDPOINT_URL')
+    """The URL of the S3-compatible service (e.g. MinIO) of the 's3' media storage;
+    if None, AWS S3."""
+
+    UPLOADS_MEDIA_PATH = os.path.join(basedir, 'app', 'static', 'uploads', 'media')
+    """Where media files are stored, by the 'local' media storage."""
+    UPLOADS_THUMBNAILS_PATH = os.path.join(
+        basedir, 'app', 'static', 'uploads', 'thumbnails'
+    )
+    """Where autogenerated thumbnails are stored, by the 'local' media storage."""
+    UPLOADS_RENDITIONS_PATH = os.path.join(
+        basedir, 'app', 'static', 'uploads', 'renditions'
+    )
+    """Where autogenerated renditions (resized versions of media files) are stored, by
+    the 'local' media storage."""
+    UPLOADS_STAGING_PATH = os.path.join(basedir, 'staging')
+    """Where uploads are written until they're stored, and media files are processed.
+    It's not served, and it must be on the same filesystem as the UPLOADS_*_PATH
+    directories, so files can be moved there without copying."""
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH') or 256 * 1024**2)
+    """The maximum size of a request body, in bytes; bigger requests are rejected as
+    they stream in. Chunked uploads (see UPLOAD_MAX_FILE_SIZE) are only bound by this
+    per chunk."""
+    UPLOAD_MAX_FILE_SIZE = int(os.environ.get('UPLOAD_MAX_FILE_SIZE') or 64 * 1024**2)
+    """The maximum size of an uploaded file, in bytes. Files are rejected as soon as
+    they're over it, before the rest of them is read."""
+    UPLOAD_MAX_FILES = 20
+    """The maximum number of media files a post can have."""
+    UPLOAD_EXPIRY = 24 * 60 * 60
+    """How long (in seconds) a chunked upload can be left unused, without receiving
+    chunks nor being included in a post, before it's deleted."""
+    UPLOAD_CHUNK_TIMEOUT = 10 * 60
+    """How long (in seconds) a chunk can take to arrive before it's assumed its request
+    died, and the chunk can be sent again."""
+
+    MEDIA_RENDITION_WIDTHS = (256, 640, 1280, 2048)
+    """The widths (in pixels) media files are resized to, so smaller screens can get
+    smaller files. Media files are never upscaled."""
+    MEDIA_RENDITION_FORMATS = ('avif', 'webp')
+    """The formats renditions are encoded in, from most to least preferred; see
+    imaging.IMAGE_ENCODERS. Those Pillow can't encode (AVIF before Pillow 11.3, or
+    without libavif) are left out, with a warning."""
+
+    MEDIA_MAX_AGE = 365 * 24 * 60 * 60
+    """How long (in seconds) clients can cache media files, thumbnails, renditions and
+    transformed copies. They're named after their contents, so they never change."""
+    MEDIA_SENDFILE = os.environ.get('MEDIA_SENDFILE')
+    """How locally stored media files are sent: by the app if None; or by the front
+    proxy, with 'x-sendfile' (Apache, lighttpd) or 'x-accel-redirect' (nginx)."""
+    MEDIA_ACCEL_REDIRECT_PREFIX = (
+        os.environ.get('MEDIA_ACCEL_REDIRECT_PREFIX') or '/internal-uploads'
+    )
+    """The internal nginx location of media files, for 'x-accel-redirect': files are
+    sent from <prefix>/<kind>/<path>, where <kind> is one of 'media', 'thumbnails',
+    'renditions' (whose paths are sharded; see app.storage) and 'cache', each of
+    which should alias its UPLOADS_*_PATH (or MEDIA_CACHE_PATH) directory."""
+
+    MEDIA_CACHE_PATH = os.path.join(basedir, 'app', 'static', 'uploads', 'cache')
+    """Where media files transformed on demand (see the media blueprint) are cached."""
+    MEDIA_CACHE_MAX_BYTES = int(os.environ.get('MEDIA_CACHE_MAX_BYTES') or 2 * 1024**3)
+    """How big the media cache can get before the least recently used files are
+    evicted."""
+    MEDIA_TRANSFORM_SIZES = (64, 128, 256, 320, 480, 640, 960, 1280, 1920, 2048)
+    """The only widths and heights (in pixels) media files can be transformed to, so
+    the cache can't be flooded with arbitrary sizes."""
+    MEDIA_TRANSFORM_QUALITIES = (40, 60, 75, 90)
+    """The only encoder qualities media files can be transformed with."""
+
+    MEDIA_REDUCING_GAP = 2.0
+    """The speed/quality trade-off of resizing: JPEGs are decoded at a reduced scale,
+    and images are reduced with a fast filter, down to this many times the target
+    size. Lower is faster; None always decodes and resizes at full quality (slowest).
+    """
+    MEDIA_MAX_IMAGE_PIXELS = 100_000_000
+    """The maximum number of pixels (width * height) an uploaded image can have.
+    Uploads are rejected as soon as their header says they have more, before they're
+    decoded (or even fully read)."""
+
+    MEDIA_PROCESSING_WORKERS = int(os.environ.get('MEDIA_PROCESSING_WORKERS') or 4)
+    """How many processes decode and thumbnail uploaded media in parallel. If 0, it's
+    done in the request's thread."""
+    MEDIA_JOB_WORKERS = int(os.environ.get('MEDIA_JOB_WORKERS') or 2)
+    """How many background threads run media jobs (generating the thumbnails and
+    renditions of uploads; see app.jobs). If 0, jobs run in the upload's request."""
+    MEDIA_JOB_POLL_INTERVAL = 1.0
+    """How long idle job workers wait before checking for new jobs, in seconds."""
+    MEDIA_JOB_TIMEOUT = 10 * 60
+    """How long a job can run (in seconds) before it's assumed its worker died, and
+    it's run again."""
+    MEDIA_JOB_MAX_ATTEMPTS = 3
+    """How many times a failing job is run before giving up on it."""
+
+    VIEW_COUNTER_FLUSH_INTERVAL = 5.0
+    """How often post views, counted in memory, are written to the database, in
+    seconds (see app.view_counts). If 0, each view is written as it happens."""
+    VIEW_COUNTER_MAX_PENDING_POSTS = 1000
+    """How many posts can have views waiting to be written before they're written
+    early."""
+
+    FLOW_SUGGESTIONS_LIMIT = 8
+    """How many flows are suggested as a flow's name is typed."""
+    FLOW_SUGGESTIONS_REFRESH_INTERVAL = 60.0
+    """How often the flow suggestions index, kept in memory, is reloaded from the
+    database, in seconds (see app.flow_suggestions). If 0, it's only loaded on
+    first use."""
+
+    BACKGROUND_WORK = (os.environ.get('BACKGROUND_WORK') or '1') == '1'
+    """Whether the app starts its background work (see app.start_background_work())
+    once it serves requests; it never does for CLI commands. If 0, media jobs are
+    left to `flask media work`, to be run in processes of their own (unless
+    `MEDIA_JOB_WORKERS` is 0, and they're run in their upload's request), views are
+    written right away, and flow suggestions are never reloaded."""
+
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    """The token scrapers must send (as `Authorization: Bearer <token>`) to read the
+    metrics at /api/metrics. If not set, they aren't served at all."""
+
 class TestingConfig(Config):
     TESTING = True
     SECRET_KEY = 'testing'
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    MEDIA_PROCESSING_WORKERS = 0
+    MEDIA_JOB_WORKERS = 0
+    VIEW_COUNTER_FLUSH_INTERVAL = 0
+    FLOW_SUGGESTIONS_REFRESH_INTERVAL = 0
+    BACKGROUND_WORK = False
+    METRICS_TOKEN = 'testing'
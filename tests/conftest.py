@@ -1,16 +1,66 @@
+import io
+import os
+import threading
+
+from PIL import Image
 import pytest
 
 from app import create_app
 from config import TestingConfig
 from app.extensions import db
+from app.models.post import Post
 from app.models.user import User
 
 
+def _test_config(tmp_path, **settings) -> type[TestingConfig]:
+    """Return a testing config whose files are all kept in `tmp_path`."""
+    class TemporaryUploadsConfig(TestingConfig):
+        UPLOADS_MEDIA_PATH = str(tmp_path / 'media')
+        UPLOADS_STAGING_PATH = str(tmp_path / 'staging')
+        UPLOADS_THUMBNAILS_PATH = str(tmp_path / 'thumbnails')
+        UPLOADS_RENDITIONS_PATH = str(tmp_path / 'renditions')
+        MEDIA_CACHE_PATH = str(tmp_path / 'cache')
+
+    for name, value in settings.items():
+        setattr(TemporaryUploadsConfig, name, value)
+    return TemporaryUploadsConfig
+
+
+@pytest.fixture()
+def app(tmp_path):
+    app = create_app(_test_config(tmp_path))
+
+    yield app
+
 @pytest.fixture()
-def app():
-    app = create_app(TestingConfig)
+def shared_app(tmp_path):
+    """An app whose database is a file, so that concurrent requests each have a
+    connection of their own."""
+    app = create_app(_test_config(
+        tmp_path, SQLALCHEMY_DATABASE_URI=f'sqlite:///{tmp_path / "imgflow.db"}'
+    ))
+    yield app
+    with app.app_context():
+        db.engine.dispose()
 
+@pytest.fixture()
+def background_app(tmp_path):
+    """An app running its background work (once it serves requests), with a single
+    media job worker."""
+    app = create_app(_test_config(
+        tmp_path,
+        BACKGROUND_WORK=True,
+        MEDIA_JOB_WORKERS=1,
+        MEDIA_JOB_POLL_INTERVAL=0.01,
+    ))
     yield app
+    for worker in app.extensions.get('media_job_workers', ()):
+        worker.stop()
+        worker.join()
+
+@pytest.fixture()
+def client(app):
+    return app.test_client()
 
 @pytest.fixture()
 def user(app):
@@ -19,3 +69,95 @@ def user(app):
         db.session.add(created_user)
         db.session.commit()
         yield created_user
+
+@pytest.fixture()
+def login(client, user):
+    """Return a function logging the client in as the user."""
+    def log_in():
+        response = client.post(
+            '/api/login', json={'username': 'testuser1', 'password': 'password1'}
+        )
+        assert response.status_code == 204
+
+    return log_in
+
+@pytest.fixture()
+def add_posts(user):
+    """Return a function adding posts by the user straight to the database (without
+    media), and returning their IDs: `count` of them, or one per title."""
+    def add(count=1, titles=None, is_public=True, flows=(), scores=None) -> list[str]:
+        if titles is None:
+            titles = [f'Post {index}' for index in range(count)]
+        posts = [
+            Post(user.id, title, [], '/thumbnail.png', is_public, list(flows))
+            for title in titles
+        ]
+        for index, post in enumerate(posts):
+            post.score = scores[index] if scores else 0
+        db.session.add_all(posts)
+        db.session.commit()
+        return [post.post_id for post in posts]
+
+    return add
+
+@pytest.fixture()
+def image_bytes():
+    """Return a function making the contents of an image file: of a single color, or
+    of noise (so it doesn't compress too well) if the color is None."""
+    def make(color=None, size=(640, 480), image_format='PNG') -> bytes:
+        if color is None:
+            image = Image.frombytes('RGB', size, os.urandom(size[0] * size[1] * 3))
+        else:
+            image = Image.new('RGB', size, color)
+        buffer = io.BytesIO()
+        image.save(buffer, image_format)
+        return buffer.getvalue()
+
+    return make
+
+@pytest.fixture()
+def upload_post(client):
+    """Return a function creating a post through the API, with the given media:
+    either their contents (bytes), uploaded along with it, or the IDs of chunked
+    uploads (strings). Keyword arguments replace the other form fields."""
+    def upload(*media, **fields):
+        data = {
+            'title': 'A post',
+            'is_public': 'false',
+            'description': [''] * len(media),
+        }
+        if media and isinstance(media[0], bytes):
+            data['media_file'] = [
+                (io.BytesIO(content), 'photo.png') for content in media
+            ]
+        else:
+            data['upload_id'] = list(media)
+        return client.post(
+            '/api/posts', data=data | fields, content_type='multipart/form-data'
+        )
+
+    return upload
+
+@pytest.fixture()
+def run_concurrently():
+    """Return a function sending the given requests (functions) all at once, each
+    from its own thread, and returning their responses."""
+    def run(requests):
+        barrier = threading.Barrier(len(requests))
+        responses = [None] * len(requests)
+
+        def send(index, request):
+            barrier.wait()
+            responses[index] = request()
+
+        threads = [
+            threading.Thread(target=send, args=(index, request))
+            for index, request in enumerate(requests)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return responses
+
+    return run
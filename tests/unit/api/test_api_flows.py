@@ -0,0 +1,90 @@
+from sqlalchemy import event
+
+from app.dbapi import create_post
+from app.extensions import db
+from app.models.post import Flow, Post
+
+
+def _add_post(user, thumbnail_url, flow_names):
+    post = create_post(
+        user.id,
+        'Title',
+        [{
+            'media_url': '/media.png',
+            'thumbnail_url': thumbnail_url,
+            'description': None,
+            'content_hash': thumbnail_url[1:].ljust(64, '0'),
+            'extension': 'png',
+            'size': 1,
+            'width': 1,
+            'height': 1,
+        }],
+        True,
+        flow_names,
+    )
+    return post['post_id']
+
+
+def _thumbnails(client):
+    return {
+        flow['name']: flow['thumbnail_url']
+        for flow in client.get('/api/flows?overview=1').json
+    }
+
+
+def test_flow_thumbnails_follow_top_post(client, user, login):
+    first = _add_post(user, '/first.png', ['cats', 'dogs'])
+    # the newest, among equals
+    second = _add_post(user, '/second.png', ['cats'])
+    assert _thumbnails(client) == {'cats': '/second.png', 'dogs': '/first.png'}
+
+    login()
+    client.post(f'/api/posts/{first}/upvote')
+    assert _thumbnails(client) == {'cats': '/first.png', 'dogs': '/first.png'}
+
+    client.delete(f'/api/posts/{first}/upvote')
+    assert _thumbnails(client) == {'cats': '/second.png', 'dogs': '/first.png'}
+
+    client.post(f'/api/posts/{first}/upvote')
+    client.delete(f'/api/posts/{first}')
+    assert _thumbnails(client) == {'cats': '/second.png', 'dogs': None}
+
+    client.delete(f'/api/posts/{second}')
+    assert _thumbnails(client) == {'cats': None, 'dogs': None}
+
+
+def test_flows_overview_in_one_query(client, user):
+    for index in range(5):
+        _add_post(user, f'/{index}.png', [f'flow{index}', 'all'])
+
+    statements = []
+    def record_statement(connection, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record_statement)
+    try:
+        thumbnails = _thumbnails(client)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record_statement)
+
+    assert len(statements) == 1
+    assert thumbnails['all'] == '/4.png'
+    assert thumbnails['flow2'] == '/2.png'
+
+
+def test_reconcile_flows(app, user):
+    post_id = _add_post(user, '/first.png', ['cats'])
+    _add_post(user, '/second.png', ['cats'])
+    # upvoted behind its back
+    db.session.execute(
+        db.update(Post).where(Post.post_id == post_id).values(score=Post.score + 1)
+    )
+    db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=['flows', 'reconcile'])
+
+    assert result.exit_code == 0
+    assert 'Done: 1 flows had the wrong top post' in result.output
+    db.session.expire_all()
+    flow = db.session.execute(db.select(Flow)).scalar_one()
+    assert flow.thumbnail_url == '/first.png'
@@ -0,0 +1,93 @@
+import os
+
+
+def test_request_too_large(app, upload_post, image_bytes):
+    app.config['MAX_CONTENT_LENGTH'] = 10_000
+
+    response = upload_post(image_bytes())
+
+    assert response.status_code == 413
+    assert response.json['error'] == 'request_too_large'
+
+
+def test_file_too_large(app, client, upload_post, image_bytes):
+    content = image_bytes()
+    app.config['UPLOAD_MAX_FILE_SIZE'] = len(content) - 1
+
+    response = upload_post(content)
+
+    assert response.status_code == 413
+    assert response.json['error'] == 'file_too_large'
+    assert os.listdir(app.config['UPLOADS_STAGING_PATH']) == []
+
+    # declared upfront by chunked uploads
+    response = client.post(
+        '/api/uploads', json={'filename': 'photo.png', 'size': len(content)}
+    )
+    assert response.status_code == 413
+    assert response.json['error'] == 'file_too_large'
+
+
+def test_too_many_files(app, upload_post, image_bytes):
+    app.config['UPLOAD_MAX_FILES'] = 2
+    content = image_bytes(size=(32, 32))
+
+    response = upload_post(content, content, content)
+
+    assert response.status_code == 400
+    assert response.json['error'] == 'too_many_files'
+
+
+def test_chunked_upload_image_too_large(app, client, image_bytes):
+    app.config['MEDIA_MAX_IMAGE_PIXELS'] = 640 * 480 - 1
+    content = image_bytes()
+    upload_id = client.post(
+        '/api/uploads', json={'filename': 'photo.png', 'size': len(content)}
+    ).json['upload_id']
+
+    # rejected from the first chunk
+    response = client.patch(
+        f'/api/uploads/{upload_id}',
+        data=content[:100_000],
+        headers={
+            'Content-Type': 'application/octet-stream',
+            'Upload-Offset': '0',
+        },
+    )
+
+    assert response.status_code == 400
+    assert response.json['error'] == 'image_too_large'
+    assert client.get(f'/api/uploads/{upload_id}').status_code == 404
+    assert os.listdir(app.config['UPLOADS_STAGING_PATH']) == []
+
+
+def test_upload_metrics(app, client, upload_post, image_bytes):
+    app.config['UPLOAD_MAX_FILES'] = 1
+    content = image_bytes(size=(32, 32))
+    upload_post(content)
+    upload_post(content, content)
+
+    response = client.get(
+        '/api/metrics', headers={'Authorization': 'Bearer testing'}
+    )
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    lines = response.text.splitlines()
+    assert (
+        f"imgflow_upload_max_file_bytes {app.config['UPLOAD_MAX_FILE_SIZE']}" in lines
+    )
+    assert 'imgflow_upload_rejections_total{reason="too_many_files"} 1' in lines
+    assert 'imgflow_upload_file_bytes_count 1' in lines
+    assert f'imgflow_upload_file_bytes_max {len(content)}' in lines
+    assert 'imgflow_upload_image_pixels_sum 1024' in lines
+
+
+def test_metrics_require_token(app, client):
+    assert client.get('/api/metrics').status_code == 404
+    response = client.get('/api/metrics', headers={'Authorization': 'Bearer wrong'})
+    assert response.status_code == 404
+
+    app.config['METRICS_TOKEN'] = None
+    response = client.get('/api/metrics', headers={'Authorization': 'Bearer None'})
+    assert response.status_code == 404
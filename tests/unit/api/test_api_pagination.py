@@ -0,0 +1,152 @@
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.engine.default import CACHE_HIT
+
+from app.dbapi import COMMENTS_PER_PAGE, POSTS_PER_PAGE
+from app.extensions import db
+from app.models.post import Flow, Post, PostComment
+
+
+def _fetch_all(client, url):
+    """Return every item of a listing, following its cursors, and how many pages it
+    took."""
+    items = []
+    pages = 0
+    cursor = None
+    while True:
+        response = client.get(url + (f'&cursor={cursor}' if cursor else ''))
+        assert response.status_code == 200
+        items += response.json
+        pages += 1
+        cursor = response.headers.get('X-Next-Cursor')
+        if cursor is None:
+            return items, pages
+
+
+def test_posts_cursor(client, add_posts):
+    post_ids = add_posts(POSTS_PER_PAGE + 5)
+
+    first_page = client.get('/api/posts?sort=newest')
+    assert len(first_page.json) == POSTS_PER_PAGE
+    # created in the same second: the newest are the last inserted
+    assert [post['post_id'] for post in first_page.json] == (
+        post_ids[::-1][:POSTS_PER_PAGE]
+    )
+
+    # new posts don't shift the next page
+    add_posts(3)
+    cursor = first_page.headers['X-Next-Cursor']
+    second_page = client.get(f'/api/posts?sort=newest&cursor={cursor}')
+    assert [post['post_id'] for post in second_page.json] == (
+        post_ids[::-1][POSTS_PER_PAGE:]
+    )
+    assert 'X-Next-Cursor' not in second_page.headers
+
+
+def test_posts_cursor_top(client, add_posts):
+    scores = [index % 7 for index in range(POSTS_PER_PAGE * 2 + 3)]
+    add_posts(len(scores), scores=scores)
+
+    posts, pages = _fetch_all(client, '/api/posts?sort=top')
+
+    assert pages == 3
+    assert [post['score'] for post in posts] == sorted(scores, reverse=True)
+    assert len({post['post_id'] for post in posts}) == len(scores)
+
+
+def test_posts_page_still_works(client, add_posts):
+    post_ids = add_posts(POSTS_PER_PAGE + 5)
+
+    response = client.get('/api/posts?sort=newest&page=1')
+
+    assert [post['post_id'] for post in response.json] == post_ids[4::-1]
+
+
+def test_invalid_cursor(client, add_posts):
+    add_posts(POSTS_PER_PAGE + 1)
+    cursor = client.get('/api/posts?sort=newest').headers['X-Next-Cursor']
+
+    for url in [
+        '/api/posts?sort=newest&cursor=not-a-cursor',
+        # made for another sorting
+        f'/api/posts?sort=top&cursor={cursor}',
+    ]:
+        response = client.get(url)
+        assert response.status_code == 400
+        assert response.json['error'] == 'invalid_cursor'
+
+
+def test_flow_and_user_posts_cursor(client, add_posts):
+    flow = Flow('cats')
+    add_posts(POSTS_PER_PAGE + 1, flows=[flow])
+
+    for url in [
+        '/api/flows/cats/posts?sort=newest',
+        '/api/users/testuser1/posts?sort=top',
+    ]:
+        posts, pages = _fetch_all(client, url)
+        assert (len(posts), pages) == (POSTS_PER_PAGE + 1, 2)
+
+
+def test_comments_cursor(client, user, add_posts):
+    (post_id,) = add_posts(1)
+    comments = [
+        PostComment(user.id, f'Comment {index}', None, post_id)
+        for index in range(COMMENTS_PER_PAGE + 2)
+    ]
+    db.session.add_all(comments)
+    db.session.commit()
+
+    for sorting, expected_ids in [
+        ('oldest', [comment.id for comment in comments]),
+        ('newest', [comment.id for comment in reversed(comments)]),
+    ]:
+        listed, pages = _fetch_all(
+            client, f'/api/posts/{post_id}/comments?sort={sorting}'
+        )
+        assert pages == 2
+        assert [comment['id'] for comment in listed] == expected_ids
+
+
+def test_posts_cursor_across_timestamps(client, add_posts):
+    post_ids = add_posts(POSTS_PER_PAGE + 5)
+    # some written by the database, and some by SQLAlchemy (formatted differently)
+    for index, post_id in enumerate(post_ids[::2]):
+        db.session.execute(
+            db.update(Post)
+                .where(Post.post_id == post_id)
+                .values(created_on=datetime(2020, 1, 1 + index % 3))
+        )
+    db.session.commit()
+
+    posts, _ = _fetch_all(client, '/api/posts?sort=newest')
+
+    assert sorted(post['post_id'] for post in posts) == sorted(post_ids)
+    created_on = [post['created_on'] for post in posts]
+    assert created_on == sorted(created_on, reverse=True)
+
+
+def test_listing_queries_compiled_once(client, add_posts):
+    add_posts(POSTS_PER_PAGE + 1)
+    cursor = client.get('/api/users/testuser1/posts?sort=top').headers['X-Next-Cursor']
+    client.get(f'/api/users/testuser1/posts?sort=top&cursor={cursor}')
+
+    cache_misses = []
+    def record_cache_miss(connection, cursor, statement, parameters, context, *args):
+        if context.cache_hit != CACHE_HIT:
+            cache_misses.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record_cache_miss)
+    try:
+        # other pages, and other users, run the same queries
+        add_posts(1)
+        client.get('/api/users/testuser1/posts?sort=top&page=1')
+        client.get(f'/api/users/testuser1/posts?sort=top&cursor={cursor}')
+        client.get('/api/users/nobody/posts?sort=top')
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record_cache_miss)
+
+    assert not [
+        statement for statement in cache_misses if 'ORDER BY' in statement
+    ]
@@ -0,0 +1,258 @@
+from concurrent.futures import ProcessPoolExecutor
+import io
+import os
+
+from PIL import Image
+from sqlalchemy import event
+
+from app.dbapi import get_post_and_media
+from app.extensions import db
+from app.imaging import get_media_executor
+from app.models.post import MediaObject
+from app.storage import MEDIA, THUMBNAILS, get_media_storage
+
+
+def _stored_files(directory) -> list[str]:
+    """Return the names of the files in a local media storage directory, sharded or
+    not."""
+    return [name for _, _, names in os.walk(directory) for name in names]
+
+
+def _stored_path(app, kind, url) -> str:
+    with app.app_context():
+        return get_media_storage().find(kind, os.path.basename(url))
+
+
+def test_create_post(app, client, upload_post, image_bytes):
+    response = upload_post(
+        image_bytes('red', image_format='JPEG'), image_bytes('blue', image_format='JPEG')
+    )
+
+    assert response.status_code == 200
+    assert 'media-0;dur=' in response.headers['Server-Timing']
+    assert 'media-1;dur=' in response.headers['Server-Timing']
+
+    thumbnail_path = _stored_path(app, THUMBNAILS, response.json['thumbnail_url'])
+    # sharded by hash
+    name = os.path.basename(thumbnail_path)
+    assert thumbnail_path == os.path.join(
+        app.config['UPLOADS_THUMBNAILS_PATH'], name[:2], name[2:4], name
+    )
+    with Image.open(thumbnail_path) as thumbnail:
+        assert max(thumbnail.size) <= 256
+
+    # still served from the same URLs
+    response = client.get(response.json['thumbnail_url'])
+    assert response.status_code == 200
+    assert response.mimetype == 'image/jpeg'
+
+
+def test_create_post_processed_in_pool(
+    app, upload_post, image_bytes, run_concurrently
+):
+    app.config['MEDIA_PROCESSING_WORKERS'] = 2
+
+    def get_executor():
+        with app.app_context():
+            return get_media_executor()
+
+    # created once, however many threads ask for it at first
+    (executor,) = set(run_concurrently([get_executor] * 4))
+    assert isinstance(executor, ProcessPoolExecutor)
+
+    try:
+        response = upload_post(image_bytes('red'), image_bytes('blue'))
+    finally:
+        executor.shutdown()
+
+    assert response.status_code == 200
+    timings = response.headers['Server-Timing'].split(', ')
+    # a duration for each new file, and for them all, processed in parallel
+    for name in ['media-0', 'media-1', 'media-total']:
+        assert any(timing.startswith(f'{name};dur=') for timing in timings)
+
+
+def test_create_post_wrong_filetype(upload_post):
+    response = upload_post(b'not an image')
+
+    assert response.status_code == 400
+    assert response.json['error'] == 'wrong_filetype'
+
+
+def test_reuploaded_media_is_stored_once(app, upload_post, image_bytes):
+    first = upload_post(image_bytes('red'))
+    second = upload_post(image_bytes('red'))
+
+    assert first.json['thumbnail_url'] == second.json['thumbnail_url']
+    # known content isn't thumbnailed again
+    assert 'media-0;dur=' not in second.headers['Server-Timing']
+    assert len(_stored_files(app.config['UPLOADS_MEDIA_PATH'])) == 1
+
+    with app.app_context():
+        media_object = db.session.execute(db.select(MediaObject)).scalar_one()
+        assert media_object.ref_count == 2
+
+
+def test_concurrent_first_uploads(shared_app, run_concurrently, image_bytes):
+    content = image_bytes('red')
+    clients = [shared_app.test_client() for _ in range(4)]
+
+    responses = run_concurrently([
+        lambda client=client: client.post(
+            '/api/posts',
+            data={
+                'title': 'A post',
+                'is_public': 'false',
+                'media_file': [(io.BytesIO(content), 'photo.png')],
+                'description': [''],
+            },
+            content_type='multipart/form-data',
+        )
+        for client in clients
+    ])
+
+    assert {response.status_code for response in responses} == {200}
+    with shared_app.app_context():
+        media_object = db.session.execute(db.select(MediaObject)).scalar_one()
+        assert media_object.ref_count == 4
+    assert len(_stored_files(shared_app.config['UPLOADS_MEDIA_PATH'])) == 1
+
+
+def test_reuploaded_media_stored_again_if_deleted(app, upload_post, image_bytes):
+    upload_post(image_bytes('red'))
+    media_path = app.config['UPLOADS_MEDIA_PATH']
+    # as if by the deletion of the last post using it, while it was reuploaded
+    for directory, _, names in os.walk(media_path):
+        for name in names:
+            os.remove(os.path.join(directory, name))
+
+    upload_post(image_bytes('red'))
+
+    assert len(_stored_files(media_path)) == 1
+
+
+def test_delete_post_keeps_shared_media(
+    app, client, login, upload_post, image_bytes
+):
+    login()
+    first = upload_post(image_bytes('red'))
+    second = upload_post(image_bytes('red'))
+    media_path = app.config['UPLOADS_MEDIA_PATH']
+
+    response = client.delete(f"/api/posts/{first.json['post_id']}")
+    assert response.status_code == 204
+    assert len(_stored_files(media_path)) == 1
+
+    response = client.delete(f"/api/posts/{second.json['post_id']}")
+    assert response.status_code == 204
+    assert _stored_files(media_path) == []
+    assert _stored_files(app.config['UPLOADS_THUMBNAILS_PATH']) == []
+    assert _stored_files(app.config['UPLOADS_RENDITIONS_PATH']) == []
+
+    with app.app_context():
+        assert db.session.execute(db.select(MediaObject)).first() is None
+
+
+def test_delete_post_requires_poster(client, upload_post, image_bytes):
+    post = upload_post(image_bytes('red'))
+
+    response = client.delete(f"/api/posts/{post.json['post_id']}")
+    assert response.status_code == 401
+
+
+def test_post_renditions(client, upload_post, image_bytes):
+    post = upload_post(image_bytes('red', size=(1000, 800)))
+    post_id = post.json['post_id']
+
+    response = client.get(
+        f'/api/posts/{post_id}', headers={'Accept': 'image/webp,*/*'}
+    )
+    media_item = response.json['media'][0]
+
+    # never upscaled: the widest rendition is the original's width
+    widths = {rendition['width'] for rendition in media_item['renditions']}
+    assert widths == {256, 640, 1000}
+    assert media_item['srcset'].count('.webp') == 3
+    assert '1000w' in media_item['srcset']
+    assert 'Accept' in response.headers['Vary']
+
+    # no explicitly supported format: only the original
+    response = client.get(f'/api/posts/{post_id}', headers={'Accept': '*/*'})
+    assert response.json['media'][0]['srcset'] is None
+
+
+def test_create_post_image_too_large(app, upload_post, image_bytes):
+    app.config['MEDIA_MAX_IMAGE_PIXELS'] = 640 * 480 - 1
+
+    response = upload_post(image_bytes('red', size=(640, 480)))
+
+    assert response.status_code == 400
+    assert response.json['error'] == 'image_too_large'
+    assert _stored_files(app.config['UPLOADS_MEDIA_PATH']) == []
+    assert os.listdir(app.config['UPLOADS_STAGING_PATH']) == []
+
+
+def test_post_placeholders(client, login, upload_post, image_bytes):
+    login()
+    response = upload_post(image_bytes('red'), is_public='true')
+    post_id = response.json['post_id']
+
+    media_item = client.get(f'/api/posts/{post_id}').json['media'][0]
+    assert media_item['placeholder'].startswith('data:image/webp;base64,')
+    assert len(media_item['placeholder']) < 1024
+    red, green, blue = bytes.fromhex(media_item['dominant_color'][1:])
+    assert red > 200 and green < 50 and blue < 50
+
+    (listed_post,) = client.get('/api/posts?sort=newest').json
+    assert listed_post['placeholder'] == media_item['placeholder']
+    assert (listed_post['cover_width'], listed_post['cover_height']) == (640, 480)
+    assert listed_post['dominant_color'] == media_item['dominant_color']
+
+
+def test_post_media_dimensions(app, client, upload_post, image_bytes):
+    post = upload_post(
+        image_bytes('red', (640, 480), 'JPEG'), image_bytes('red', (300, 500), 'JPEG')
+    )
+
+    media = client.get(f"/api/posts/{post.json['post_id']}").json['media']
+
+    sizes = [(media_item['width'], media_item['height']) for media_item in media]
+    assert sizes == [(640, 480), (300, 500)]
+    for media_item in media:
+        assert media_item['format'] == 'jpg'
+        size = os.path.getsize(_stored_path(app, MEDIA, media_item['media_url']))
+        assert media_item['size'] == size
+
+
+def test_post_loaded_in_one_query(client, user, login, upload_post, image_bytes):
+    login()
+    response = upload_post(
+        image_bytes('red', (1000, 800)),
+        image_bytes('blue', (800, 1000)),
+        is_public='true',
+        description=['Red', 'Blue'],
+        flow=['colors', 'photos'],
+    )
+    post_id = response.json['post_id']
+    client.post(f'/api/posts/{post_id}/upvote')
+    user_id = user.id
+
+    statements = []
+    def record_statement(connection, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record_statement)
+    try:
+        post = get_post_and_media(post_id, user_id)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record_statement)
+
+    assert len(statements) == 1
+    assert post['username'] == 'testuser1'
+    assert post['has_upvote']
+    assert {flow['name'] for flow in post['flows']} == {'colors', 'photos'}
+    assert [media_item['description'] for media_item in post['media']] == [
+        'Red', 'Blue'
+    ]
+    for media_item in post['media']:
+        assert len(media_item['renditions']) == 6
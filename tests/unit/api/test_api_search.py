@@ -0,0 +1,70 @@
+from app.dbapi import POSTS_PER_PAGE
+from app.extensions import db
+from app.models.post import Post
+
+
+def _search(client, title, sort='relevance'):
+    response = client.get(f'/api/posts?sort={sort}&title={title}')
+    assert response.status_code == 200
+    return [post['title'] for post in response.json]
+
+
+def test_search_matches_words_and_prefixes(client, add_posts):
+    add_posts(titles=['Funny cats video', 'Cats', 'Dogs video', 'Crème brûlée'])
+    add_posts(titles=['My cats'], is_public=False)
+
+    # every word, or the start of one, in any order
+    assert _search(client, 'vid cat', sort='newest') == ['Funny cats video']
+    assert _search(client, 'CREME', sort='newest') == ['Crème brûlée']
+    # the shortest title is the most relevant
+    assert _search(client, 'cats') == ['Cats', 'Funny cats video']
+    assert _search(client, 'ats') == []
+    assert _search(client, '%!') == []
+
+
+def test_search_follows_changes(client, add_posts):
+    post_id, _ = add_posts(titles=['Cats', 'Dogs'])
+
+    post = db.session.execute(
+        db.select(Post).where(Post.post_id == post_id)
+    ).scalar_one()
+    post.title = 'Birds'
+    db.session.commit()
+    assert _search(client, 'cats') == []
+    assert _search(client, 'birds') == ['Birds']
+
+    db.session.delete(post)
+    db.session.commit()
+    assert _search(client, 'birds') == []
+
+
+def test_search_cursor_relevance(client, add_posts):
+    # many equally relevant
+    titles = [
+        'Cat' + ' and more' * (index % 4) for index in range(POSTS_PER_PAGE * 2 + 3)
+    ]
+    add_posts(titles=titles)
+
+    found = []
+    cursor = None
+    while True:
+        response = client.get(
+            '/api/posts?sort=relevance&title=cat'
+            + (f'&cursor={cursor}' if cursor else '')
+        )
+        found += [post['title'] for post in response.json]
+        cursor = response.headers.get('X-Next-Cursor')
+        if cursor is None:
+            break
+
+    assert found == sorted(titles, key=len)
+
+
+def test_relevance_only_for_searches(client, user):
+    for url in [
+        '/api/posts?sort=relevance',
+        '/api/users/testuser1/posts?sort=relevance',
+    ]:
+        response = client.get(url)
+        assert response.status_code == 400
+        assert response.json == {'error': 'invalid_sort'}
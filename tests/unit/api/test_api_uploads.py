@@ -0,0 +1,217 @@
+from datetime import datetime, timedelta, timezone
+import hashlib
+import os
+
+from sqlalchemy import event
+
+from app.dbapi import claim_chunked_upload, delete_expired_chunked_uploads
+from app.extensions import db
+from app.models.post import ChunkedUpload, MediaObject
+from app.storage import THUMBNAILS, get_media_storage
+
+
+def _start_upload(client, content: bytes, filename='photo.png') -> str:
+    response = client.post(
+        '/api/uploads', json={'filename': filename, 'size': len(content)}
+    )
+    assert response.status_code == 201
+    return response.json['upload_id']
+
+
+def _send_chunk(client, upload_id: str, content: bytes, offset: int):
+    return client.patch(
+        f'/api/uploads/{upload_id}',
+        data=content,
+        headers={
+            'Content-Type': 'application/octet-stream',
+            'Upload-Offset': str(offset),
+        },
+    )
+
+
+def _upload(client, content: bytes, chunk_size=100_000) -> str:
+    upload_id = _start_upload(client, content)
+    for offset in range(0, len(content), chunk_size):
+        response = _send_chunk(
+            client, upload_id, content[offset:offset + chunk_size], offset
+        )
+        assert response.status_code == 200
+
+    response = client.post(f'/api/uploads/{upload_id}/finalize')
+    assert response.status_code == 200
+    assert response.json['content_hash'] == hashlib.sha256(content).hexdigest()
+    return upload_id
+
+
+def test_create_post_from_chunked_uploads(app, client, upload_post, image_bytes):
+    first = image_bytes()
+    second = image_bytes()
+    upload_ids = [_upload(client, first), _upload(client, second)]
+
+    response = upload_post(*upload_ids)
+
+    assert response.status_code == 200
+    assert os.listdir(app.config['UPLOADS_STAGING_PATH']) == []
+    thumbnail_name = os.path.basename(response.json['thumbnail_url'])
+    assert thumbnail_name == hashlib.sha256(first).hexdigest() + '.png'
+
+    with app.app_context():
+        assert get_media_storage().exists(THUMBNAILS, thumbnail_name)
+        assert db.session.execute(db.select(ChunkedUpload)).first() is None
+        assert len(db.session.execute(db.select(MediaObject)).all()) == 2
+
+    # used up
+    assert upload_post(upload_ids[0]).status_code == 400
+
+
+def test_resume_chunked_upload(client, image_bytes):
+    content = image_bytes()
+    upload_id = _start_upload(client, content)
+    assert _send_chunk(client, upload_id, content[:1000], 0).status_code == 200
+
+    # a retried chunk that did arrive, or a chunk that got ahead
+    for offset in (0, 2000):
+        response = _send_chunk(client, upload_id, content[offset:3000], offset)
+        assert response.status_code == 409
+        assert response.json['offset'] == 1000
+
+    response = client.get(f'/api/uploads/{upload_id}')
+    assert response.json['offset'] == 1000
+    assert not response.json['is_finalized']
+
+    response = client.post(f'/api/uploads/{upload_id}/finalize')
+    assert response.status_code == 400
+    assert response.json['error'] == 'upload_incomplete'
+
+    assert _send_chunk(client, upload_id, content[1000:], 1000).status_code == 200
+    assert client.post(f'/api/uploads/{upload_id}/finalize').status_code == 200
+
+
+def test_chunk_past_upload_size(client, image_bytes):
+    content = image_bytes()
+    upload_id = _start_upload(client, content)
+
+    response = _send_chunk(client, upload_id, content + b'extra', 0)
+
+    assert response.status_code == 413
+    assert client.get(f'/api/uploads/{upload_id}').json['offset'] == 0
+    assert _send_chunk(client, upload_id, content, 0).status_code == 200
+
+
+def test_concurrent_chunk_not_written(app, client, image_bytes):
+    content = image_bytes()
+    upload_id = _start_upload(client, content)
+    staging_path = os.path.join(app.config['UPLOADS_STAGING_PATH'], upload_id)
+    # as if a request were still receiving the chunk
+    with app.app_context():
+        assert claim_chunked_upload(upload_id, 0, timedelta(minutes=10))
+
+    response = _send_chunk(client, upload_id, content, 0)
+
+    assert response.status_code == 409
+    assert response.json['error'] == 'concurrent_chunk'
+    assert os.path.getsize(staging_path) == 0
+
+    # unless that request died
+    app.config['UPLOAD_CHUNK_TIMEOUT'] = 0
+    assert _send_chunk(client, upload_id, content, 0).status_code == 200
+    assert os.path.getsize(staging_path) == len(content)
+
+
+def _make_idle(app, *upload_ids):
+    """Make the given uploads look started, and last sent a chunk, days ago."""
+    days_ago = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=2)
+    with app.app_context():
+        db.session.execute(
+            db.update(ChunkedUpload)
+                .where(ChunkedUpload.upload_id.in_(upload_ids))
+                .values(created_on=days_ago, updated_on=days_ago)
+        )
+        db.session.commit()
+
+
+def test_uploads_expire_once_idle(app, client, image_bytes):
+    content = image_bytes()
+    idle_upload_id = _start_upload(client, content)
+    active_upload_id = _start_upload(client, content)
+    _make_idle(app, idle_upload_id, active_upload_id)
+    # slow, but still going
+    assert _send_chunk(client, active_upload_id, content[:100], 0).status_code == 200
+
+    # expired uploads are deleted as new ones start
+    _start_upload(client, content)
+
+    assert client.get(f'/api/uploads/{idle_upload_id}').status_code == 404
+    assert client.get(f'/api/uploads/{active_upload_id}').json['offset'] == 100
+    staging_files = os.listdir(app.config['UPLOADS_STAGING_PATH'])
+    assert active_upload_id in staging_files
+    assert idle_upload_id not in staging_files
+
+
+def test_expiring_upload_included_in_post_meanwhile(app, client, image_bytes):
+    upload_id = _upload(client, image_bytes())
+    _make_idle(app, upload_id)
+
+    def include_in_post(connection, cursor, statement, *args):
+        if statement.startswith('DELETE FROM "ChunkedUpload"') and not included:
+            included.append(upload_id)
+            # as by a concurrent request, between the lookup and the deletion
+            cursor.execute(
+                'DELETE FROM "ChunkedUpload" WHERE upload_id = ?', (upload_id,)
+            )
+
+    included = []
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', include_in_post)
+        try:
+            deleted_upload_ids = delete_expired_chunked_uploads(timedelta(days=1))
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', include_in_post)
+
+    assert included
+    # its staging file is the post's, not to be deleted
+    assert deleted_upload_ids == ()
+
+
+def test_finalize_rejects_unsupported_format(app, client):
+    content = b'<html></html>' * 100
+    upload_id = _start_upload(client, content)
+    _send_chunk(client, upload_id, content, 0)
+
+    response = client.post(f'/api/uploads/{upload_id}/finalize')
+
+    assert response.status_code == 400
+    assert response.json['error'] == 'wrong_filetype'
+    assert os.listdir(app.config['UPLOADS_STAGING_PATH']) == []
+    assert client.get(f'/api/uploads/{upload_id}').status_code == 404
+
+
+def test_create_post_rejects_unfinalized_upload(client, upload_post, image_bytes):
+    content = image_bytes()
+    upload_id = _start_upload(client, content)
+    _send_chunk(client, upload_id, content, 0)
+
+    response = upload_post(upload_id)
+
+    assert response.status_code == 400
+    assert response.json['error'] == 'invalid_upload'
+
+
+def test_concurrent_posts_from_same_upload(shared_app, run_concurrently, image_bytes):
+    client = shared_app.test_client()
+    upload_id = _upload(client, image_bytes())
+
+    responses = run_concurrently([
+        lambda: client.post(
+            '/api/posts',
+            data={'is_public': 'false', 'upload_id': [upload_id], 'description': ['']},
+            content_type='multipart/form-data',
+        )
+        for _ in range(4)
+    ])
+
+    status_codes = sorted(response.status_code for response in responses)
+    # consumed by one of them, either before or after the others looked it up
+    assert status_codes[0] == 200
+    assert set(status_codes[1:]) <= {400, 409}
+    assert os.listdir(shared_app.config['UPLOADS_STAGING_PATH']) == []
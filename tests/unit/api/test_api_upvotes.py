@@ -0,0 +1,166 @@
+from sqlalchemy import event
+
+from app.extensions import db
+from app.models.post import CommentUpvote, Post, PostComment, PostUpvote
+from app.models.user import User
+
+
+def _selects(client, url):
+    """Return the response to GETting `url`, and the SELECTs it ran."""
+    selects = []
+    def record_select(connection, cursor, statement, *args):
+        if statement.lstrip().upper().startswith('SELECT'):
+            selects.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record_select)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record_select)
+    return response, selects
+
+
+def test_posts_upvote_states(client, user, login, add_posts):
+    post_ids = add_posts(6)
+    upvoted = set(post_ids[::2])
+    db.session.add_all(PostUpvote(post_id, user.id) for post_id in upvoted)
+    db.session.commit()
+
+    response = client.get('/api/posts?sort=newest')
+    assert not any(post['has_upvote'] for post in response.json)
+
+    login()
+    for url in [
+        '/api/posts?sort=newest',
+        '/api/posts?sort=top&title=Post',
+        '/api/users/testuser1/posts?sort=newest',
+    ]:
+        response = client.get(url)
+        assert {
+            post['post_id'] for post in response.json if post['has_upvote']
+        } == upvoted
+
+
+def test_upvote_states_fetched_at_once(client, user, login, add_posts):
+    (post_id,) = add_posts(1)
+    add_posts(10)
+    db.session.add_all(
+        PostComment(user.id, f'Comment {index}', None, post_id) for index in range(10)
+    )
+    db.session.commit()
+    login()
+
+    for url, upvote_table in [
+        ('/api/posts?sort=newest', 'PostUpvote'),
+        (f'/api/posts/{post_id}/comments?sort=newest', 'CommentUpvote'),
+    ]:
+        response, selects = _selects(client, url)
+        assert len(response.json) > 1
+        # not looked up for each row of the page, but all in a query of their own
+        upvote_selects = [select for select in selects if upvote_table in select]
+        assert len(upvote_selects) == 1
+        assert upvote_selects[0].startswith(f'SELECT "{upvote_table}"')
+
+
+def test_comments_upvote_states(client, user, login, add_posts):
+    (post_id,) = add_posts(1)
+    comments = [
+        PostComment(user.id, f'Comment {index}', None, post_id) for index in range(4)
+    ]
+    db.session.add_all(comments)
+    db.session.commit()
+    replies = [
+        PostComment(user.id, 'Reply', comments[0].id, post_id) for _ in range(2)
+    ]
+    db.session.add_all(replies)
+    db.session.commit()
+    upvoted = {comments[1].id, comments[3].id, replies[1].id}
+    db.session.add_all(CommentUpvote(comment_id, user.id) for comment_id in upvoted)
+    db.session.commit()
+
+    login()
+    listed = client.get(f'/api/posts/{post_id}/comments?sort=newest').json
+    listed += client.get(
+        f'/api/posts/{post_id}/comments/{comments[0].id}/replies?sort=newest'
+    ).json
+
+    assert len(listed) == 6
+    assert {comment['id'] for comment in listed if comment['has_upvote']} == upvoted
+
+
+def _scores(app, post_id, comment_id):
+    with app.app_context():
+        return db.session.execute(
+            db.select(Post.score, PostComment.score, User.score)
+                .join(PostComment, PostComment.post_id == Post.post_id)
+                .join(User, User.id == Post.user_id)
+                .where(Post.post_id == post_id, PostComment.id == comment_id)
+        ).one()
+
+
+def test_concurrent_upvotes(shared_app, run_concurrently):
+    with shared_app.app_context():
+        poster = User('poster', 'password1')
+        voters = [User(f'voter{index}', 'password1') for index in range(4)]
+        db.session.add_all([poster, *voters])
+        db.session.commit()
+        post = Post(poster.id, 'Title', [], '/thumbnail.png', True, [])
+        db.session.add(post)
+        db.session.commit()
+        comment = PostComment(poster.id, 'Comment', None, post.post_id)
+        db.session.add(comment)
+        db.session.commit()
+        post_id, comment_id = post.post_id, comment.id
+        voter_names = [voter.name for voter in voters]
+
+    clients = []
+    for name in voter_names:
+        client = shared_app.test_client()
+        client.post('/api/login', json={'username': name, 'password': 'password1'})
+        clients.append(client)
+    post_url = f'/api/posts/{post_id}/upvote'
+    comment_url = f'/api/posts/{post_id}/comments/{comment_id}/vote'
+
+    # every voter double-clicks (or triple-clicks) both
+    responses = run_concurrently([
+        lambda client=client, url=url: client.post(url)
+        for client in clients for url in [post_url, comment_url] for _ in range(3)
+    ])
+    assert {response.status_code for response in responses} == {204}
+    # the poster made both, so the user's score is theirs combined
+    assert _scores(shared_app, post_id, comment_id) == (4, 4, 8)
+
+    # and undo them, all at once again
+    responses = run_concurrently([
+        lambda client=client, url=url: client.delete(url)
+        for client in clients for url in [post_url, comment_url] for _ in range(3)
+    ])
+    assert {response.status_code for response in responses} == {204}
+    assert _scores(shared_app, post_id, comment_id) == (0, 0, 0)
+
+
+def test_upvote_missing_post_or_comment(client, login, add_posts):
+    (post_id,) = add_posts(1)
+    login()
+
+    assert client.post('/api/posts/abcdefgh/upvote').status_code == 204
+    assert client.post(f'/api/posts/{post_id}/comments/1234/vote').status_code == 204
+
+    for model in [PostUpvote, CommentUpvote]:
+        assert db.session.execute(
+            db.select(db.func.count()).select_from(model)
+        ).scalar() == 0
+
+
+def test_upvote_anonymous_post(client, user, login):
+    post = Post(None, 'Title', [], '/thumbnail.png', False, [])
+    db.session.add(post)
+    db.session.commit()
+    login()
+
+    assert client.post(f'/api/posts/{post.post_id}/upvote').status_code == 204
+
+    db.session.refresh(post)
+    db.session.refresh(user)
+    assert post.score == 1
+    assert user.score == 0
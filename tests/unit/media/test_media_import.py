@@ -0,0 +1,145 @@
+import json
+import os
+
+from PIL import Image
+
+from app import imports
+from app.extensions import db
+from app.models.post import Flow, MediaObject, Post
+from app.storage import RENDITIONS, THUMBNAILS, get_media_storage
+
+
+def _save_image(path, color='red', size=(640, 480)):
+    Image.new('RGB', size, color).save(path)
+
+
+def _import(app, *args):
+    return app.test_cli_runner().invoke(
+        args=['media', 'import', '--workers', '0', *args]
+    )
+
+
+def test_import_directory(app, tmp_path):
+    archive = tmp_path / 'archive'
+    (archive / 'nested').mkdir(parents=True)
+    _save_image(archive / 'a.jpg', 'red')
+    _save_image(archive / 'nested' / 'b.png', 'blue')
+    _save_image(archive / 'nested' / 'c.png', 'blue')
+    (archive / 'notes.txt').write_text('not an image')
+
+    result = _import(app, str(archive))
+
+    assert 'Done: 3 posts (3 images) imported, 0 skipped' in result.output
+    with app.app_context():
+        posts = db.session.execute(db.select(Post)).scalars().all()
+        assert len(posts) == 3
+        assert not any(post.is_processing or post.is_public for post in posts)
+
+        # the same contents are stored once
+        media_objects = db.session.execute(db.select(MediaObject)).scalars().all()
+        assert sorted(media_object.ref_count for media_object in media_objects) == [1, 2]
+
+        storage = get_media_storage()
+        for media_object in media_objects:
+            assert (media_object.width, media_object.height) == (640, 480)
+            assert media_object.placeholder.startswith('data:image/webp')
+            assert storage.exists(THUMBNAILS, media_object.filename)
+            assert media_object.renditions
+            for rendition in media_object.renditions:
+                assert storage.exists(RENDITIONS, rendition.filename)
+
+    assert os.listdir(app.config['UPLOADS_STAGING_PATH']) == []
+
+
+def test_import_manifest(app, client, user, tmp_path):
+    _save_image(tmp_path / 'a.jpg', 'red')
+    _save_image(tmp_path / 'b.jpg', 'green')
+    manifest = tmp_path / 'manifest.jsonl'
+    manifest.write_text('\n'.join(json.dumps(post) for post in [
+        {
+            'files': ['a.jpg', 'b.jpg'],
+            'title': 'Colors',
+            'descriptions': ['Red'],
+            'flows': ['colors', 'art'],
+        },
+        {'files': ['a.jpg'], 'flows': ['colors']},
+        {'files': ['missing.jpg']},
+        {'files': ['b.jpg'], 'flows': ['not valid!']},
+    ]))
+
+    result = _import(app, str(manifest), '--user', 'testuser1', '--public')
+
+    assert 'Done: 2 posts (3 images) imported, 2 skipped' in result.output
+    assert f'Skipped {manifest}:3' in result.output
+    assert f'Skipped {manifest}:4: invalid flow name' in result.output
+
+    flows = {flow.name: flow.post_count for flow in db.session.execute(
+        db.select(Flow)
+    ).scalars()}
+    assert flows == {'colors': 2, 'art': 1}
+
+    listed_posts = client.get('/api/posts?sort=newest').json
+    assert {post['title'] for post in listed_posts} == {'Colors', None}
+    post_id = next(post['post_id'] for post in listed_posts if post['title'])
+    media = client.get(f'/api/posts/{post_id}').json['media']
+    assert [media_item['description'] for media_item in media] == ['Red', None]
+
+
+def test_import_manifest_skips_unreadable_lines(app, tmp_path):
+    _save_image(tmp_path / 'a.jpg', 'red')
+    manifest = tmp_path / 'manifest.jsonl'
+    manifest.write_text('\n'.join([
+        json.dumps({'files': ['a.jpg']}),
+        '{"files": ["a.jpg"',
+        json.dumps({'title': 'No files'}),
+        json.dumps(['a.jpg']),
+        json.dumps({'files': ['a.jpg'], 'descriptions': ['A' * 2_001]}),
+        json.dumps({'files': ['a.jpg'], 'title': 'Last'}),
+    ]))
+
+    result = _import(app, str(manifest))
+
+    assert 'Done: 2 posts (2 images) imported, 4 skipped' in result.output
+    assert f'Skipped {manifest}:2: invalid JSON' in result.output
+    assert f"Skipped {manifest}:3: missing 'files'" in result.output
+    assert f'Skipped {manifest}:4: invalid entry' in result.output
+    assert f'Skipped {manifest}:5: description too long' in result.output
+    with app.app_context():
+        titles = db.session.execute(db.select(Post.title)).scalars().all()
+    assert sorted(titles, key=str) == ['Last', None]
+
+
+def test_import_deletes_stored_files_if_not_created(app, tmp_path, monkeypatch):
+    archive = tmp_path / 'archive'
+    archive.mkdir()
+    _save_image(archive / 'a.png')
+
+    def import_posts(posts):
+        raise RuntimeError('Lost the database')
+
+    monkeypatch.setattr(imports, 'import_posts', import_posts)
+    result = _import(app, str(archive))
+
+    assert isinstance(result.exception, RuntimeError)
+    for kind in ['MEDIA', 'THUMBNAILS', 'RENDITIONS']:
+        for _, _, filenames in os.walk(app.config[f'UPLOADS_{kind}_PATH']):
+            assert filenames == []
+
+
+def test_import_resumes_from_checkpoint(app, tmp_path):
+    archive = tmp_path / 'archive'
+    archive.mkdir()
+    for index, color in enumerate(['red', 'green', 'blue']):
+        _save_image(archive / f'{index}.png', color, (64, 64))
+    checkpoint = tmp_path / 'progress.json'
+    checkpoint.write_text(json.dumps({'source': str(archive), 'done': 2}))
+
+    result = _import(app, str(archive), '--checkpoint', str(checkpoint))
+
+    assert 'Resuming after 2 entries' in result.output
+    assert 'Done: 1 posts (1 images) imported' in result.output
+    assert json.loads(checkpoint.read_text())['done'] == 3
+
+    # nothing left to import
+    result = _import(app, str(archive), '--checkpoint', str(checkpoint))
+    assert 'Done: 0 posts' in result.output
@@ -0,0 +1,88 @@
+import io
+import os
+
+from PIL import Image
+
+from app.storage import THUMBNAILS, get_media_storage
+
+
+def _store_thumbnail(app, name='0123456789abcdef.png') -> bytes:
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), 'green').save(buffer, 'PNG')
+    staging_path = os.path.join(app.config['UPLOADS_STAGING_PATH'], name)
+    with open(staging_path, 'wb') as file:
+        file.write(buffer.getvalue())
+
+    with app.app_context():
+        get_media_storage().put(THUMBNAILS, name, staging_path)
+    return buffer.getvalue()
+
+
+def test_serve_immutable(app, client):
+    content = _store_thumbnail(app)
+
+    response = client.get('/static/uploads/thumbnails/0123456789abcdef.png')
+
+    assert response.status_code == 200
+    assert response.data == content
+    assert response.cache_control.immutable
+    assert response.cache_control.public
+    assert response.cache_control.max_age == app.config['MEDIA_MAX_AGE']
+    assert not response.cache_control.no_cache
+    assert 'no-cache' not in response.headers['Cache-Control']
+    etag, is_weak = response.get_etag()
+    assert etag == '0123456789abcdef.png' and not is_weak
+
+    response = client.get(
+        '/static/uploads/thumbnails/0123456789abcdef.png',
+        headers={'If-None-Match': f'"{etag}"'},
+    )
+    assert response.status_code == 304
+    assert response.data == b''
+
+
+def test_serve_range(app, client):
+    content = _store_thumbnail(app)
+
+    response = client.get(
+        '/static/uploads/thumbnails/0123456789abcdef.png',
+        headers={'Range': 'bytes=10-19'},
+    )
+
+    assert response.status_code == 206
+    assert response.data == content[10:20]
+    assert response.headers['Content-Range'] == f'bytes 10-19/{len(content)}'
+
+
+def test_serve_missing(app, client):
+    response = client.get('/static/uploads/thumbnails/0123456789abcdef.png')
+
+    assert response.status_code == 404
+
+
+def test_serve_x_accel_redirect(app, client):
+    _store_thumbnail(app)
+    app.config['MEDIA_SENDFILE'] = 'x-accel-redirect'
+    app.config['MEDIA_ACCEL_REDIRECT_PREFIX'] = '/internal'
+
+    response = client.get('/static/uploads/thumbnails/0123456789abcdef.png')
+
+    assert response.status_code == 200
+    assert response.data == b''
+    assert response.headers['X-Accel-Redirect'] == (
+        '/internal/thumbnails/01/23/0123456789abcdef.png'
+    )
+    assert response.mimetype == 'image/png'
+    assert response.cache_control.immutable
+
+
+def test_serve_x_sendfile(app, client):
+    _store_thumbnail(app)
+    app.config['MEDIA_SENDFILE'] = 'x-sendfile'
+
+    response = client.get('/static/uploads/thumbnails/0123456789abcdef.png')
+
+    assert response.data == b''
+    assert response.headers['X-Sendfile'] == os.path.join(
+        app.config['UPLOADS_THUMBNAILS_PATH'], '01', '23', '0123456789abcdef.png'
+    )
@@ -0,0 +1,148 @@
+import io
+import os
+
+from PIL import Image
+
+from app.extensions import db
+from app.models.post import MediaCacheEntry, MediaCacheUsage
+
+
+def _store_image(app, name='original.png', size=(800, 600)) -> str:
+    Image.new('RGB', size, 'green').save(
+        os.path.join(app.config['UPLOADS_MEDIA_PATH'], name)
+    )
+    return name
+
+
+def _cached_names(app) -> set[str]:
+    with app.app_context():
+        return set(db.session.execute(db.select(MediaCacheEntry.filename)).scalars())
+
+
+def test_serve_original(app, client):
+    name = _store_image(app)
+
+    response = client.get(f'/media/{name}')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'image/png'
+
+
+def test_serve_missing(client):
+    assert client.get('/media/missing.png').status_code == 404
+    assert client.get('/media/..%2Fconfig.py').status_code == 404
+
+
+def test_transform_is_cached(app, client):
+    name = _store_image(app)
+
+    response = client.get(f'/media/{name}?w=256&fmt=webp&q=75')
+    assert response.status_code == 200
+    assert response.mimetype == 'image/webp'
+    with Image.open(io.BytesIO(response.data)) as image:
+        assert image.size == (256, 192)
+
+    assert len(_cached_names(app)) == 1
+    cached_path = os.path.join(
+        app.config['MEDIA_CACHE_PATH'], _cached_names(app).pop()
+    )
+    modified_on = os.path.getmtime(cached_path)
+
+    response = client.get(f'/media/{name}?w=256&fmt=webp&q=75')
+    assert response.status_code == 200
+    # served from the cache, not transformed again
+    assert os.path.getmtime(cached_path) == modified_on
+
+
+def test_empty_transform_serves_original(app, client):
+    name = _store_image(app)
+
+    response = client.get(f'/media/{name}?w=&fmt=')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'image/png'
+    assert not os.listdir(app.config['MEDIA_CACHE_PATH'])
+
+
+def test_transform_never_upscales(app, client):
+    name = _store_image(app, size=(100, 50))
+
+    response = client.get(f'/media/{name}?w=2048')
+
+    with Image.open(io.BytesIO(response.data)) as image:
+        assert image.size == (100, 50)
+
+
+def test_transform_rejects_arbitrary_values(app, client):
+    name = _store_image(app)
+
+    assert client.get(f'/media/{name}?w=257').json['error'] == 'invalid_size'
+    assert client.get(f'/media/{name}?h=abc').json['error'] == 'invalid_transform'
+    assert client.get(f'/media/{name}?q=13').json['error'] == 'invalid_quality'
+    assert client.get(f'/media/{name}?fmt=gif').json['error'] == 'invalid_format'
+    assert client.get(f'/media/{name}?v=2').json['error'] == 'invalid_transform'
+    assert not os.listdir(app.config['MEDIA_CACHE_PATH'])
+
+
+def test_cache_evicts_least_recently_used(app, client):
+    name = _store_image(app)
+    client.get(f'/media/{name}?w=64&fmt=png')
+    (oldest,) = _cached_names(app)
+    client.get(f'/media/{name}?w=128&fmt=png')
+    (newest,) = _cached_names(app) - {oldest}
+
+    # just enough room for the newest entry
+    newest_size = os.path.getsize(os.path.join(app.config['MEDIA_CACHE_PATH'], newest))
+    app.config['MEDIA_CACHE_MAX_BYTES'] = newest_size + 1
+    client.get(f'/media/{name}?h=64&fmt=png')
+
+    cached_names = _cached_names(app)
+    assert oldest not in cached_names
+    assert len(cached_names) >= 1
+    assert sorted(os.listdir(app.config['MEDIA_CACHE_PATH'])) == sorted(cached_names)
+
+
+def test_transform_bigger_than_cache_not_kept(app, client):
+    name = _store_image(app)
+    app.config['MEDIA_CACHE_MAX_BYTES'] = 1
+    # not there anymore for the front proxy to send
+    app.config['MEDIA_SENDFILE'] = 'x-accel-redirect'
+
+    response = client.get(f'/media/{name}?w=64&fmt=png')
+    with Image.open(io.BytesIO(response.data)) as image:
+        assert image.width == 64
+    assert 'X-Accel-Redirect' not in response.headers
+    response.close()
+    assert not os.listdir(app.config['MEDIA_CACHE_PATH'])
+
+    response = client.get(
+        f'/media/{name}?w=64&fmt=png', headers={'Range': 'bytes=0-9'}
+    )
+    assert response.status_code == 206
+    assert len(response.data) == 10
+    response.close()
+
+    assert not os.listdir(app.config['MEDIA_CACHE_PATH'])
+    assert not _cached_names(app)
+
+
+def test_cache_usage_kept_up_to_date(app, client):
+    name = _store_image(app)
+    for width in [64, 128, 256]:
+        client.get(f'/media/{name}?w={width}&fmt=png')
+    cache_path = app.config['MEDIA_CACHE_PATH']
+    # room for the biggest entry only
+    app.config['MEDIA_CACHE_MAX_BYTES'] = max(
+        os.path.getsize(os.path.join(cache_path, cached))
+        for cached in os.listdir(cache_path)
+    )
+    client.get(f'/media/{name}?h=64&fmt=png')
+
+    cached_names = os.listdir(cache_path)
+    assert len(cached_names) < 4
+    assert set(cached_names) == _cached_names(app)
+    with app.app_context():
+        usage = db.session.execute(db.select(MediaCacheUsage.size)).scalar_one()
+    assert usage == sum(
+        os.path.getsize(os.path.join(cache_path, cached)) for cached in cached_names
+    )
@@ -0,0 +1,44 @@
+import json
+
+from benchmarks.upload_path import main, run_benchmarks
+
+
+def test_run_benchmarks(tmp_path):
+    results = run_benchmarks(
+        str(tmp_path / 'corpus'),
+        [0.01],
+        ['png'],
+        ['stage', 'read_size'],
+        min_iterations=1,
+        max_iterations=2,
+    )
+
+    assert [result.case for result in results] == [
+        'is_file_allowed', 'stage/0.01mp.png', 'read_size/0.01mp.png'
+    ]
+    for result in results:
+        assert result.iterations == 2
+        assert result.images_per_second > 0
+        assert 0 < result.p50_ms <= result.p99_ms
+        assert result.peak_rss_mib > 0
+    assert results[1].file_size == (tmp_path / 'corpus' / '0.01mp.png').stat().st_size
+
+
+def test_benchmark_regressions(tmp_path):
+    output = tmp_path / 'results.json'
+    args = [
+        '--corpus', str(tmp_path / 'corpus'), '--megapixels', '0.01',
+        '--formats', 'jpg', '--stages', 'read_size', '--max-iterations', '1',
+    ]
+    assert main(args + ['--output', str(output)]) == 0
+
+    baseline = json.loads(output.read_text())
+    assert {result['case'] for result in baseline['results']} == {
+        'is_file_allowed', 'read_size/0.01mp.jpg'
+    }
+
+    # as if it used to be much faster
+    for result in baseline['results']:
+        result['p50_ms'] /= 100
+    output.write_text(json.dumps(baseline))
+    assert main(args + ['--baseline', str(output)]) == 1
@@ -0,0 +1,169 @@
+import threading
+
+from sqlalchemy import event
+
+from app import flow_suggestions
+from app.extensions import db
+from app.flow_suggestions import FlowSuggestions, get_flow_suggestions
+from app.models.post import Flow
+
+
+def _names(suggestions):
+    return [suggestion['name'] for suggestion in suggestions]
+
+
+def test_suggest_most_posts_first(app):
+    suggestions = FlowSuggestions(app, 3, 0)
+    suggestions.load({'cats': 5, 'catalog': 9, 'cars': 7, 'cat': 5, 'dogs': 100})
+
+    assert suggestions.suggest('ca') == [
+        {'name': 'catalog', 'post_count': 9},
+        {'name': 'cars', 'post_count': 7},
+        # then by name
+        {'name': 'cat', 'post_count': 5},
+    ]
+    assert _names(suggestions.suggest('cat')) == ['catalog', 'cat', 'cats']
+    assert _names(suggestions.suggest('cats')) == ['cats']
+    assert suggestions.suggest('catz') == []
+
+
+def test_suggest_ignoring_case(app):
+    suggestions = FlowSuggestions(app, 8, 0)
+    suggestions.load({'Straße': 1, 'ÉCOLE': 2, 'Ünicode-2': 3})
+
+    assert _names(suggestions.suggest('STRASS')) == ['Straße']
+    assert _names(suggestions.suggest('éco')) == ['ÉCOLE']
+    assert _names(suggestions.suggest('üNICODE-')) == ['Ünicode-2']
+
+
+def test_suggestions_follow_post_counts(app):
+    suggestions = FlowSuggestions(app, 2, 0)
+    suggestions.load({'cats': 3, 'cars': 2, 'cake': 1})
+
+    suggestions.add_posts(['cake'], 3)
+    assert _names(suggestions.suggest('c')) == ['cake', 'cats']
+
+    suggestions.add_posts(['cake', 'cats'], -3)
+    assert _names(suggestions.suggest('c')) == ['cars', 'cake']
+
+    # new flows
+    suggestions.add_posts(['cabin', 'cabin', 'cabin'])
+    assert suggestions.suggest('ca') == [
+        {'name': 'cabin', 'post_count': 3},
+        {'name': 'cars', 'post_count': 2},
+    ]
+
+
+def _add_post(suggestions, committed=None, add=None):
+    """Count a post in "cats", as its request would, in the background."""
+    def change():
+        with suggestions.changing_posts():
+            if committed is not None:
+                committed.set()
+                add.wait(5)
+            suggestions.add_posts(['cats'])
+
+    thread = threading.Thread(target=change)
+    thread.start()
+    return thread
+
+
+def test_posts_changed_while_refreshing(app, monkeypatch):
+    suggestions = FlowSuggestions(app, 2, 0)
+    suggestions.load({'cats': 1})
+    reading = threading.Event()
+    read = threading.Event()
+
+    def get_flow_post_counts():
+        reading.set()
+        read.wait(5)
+        # before the post added below was committed
+        return ({'name': 'cats', 'post_count': 1},)
+
+    monkeypatch.setattr(flow_suggestions, 'get_flow_post_counts', get_flow_post_counts)
+    refreshing = threading.Thread(target=suggestions.refresh)
+    refreshing.start()
+    reading.wait(5)
+    adding = _add_post(suggestions)
+
+    # held back until the index is replaced, so it's counted in the new one
+    adding.join(0.1)
+    assert adding.is_alive()
+    read.set()
+    refreshing.join()
+    adding.join()
+
+    assert suggestions.suggest('c') == [{'name': 'cats', 'post_count': 2}]
+
+
+def test_refreshing_while_posts_changed(app, monkeypatch):
+    suggestions = FlowSuggestions(app, 2, 0)
+    suggestions.load({'cats': 1})
+    monkeypatch.setattr(
+        flow_suggestions,
+        'get_flow_post_counts',
+        # after the post added below was committed
+        lambda: ({'name': 'cats', 'post_count': 2},),
+    )
+    committed = threading.Event()
+    add = threading.Event()
+    adding = _add_post(suggestions, committed, add)
+    committed.wait(5)
+
+    refreshing = threading.Thread(target=suggestions.refresh)
+    refreshing.start()
+    # not read until it's counted, so it's not counted again in the new index
+    refreshing.join(0.1)
+    assert refreshing.is_alive()
+    add.set()
+    adding.join()
+    refreshing.join()
+
+    assert suggestions.suggest('c') == [{'name': 'cats', 'post_count': 2}]
+
+
+def test_api_suggestions_without_queries(app, client):
+    with app.app_context():
+        flows = [Flow('cats'), Flow('cars')]
+        flows[1].post_count = 2
+        db.session.add_all(flows)
+        db.session.commit()
+        get_flow_suggestions().refresh()
+
+        statements = []
+        def record_statement(connection, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record_statement)
+        try:
+            response = client.get('/api/flow-suggestions?name=CA')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record_statement)
+
+    assert _names(response.json) == ['cars', 'cats']
+    assert statements == []
+
+
+def test_new_posts_counted(client, login, upload_post, image_bytes):
+    login()
+
+    response = upload_post(image_bytes('red'), is_public='true', flow=['Ñandú', 'cats'])
+    assert response.status_code == 200
+
+    assert client.get('/api/flow-suggestions?name=ña').json == [
+        {'name': 'Ñandú', 'post_count': 1}
+    ]
+
+
+def test_deleted_posts_uncounted(client, login, upload_post, image_bytes):
+    login()
+    upload_post(image_bytes('red'), is_public='true', flow=['cats'])
+    response = upload_post(image_bytes('blue'), is_public='true', flow=['cats'])
+    # loaded before the deletion
+    assert client.get('/api/flow-suggestions?name=ca').json[0]['post_count'] == 2
+
+    client.delete(f"/api/posts/{response.json['post_id']}")
+
+    assert client.get('/api/flow-suggestions?name=ca').json == [
+        {'name': 'cats', 'post_count': 1}
+    ]
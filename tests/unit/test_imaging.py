@@ -0,0 +1,92 @@
+from PIL import Image
+import pytest
+from werkzeug.datastructures import MIMEAccept
+
+from app.imaging import (
+    rendition_widths, process_media, negotiate_rendition_format, srcset,
+    init_rendition_formats,
+)
+
+
+LADDER = (256, 640, 1280, 2048)
+
+
+def test_rendition_widths():
+    assert rendition_widths(3000, LADDER) == [256, 640, 1280, 2048]
+    assert rendition_widths(2048, LADDER) == [256, 640, 1280, 2048]
+    assert rendition_widths(1000, LADDER) == [256, 640, 1000]
+    # smaller than every step
+    assert rendition_widths(100, LADDER) == [100]
+
+
+def test_negotiate_rendition_format():
+    formats = ('avif', 'webp')
+
+    chrome = MIMEAccept([
+        ('text/html', 1), ('image/avif', 1), ('image/webp', 1), ('*/*', 0.8)
+    ])
+    assert negotiate_rendition_format(chrome, formats) == 'avif'
+    only_webp = MIMEAccept([('image/webp', 1), ('*/*', 0.8)])
+    assert negotiate_rendition_format(only_webp, formats) == 'webp'
+    # wildcards don't count
+    assert negotiate_rendition_format(MIMEAccept([('*/*', 1)]), formats) is None
+    refused = MIMEAccept([('image/avif', 0), ('image/webp', 1)])
+    assert negotiate_rendition_format(refused, formats) == 'webp'
+
+
+def test_srcset():
+    renditions = [
+        {'url': '/b.webp', 'width': 640, 'format': 'webp'},
+        {'url': '/a.webp', 'width': 256, 'format': 'webp'},
+        {'url': '/a.avif', 'width': 256, 'format': 'avif'},
+    ]
+
+    assert srcset(renditions, 'webp') == '/a.webp 256w, /b.webp 640w'
+    assert srcset(renditions, 'avif') == '/a.avif 256w'
+    assert srcset(renditions, None) is None
+    assert srcset([], 'webp') is None
+
+
+def test_process_media_drafts_large_jpegs(tmp_path):
+    original_path = str(tmp_path / 'original.jpg')
+    Image.new('RGB', (4000, 3000), 'blue').save(original_path)
+    thumbnail_path = str(tmp_path / 'thumbnail.jpg')
+
+    result = process_media(
+        original_path, thumbnail_path, str(tmp_path), LADDER, ('webp',), 2.0, 10**8
+    )
+
+    sizes = {
+        (rendition['width'], rendition['height'])
+        for rendition in result['renditions']
+    }
+    assert sizes == {(256, 192), (640, 480), (1280, 960), (2048, 1536)}
+    for rendition in result['renditions']:
+        with Image.open(tmp_path / rendition['filename']) as image:
+            assert image.size == (rendition['width'], rendition['height'])
+    with Image.open(thumbnail_path) as thumbnail:
+        assert thumbnail.size == (256, 192)
+
+
+def test_process_media_pixel_limit(tmp_path):
+    original_path = str(tmp_path / 'original.png')
+    Image.new('RGB', (100, 100)).save(original_path)
+
+    with pytest.raises(Image.DecompressionBombError):
+        process_media(
+            original_path, str(tmp_path / 'thumbnail.png'), str(tmp_path),
+            LADDER, ('webp',), 2.0, 100 * 100 - 1
+        )
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['original.png']
+
+
+def test_unencodable_rendition_formats_left_out(app, monkeypatch, caplog):
+    # as with a Pillow built without libavif
+    Image.init()
+    monkeypatch.delitem(Image.SAVE, 'AVIF')
+    app.config['MEDIA_RENDITION_FORMATS'] = ('avif', 'webp')
+
+    init_rendition_formats(app)
+
+    assert app.config['MEDIA_RENDITION_FORMATS'] == ('webp',)
+    assert 'cannot encode avif' in caplog.text
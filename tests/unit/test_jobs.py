@@ -0,0 +1,162 @@
+from datetime import timedelta
+import os
+import threading
+import time
+
+from app.dbapi import claim_media_job
+from app.extensions import db
+from app.jobs import run_pending_media_jobs, start_media_job_workers
+from app.models.post import MediaJob, MediaObject, Post
+from app.storage import MEDIA, THUMBNAILS, get_media_storage
+
+
+def _has_thumbnail(app, post) -> bool:
+    with app.app_context():
+        return get_media_storage().exists(
+            THUMBNAILS, os.path.basename(post['thumbnail_url'])
+        )
+
+
+def test_upload_returns_before_processing(app, upload_post, image_bytes):
+    # as if there were background workers
+    app.config['MEDIA_JOB_WORKERS'] = 2
+
+    post = upload_post(image_bytes('red'), image_bytes('blue')).json
+
+    assert post['is_processing']
+    assert not _has_thumbnail(app, post)
+
+    with app.app_context():
+        durations = run_pending_media_jobs()
+        assert len(durations) == 2
+
+        assert not db.session.execute(
+            db.select(Post.is_processing).where(Post.post_id == post['post_id'])
+        ).scalar_one()
+        assert db.session.execute(db.select(MediaJob)).first() is None
+
+    assert _has_thumbnail(app, post)
+
+
+def test_media_work_command(app, upload_post, image_bytes):
+    # as with BACKGROUND_WORK=0: there are workers, but not in this process
+    app.config['MEDIA_JOB_WORKERS'] = 2
+    post = upload_post(image_bytes('red'), image_bytes('blue')).json
+
+    result = app.test_cli_runner().invoke(args=['media', 'work', '--once'])
+
+    assert '2 media jobs run' in result.output
+    assert _has_thumbnail(app, post)
+    response = app.test_client().get(f"/api/posts/{post['post_id']}")
+    assert not response.json['is_processing']
+
+
+def test_post_processing_until_all_media_processed(app, upload_post, image_bytes):
+    app.config['MEDIA_JOB_WORKERS'] = 2
+    first = upload_post(image_bytes('red')).json
+    # shares the red image, which is still being processed
+    second = upload_post(image_bytes('blue'), image_bytes('red')).json
+
+    assert second['is_processing']
+    with app.app_context():
+        run_pending_media_jobs()
+        processing = db.session.execute(
+            db.select(Post.is_processing).where(
+                Post.post_id.in_((first['post_id'], second['post_id']))
+            )
+        ).scalars().all()
+        assert processing == [False, False]
+
+
+def test_claim_media_job_only_once(app, upload_post, image_bytes):
+    app.config['MEDIA_JOB_WORKERS'] = 2
+    upload_post(image_bytes('red'))
+
+    with app.app_context():
+        stale_after = timedelta(minutes=10)
+        assert claim_media_job(stale_after) is not None
+        assert claim_media_job(stale_after) is None
+        # its worker died
+        assert claim_media_job(timedelta(0)) is not None
+
+
+def test_failed_media_job_gives_up(app, upload_post, image_bytes):
+    app.config['MEDIA_JOB_WORKERS'] = 2
+    app.config['MEDIA_JOB_MAX_ATTEMPTS'] = 2
+    post = upload_post(image_bytes('red')).json
+
+    # corrupted after being stored
+    filename = os.path.basename(post['thumbnail_url'])
+    with app.app_context():
+        media_path = get_media_storage().find(MEDIA, filename)
+    with open(media_path, 'r+b') as file:
+        file.truncate(100)
+
+    with app.app_context():
+        assert run_pending_media_jobs() == {filename.split('.')[0]: None}
+        assert db.session.execute(db.select(MediaJob.status)).scalar() == 'pending'
+
+        run_pending_media_jobs()
+        assert db.session.execute(db.select(MediaJob.status)).scalar() == 'failed'
+        # not stuck as processing, even without renditions
+        media_object = db.session.execute(db.select(MediaObject)).scalar_one()
+        assert not media_object.is_processing
+        assert not db.session.execute(
+            db.select(Post.is_processing).where(Post.post_id == post['post_id'])
+        ).scalar_one()
+
+
+def test_media_job_worker(app, upload_post, image_bytes):
+    app.config['MEDIA_JOB_WORKERS'] = 1
+    app.config['MEDIA_JOB_POLL_INTERVAL'] = 0.01
+    post = upload_post(image_bytes('red')).json
+
+    (worker,) = start_media_job_workers(app)
+    try:
+        deadline = time.monotonic() + 10
+        while not _has_thumbnail(app, post):
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+    finally:
+        worker.stop()
+        worker.join()
+
+
+def test_media_work_command_runs_until_stopped(app, upload_post, image_bytes):
+    app.config['MEDIA_JOB_WORKERS'] = 2
+    app.config['MEDIA_JOB_POLL_INTERVAL'] = 0.01
+    post = upload_post(image_bytes('red')).json
+    results = []
+
+    command = threading.Thread(target=lambda: results.append(
+        app.test_cli_runner().invoke(args=['media', 'work', '--workers', '1'])
+    ))
+    command.start()
+    deadline = time.monotonic() + 10
+    while 'media_job_workers' not in app.extensions:
+        assert command.is_alive() and time.monotonic() < deadline
+        time.sleep(0.01)
+    try:
+        while not _has_thumbnail(app, post):
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+    finally:
+        for worker in app.extensions['media_job_workers']:
+            worker.stop()
+        command.join()
+
+    (result,) = results
+    assert 'Running media jobs with 1 workers' in result.output
+
+
+def test_media_job_workers_start_when_serving(background_app):
+    # not for CLI commands, which never serve requests
+    result = background_app.test_cli_runner().invoke(args=['db', 'upgrade'])
+    assert result.exit_code == 0
+    assert 'media_job_workers' not in background_app.extensions
+
+    background_app.test_client().get('/api/flow-suggestions?name=a')
+    background_app.test_client().get('/api/flow-suggestions?name=b')
+
+    (worker,) = background_app.extensions['media_job_workers']
+    assert worker.is_alive()
@@ -0,0 +1,111 @@
+import re
+
+from sqlalchemy import event
+
+from app import dbapi
+from app.dbapi import CommentSorting, PostSorting
+from app.extensions import db
+from app.models.post import Flow, Post
+from app.schema import upgrade_schema
+
+
+def _full_table_scans(connection, statement, parameters) -> list[str]:
+    """Return the tables the database would read whole to run the given statement."""
+    if connection.dialect.name == 'sqlite':
+        plan = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters)
+        # scans using an index are fine: they read it in order, up to the limit
+        return [
+            match.group(1) for row in plan
+            if (match := re.fullmatch(r'SCAN (\w+)', row.detail))
+        ]
+
+    plan = connection.exec_driver_sql(f'EXPLAIN {statement}', parameters)
+    return [row.table for row in plan if row.type == 'ALL']
+
+
+def _hot_queries(user, flow):
+    """Yield the name, function and arguments of each listing and lookup."""
+    post_id = 'abcdefgh'
+    for sorting in PostSorting:
+        yield (
+            'search', dbapi.search_public_posts_by_page,
+            'some tit', user.id, 0, sorting,
+        )
+        if sorting is PostSorting.RELEVANCE:
+            # only for searches
+            continue
+        yield 'public', dbapi.get_public_posts_by_page, user.id, 0, sorting
+        yield (
+            'user', dbapi.get_public_posts_from_user_by_page,
+            user.id, user.id, 0, sorting,
+        )
+        yield (
+            'flow', dbapi.get_public_posts_in_flow_by_page, flow.id, user.id, 0, sorting
+        )
+    for sorting in CommentSorting:
+        yield 'comments', dbapi.get_post_comments_by_page, post_id, user.id, 0, sorting
+        yield 'replies', dbapi.get_comment_replies, post_id, 1, user.id, sorting
+    yield 'post', dbapi.get_post_and_media, post_id, user.id
+    yield 'post media', dbapi.get_post_media, post_id
+    yield 'flow', dbapi.get_flow, flow.name
+    yield 'flows overview', dbapi.get_flows_overview
+    yield 'user', dbapi.get_user_by_name, user.name
+
+
+def test_hot_queries_use_indexes(user):
+    flow = Flow('flow')
+    db.session.add(flow)
+    db.session.commit()
+
+    statements = []
+    def record_statement(connection, cursor, statement, parameters, *args):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((connection, statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', record_statement)
+    try:
+        for name, query, *arguments in _hot_queries(user, flow):
+            statements.clear()
+            query(*arguments)
+            assert statements, name
+            for connection, statement, parameters in statements:
+                assert _full_table_scans(connection, statement, parameters) == [], (
+                    f'{name}: {statement}'
+                )
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record_statement)
+
+
+def test_upgrade_schema_creates_missing_columns_and_indexes(user):
+    db.session.add(Post(user.id, 'Title', [], '/thumbnail.png', True, []))
+    db.session.commit()
+
+    # as created by an older version
+    with db.engine.begin() as connection:
+        connection.exec_driver_sql('DROP INDEX ix_Post_public_newest')
+        connection.exec_driver_sql('DROP TABLE PostFlow')
+        connection.exec_driver_sql('ALTER TABLE Post DROP COLUMN is_processing')
+        connection.exec_driver_sql('DROP TABLE PostTitleSearch')
+        for trigger in ['insert', 'delete', 'update']:
+            connection.exec_driver_sql(f'DROP TRIGGER PostTitleSearch_{trigger}')
+
+    created = upgrade_schema()
+
+    assert sorted(created) == [
+        'Post.PostTitleSearch',
+        'Post.is_processing',
+        'Post.ix_Post_public_newest',
+        'PostFlow',
+    ]
+    assert db.session.execute(db.select(Post.is_processing)).scalar_one() is False
+    # with the posts already there
+    assert dbapi.search_public_posts_by_page('title', None, 0, PostSorting.NEWEST)[0]
+    # nothing left to do
+    assert upgrade_schema() == []
+
+
+def test_upgrade_command(app):
+    result = app.test_cli_runner().invoke(args=['db', 'upgrade'])
+
+    assert result.exit_code == 0
+    assert 'Already up to date' in result.output
@@ -0,0 +1,173 @@
+import os
+
+import pytest
+
+from app.storage import (
+    MEDIA, THUMBNAILS, LocalMediaStorage, S3MediaStorage, migrate_local_files,
+    shard_path,
+)
+
+
+HASH = 'e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855'
+
+
+class _ClientError(Exception):
+    """Like botocore's ClientError."""
+    def __init__(self, code):
+        super().__init__(code)
+        self.response = {'Error': {'Code': code}}
+
+
+class _FakeS3Client:
+    """An in-memory stand-in for an S3 client (as a MinIO server would be)."""
+    def __init__(self):
+        self.objects = {}
+
+    def upload_file(self, path, bucket, key, ExtraArgs=None):
+        with open(path, 'rb') as file:
+            self.objects[(bucket, key)] = (file.read(), ExtraArgs)
+
+    def download_file(self, bucket, key, path):
+        if (bucket, key) not in self.objects:
+            raise _ClientError('404')
+        with open(path, 'wb') as file:
+            file.write(self.objects[(bucket, key)][0])
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise _ClientError('404')
+        return {}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+
+def _directories(tmp_path) -> dict[str, str]:
+    directories = {MEDIA: str(tmp_path / 'media'), THUMBNAILS: str(tmp_path / 'thumbs')}
+    for directory in directories.values():
+        (tmp_path / directory).mkdir()
+    return directories
+
+
+def test_shard_path():
+    assert shard_path(HASH + '.png') == f'e3/b0/{HASH}.png'
+    assert shard_path(HASH + '-256w.webp') == f'e3/b0/{HASH}-256w.webp'
+
+
+def test_local_storage(tmp_path):
+    storage = LocalMediaStorage(_directories(tmp_path))
+    staged = tmp_path / 'staged'
+    staged.write_bytes(b'contents')
+
+    storage.put(MEDIA, HASH + '.png', str(staged))
+
+    assert not staged.exists()
+    assert (tmp_path / 'media' / 'e3' / 'b0' / f'{HASH}.png').read_bytes() == b'contents'
+    assert storage.exists(MEDIA, HASH + '.png')
+    assert not storage.exists(THUMBNAILS, HASH + '.png')
+    with storage.local_copy(MEDIA, HASH + '.png') as path:
+        assert open(path, 'rb').read() == b'contents'
+
+    storage.delete(MEDIA, HASH + '.png')
+    assert not storage.exists(MEDIA, HASH + '.png')
+
+
+def test_local_storage_finds_unsharded_files(tmp_path):
+    storage = LocalMediaStorage(_directories(tmp_path))
+    (tmp_path / 'media' / 'legacy-photo.jpg').write_bytes(b'contents')
+
+    assert storage.find(MEDIA, 'legacy-photo.jpg') == str(
+        tmp_path / 'media' / 'legacy-photo.jpg'
+    )
+    storage.delete(MEDIA, 'legacy-photo.jpg')
+    assert not storage.exists(MEDIA, 'legacy-photo.jpg')
+
+
+def test_local_storage_rejects_paths(tmp_path):
+    storage = LocalMediaStorage(_directories(tmp_path))
+    (tmp_path / 'secret.txt').write_bytes(b'secret')
+
+    for filename in ('../secret.txt', '..', '.hidden', 'a/b.png', ''):
+        assert not storage.exists(MEDIA, filename)
+        with pytest.raises(FileNotFoundError):
+            storage.find(MEDIA, filename)
+
+
+def test_s3_storage(tmp_path):
+    client = _FakeS3Client()
+    storage = S3MediaStorage(
+        'uploads', 'https://cdn.example.com/', str(tmp_path), client=client
+    )
+    staged = tmp_path / 'staged'
+    staged.write_bytes(b'contents')
+
+    storage.put(MEDIA, HASH + '.png', str(staged))
+
+    assert not staged.exists()
+    contents, extra_args = client.objects[('uploads', f'media/e3/b0/{HASH}.png')]
+    assert contents == b'contents'
+    assert extra_args['ContentType'] == 'image/png'
+    assert storage.url(MEDIA, HASH + '.png') == (
+        f'https://cdn.example.com/media/e3/b0/{HASH}.png'
+    )
+    assert storage.exists(MEDIA, HASH + '.png')
+    with storage.local_copy(MEDIA, HASH + '.png') as path:
+        assert open(path, 'rb').read() == b'contents'
+    # the local copy is temporary
+    assert list(tmp_path.iterdir()) == []
+
+    storage.delete(MEDIA, HASH + '.png')
+    assert not storage.exists(MEDIA, HASH + '.png')
+    with pytest.raises(FileNotFoundError):
+        with storage.local_copy(MEDIA, HASH + '.png'):
+            pass
+
+
+def test_migrate_local_files(tmp_path):
+    directories = _directories(tmp_path)
+    storage = LocalMediaStorage(directories)
+    names = [f'{index:02x}{HASH[2:]}.png' for index in range(50)]
+    for name in names:
+        (tmp_path / 'media' / name).write_bytes(name.encode())
+        (tmp_path / 'thumbs' / name).write_bytes(name.encode())
+
+    progress = []
+    moved = migrate_local_files(
+        storage, directories, workers=4, on_progress=progress.append, batch_size=16
+    )
+
+    assert moved == 100
+    assert progress[-1] == 100
+    for name in names:
+        assert storage.path(MEDIA, name) == storage.find(MEDIA, name)
+        assert open(storage.find(THUMBNAILS, name), 'rb').read() == name.encode()
+
+    # already sharded
+    assert migrate_local_files(storage, directories, workers=4) == 0
+
+
+def test_migrate_local_files_to_s3(tmp_path):
+    directories = _directories(tmp_path)
+    staging = tmp_path / 'staging'
+    staging.mkdir()
+    storage = S3MediaStorage('uploads', 'https://cdn', str(staging), client=_FakeS3Client())
+    sharded_name = 'ff' + HASH[2:] + '.png'
+    (tmp_path / 'media' / f'{HASH}.png').write_bytes(b'unsharded')
+    (tmp_path / 'media' / 'ff' / HASH[2:4]).mkdir(parents=True)
+    (tmp_path / 'media' / 'ff' / HASH[2:4] / sharded_name).write_bytes(b'sharded')
+
+    assert migrate_local_files(storage, directories, workers=2) == 2
+    assert storage.exists(MEDIA, f'{HASH}.png')
+    assert storage.exists(MEDIA, sharded_name)
+
+
+def test_reshard_command(app):
+    media_path = app.config['UPLOADS_MEDIA_PATH']
+    with open(os.path.join(media_path, f'{HASH}.png'), 'wb') as file:
+        file.write(b'contents')
+
+    result = app.test_cli_runner().invoke(args=['media', 'reshard'])
+
+    assert 'Done: 1 files moved' in result.output
+    with open(os.path.join(media_path, 'e3', 'b0', f'{HASH}.png'), 'rb') as file:
+        assert file.read() == b'contents'
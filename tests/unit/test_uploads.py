@@ -0,0 +1,125 @@
+import hashlib
+import io
+import os
+
+import pytest
+from werkzeug.exceptions import ClientDisconnected
+
+from app.uploads import (
+    FileTooLarge, ImageTooLarge, LimitedUploadFile, create_upload_file,
+    sniff_image_format, stage_upload, write_upload_chunk, UPLOAD_CHUNK_SIZE
+)
+
+
+def test_sniff_image_format(image_bytes):
+    assert sniff_image_format(image_bytes(size=(64, 48), image_format='PNG')) == 'png'
+    assert sniff_image_format(image_bytes(size=(64, 48), image_format='JPEG')) == 'jpg'
+    assert sniff_image_format(image_bytes(size=(64, 48), image_format='WEBP')) == 'webp'
+    assert sniff_image_format(image_bytes(size=(64, 48), image_format='GIF')) is None
+    assert sniff_image_format(b'RIFF\x00\x00\x00\x00WAVEfmt ') is None
+    assert sniff_image_format(b'') is None
+
+
+def test_stage_upload(tmp_path, image_bytes):
+    # bigger than a single chunk
+    content = image_bytes(size=(1024, 1024), image_format='PNG')
+    assert len(content) > UPLOAD_CHUNK_SIZE
+
+    staged = stage_upload(io.BytesIO(content), str(tmp_path))
+
+    assert staged
+    assert staged.extension == 'png'
+    assert staged.size == len(content)
+    assert staged.content_hash == hashlib.sha256(content).hexdigest()
+    assert staged.filename == staged.content_hash + '.png'
+    with open(staged.path, 'rb') as file:
+        assert file.read() == content
+
+
+def test_stage_parsed_upload_without_copying(tmp_path, image_bytes):
+    content = image_bytes(size=(1024, 1024), image_format='PNG')
+    upload_file = create_upload_file(str(tmp_path), len(content), 1024 * 1024)
+    # as the request is parsed
+    for offset in range(0, len(content), 1000):
+        upload_file.write(content[offset:offset + 1000])
+
+    staged = stage_upload(upload_file, str(tmp_path))
+
+    assert staged.filename == hashlib.sha256(content).hexdigest() + '.png'
+    assert staged.size == len(content)
+    # the same file: written once
+    assert os.path.samefile(staged.path, upload_file.name)
+
+    # as the request ends
+    upload_file.close()
+    assert [path.name for path in tmp_path.iterdir()] == [
+        os.path.basename(staged.path)
+    ]
+    with open(staged.path, 'rb') as file:
+        assert file.read() == content
+
+
+def test_stage_upload_same_contents_same_name(tmp_path, image_bytes):
+    content = image_bytes(size=(64, 48), image_format='JPEG')
+
+    first = stage_upload(io.BytesIO(content), str(tmp_path))
+    second = stage_upload(io.BytesIO(content), str(tmp_path))
+
+    assert first.filename == second.filename
+    # staged separately, so concurrent uploads don't step on each other
+    assert first.path != second.path
+
+
+def test_stage_upload_rejects_unsupported_format(tmp_path):
+    # named like an image, but it isn't one
+    staged = stage_upload(io.BytesIO(b'<html></html>' * 100), str(tmp_path))
+
+    assert staged is None
+    assert not any(tmp_path.iterdir())
+
+
+class _DroppedStream(io.BytesIO):
+    """A request stream whose client disconnects after sending `length` bytes."""
+    def __init__(self, content: bytes, length: int):
+        super().__init__(content[:length])
+
+    def read(self, size=-1):
+        chunk = super().read(size)
+        if not chunk:
+            raise ClientDisconnected()
+        return chunk
+
+
+def test_write_upload_chunk_keeps_what_arrived(tmp_path):
+    path = tmp_path / 'upload'
+    path.write_bytes(b'first' + b'leftovers')
+    chunk = os.urandom(UPLOAD_CHUNK_SIZE * 2)
+
+    written, is_complete = write_upload_chunk(
+        _DroppedStream(chunk, 100_000), str(path), 5, len(chunk)
+    )
+
+    assert (written, is_complete) == (100_000, False)
+    assert path.read_bytes() == b'first' + chunk[:100_000]
+
+
+def test_limited_upload_file_rejects_early(image_bytes):
+    content = image_bytes(size=(640, 480), image_format='PNG')
+
+    # the header says it's too big: rejected before the rest of it arrives
+    written = io.BytesIO()
+    limited = LimitedUploadFile(written, len(content), 640 * 480 - 1)
+    with pytest.raises(ImageTooLarge):
+        for offset in range(0, len(content), 1024):
+            limited.write(content[offset:offset + 1024])
+    assert len(written.getvalue()) < 64 * 1024
+
+    limited = LimitedUploadFile(io.BytesIO(), len(content) - 1, 640 * 480)
+    with pytest.raises(FileTooLarge):
+        limited.write(content)
+
+    written = io.BytesIO()
+    limited = LimitedUploadFile(written, len(content), 640 * 480)
+    limited.write(content)
+    limited.seek(0)
+    assert limited.read() == content
@@ -0,0 +1,105 @@
+import time
+
+import pytest
+from sqlalchemy import event
+
+from app.extensions import db
+from app.models.post import Post
+from app.view_counts import ViewCounter
+
+
+def _stored_views(post_id) -> int:
+    db.session.expire_all()
+    return db.session.execute(
+        db.select(Post.views).where(Post.post_id == post_id)
+    ).scalar_one()
+
+
+def _view(client, post_id) -> str:
+    response = client.get(f'/posts/{post_id}')
+    assert response.status_code == 200
+    return response.get_data(as_text=True)
+
+
+def test_views_written_right_away(client, add_posts):
+    (post_id,) = add_posts(1)
+
+    _view(client, post_id)
+    assert '2 views' in _view(client, post_id)
+
+    assert _stored_views(post_id) == 2
+
+
+def test_views_written_in_batches(app, client, add_posts):
+    post_ids = add_posts(2)
+    counter = app.extensions['view_counter'] = ViewCounter(app, 60, 1000)
+
+    statements = []
+    def record_statement(connection, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record_statement)
+    try:
+        for _ in range(3):
+            page = _view(client, post_ids[0])
+        _view(client, post_ids[1])
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record_statement)
+
+    # shown, but not written yet
+    assert '3 views' in page
+    assert not [statement for statement in statements if 'UPDATE' in statement]
+    assert _stored_views(post_ids[0]) == 0
+
+    assert counter.flush() == 2
+    assert [_stored_views(post_id) for post_id in post_ids] == [3, 1]
+    assert counter.flush() == 0
+
+
+def test_views_kept_if_not_written(app, client, add_posts):
+    (post_id,) = add_posts(1)
+    counter = app.extensions['view_counter'] = ViewCounter(app, 60, 1000)
+    _view(client, post_id)
+
+    def fail(*args):
+        raise RuntimeError('database is locked')
+
+    event.listen(db.engine, 'before_cursor_execute', fail)
+    try:
+        with pytest.raises(RuntimeError):
+            counter.flush()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', fail)
+
+    assert counter.pending(post_id) == 1
+    counter.flush()
+    assert _stored_views(post_id) == 1
+
+
+def test_views_written_when_too_many_pending(app, client, add_posts):
+    post_ids = add_posts(3)
+    counter = app.extensions['view_counter'] = ViewCounter(app, 60, 3)
+    counter.start()
+    try:
+        for post_id in post_ids:
+            _view(client, post_id)
+
+        deadline = time.monotonic() + 5
+        while counter.pending(post_ids[0]) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert counter.pending(post_ids[0]) == 0
+    finally:
+        counter.stop()
+
+    assert [_stored_views(post_id) for post_id in post_ids] == [1, 1, 1]
+
+
+def test_views_written_on_stop(app, client, add_posts):
+    (post_id,) = add_posts(1)
+    counter = app.extensions['view_counter'] = ViewCounter(app, 60, 1000)
+    counter.start()
+    _view(client, post_id)
+
+    counter.stop()
+
+    assert _stored_views(post_id) == 1